@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+# Benchmark for the driver's result bookkeeping
+
+# This file is part of SimpleTuner
+
+# Copyright (C) 2021-2023 Embecosm <www.embecosm.com>
+# Contributor Maxim Blinov <maxim.blinov@embecosm.com>
+
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Runs Combined Elimination against a synthetic configuration, without
+# any workers: every job is answered straight away with a made-up
+# score. What's left is the time the driver itself spends per result,
+# which for big configurations is what keeps the workers waiting.
+
+import os, sys, time, random;
+import logging;
+import argparse;
+from tempfile import TemporaryDirectory;
+
+from flag import Flag;
+from config import Config;
+from config import create_cmd_parts;
+from config import create_cmd_from_parts;
+from strategy.CombinedElimination import CombinedElimination;
+from simpletuner import write_leaderboard_entry;
+
+parser = argparse.ArgumentParser(description='Benchmark the Combined Elimination driver on synthetic results.');
+
+parser.add_argument("--flags", type=int, default=1000,
+                    help="Number of flags in the synthetic configuration (default: 1000).");
+
+parser.add_argument("--states", type=int, default=101,
+                    help="Number of states per flag (default: 101, which with"
+                    " the default --flags gives 100000 state variations).");
+
+parser.add_argument("--iterations", type=int, default=3,
+                    help="Number of iterations to run (default: 3).");
+
+parser.add_argument("--max-promotions", type=int, default=1,
+                    help="Passed on to Combined Elimination (default: 1).");
+
+parser.add_argument("--streaming", action="store_true",
+                    help="Run Combined Elimination in streaming mode.");
+
+parser.add_argument("--streaming-quorum", type=float, default=0.5,
+                    help="Passed on to Combined Elimination (default: 0.5).");
+
+parser.add_argument("--surrogate-top-k", type=int, default=None,
+                    help="Passed on to Combined Elimination (default: none).");
+
+parser.add_argument("--seed", type=int, default=0,
+                    help="Seed for the synthetic scores.");
+
+args = parser.parse_args();
+
+def main():
+    logging.basicConfig(format="[%(levelname)s] %(name)s: %(message)s");
+    logging.root.setLevel(logging.WARNING);
+    logger = logging.getLogger("bench-driver.py");
+    logger.setLevel(logging.INFO);
+
+    random.seed(args.seed);
+
+    flags = [Flag("flag-{}".format(i),
+                  ["--param=flag-{}={}".format(i, j) for j in range(args.states)])
+             for i in range(args.flags)];
+    config = Config("-O2", flags);
+    flag_values = config.get_flag_values();
+
+    logger.info("Synthetic configuration: {} flags, {} state variations"\
+                .format(args.flags, args.flags * (args.states - 1)));
+
+    workspace = TemporaryDirectory();
+    f_leaderboard = open(os.devnull, "w");
+
+    ce = CombinedElimination(config, workspace.name,
+                             streaming=args.streaming,
+                             streaming_quorum=args.streaming_quorum,
+                             max_promotions=args.max_promotions,
+                             surrogate_top_k=args.surrogate_top_k);
+
+    iteration_parts = {};
+    n_results = 0;
+    start = time.perf_counter();
+    iteration_start = start;
+    iteration_results = 0;
+
+    while not ce.done and ce.n_iterations < args.iterations:
+        n_iterations = ce.n_iterations;
+
+        if n_iterations not in iteration_parts:
+            iteration_parts[n_iterations] = create_cmd_parts(flag_values, ce.config.get_states());
+
+        # Answer a worker pool's worth of jobs at a time, the same way
+        # the real driver would see them.
+        for iteration, variation, mode in ce.propose(64):
+            score = random.gauss(1e6, 1e3) if len(variation) > 0 else 1e6;
+
+            job_flags = create_cmd_from_parts(config.base_opt, flag_values,
+                                              iteration_parts[iteration], variation);
+            write_leaderboard_entry(f_leaderboard, job_flags, score);
+
+            ce.observe(iteration, variation, mode, score, 0.0, hash(tuple(job_flags)));
+            n_results += 1;
+            iteration_results += 1;
+
+        if ce.n_iterations != n_iterations or ce.done:
+            now = time.perf_counter();
+            logger.info("Iteration {}: {} results in {:.3f}s ({:.1f} us/result)"\
+                        .format(n_iterations, iteration_results, now - iteration_start,
+                                1e6 * (now - iteration_start) / iteration_results));
+            iteration_start = now;
+            iteration_results = 0;
+
+    elapsed = time.perf_counter() - start;
+    logger.info("Total: {} results in {:.3f}s ({:.1f} us/result)"\
+                .format(n_results, elapsed, 1e6 * elapsed / max(n_results, 1)));
+
+    f_leaderboard.close();
+    workspace.cleanup();
+
+if __name__ == "__main__":
+    main();
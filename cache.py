@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+
+# Persistent result cache
+
+# This file is part of SimpleTuner
+
+# Copyright (C) 2021-2023 Embecosm <www.embecosm.com>
+# Contributor Maxim Blinov <maxim.blinov@embecosm.com>
+
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os, time;
+import sqlite3;
+import logging;
+
+# On-disk cache of results, shared between runs (and between
+# simpletuner.py and minimize-flags.py).
+#
+# It holds three mappings:
+#  - binary checksum -> score (and its error, see measurement.py), for
+#    a given compiler, worker context and benchmark type. This saves
+#    benchmarking binaries that some earlier run already measured.
+#  - command line -> binary checksum, for a given compiler and worker
+#    context. Together with the above, this saves compiling at all.
+#  - fingerprint of a command line (see `GCCDriver.get_fingerprint`)
+#    -> binary checksum, for a given compiler and worker context. This
+#    does the same for command lines that differ, but only in ways
+#    that make no difference.
+#
+# The last two aren't keyed by the benchmark type, so they rely on a
+# worker context building the same binary from the same flags whatever
+# its `benchmark_type`, which is how all of the ones in context/ work.
+# A context whose build does depend on it has to be given a name per
+# benchmark type (`context`), or run with --no-cache.
+#
+# Every entry records when it was last used, and once a table grows
+# past `max_entries`, the least recently used entries are evicted.
+#
+# The database is opened lazily by whichever process first uses it, so
+# that a ResultCache can be handed to worker processes.
+class ResultCache:
+    SCHEMA = [
+        """
+        CREATE TABLE IF NOT EXISTS scores (
+            compiler TEXT NOT NULL,
+            context TEXT NOT NULL,
+            benchmark TEXT NOT NULL,
+            checksum TEXT NOT NULL,
+            score REAL NOT NULL,
+            last_used REAL NOT NULL,
+            error REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (compiler, context, benchmark, checksum)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS binaries (
+            compiler TEXT NOT NULL,
+            context TEXT NOT NULL,
+            flags TEXT NOT NULL,
+            checksum TEXT NOT NULL,
+            last_used REAL NOT NULL,
+            PRIMARY KEY (compiler, context, flags)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS fingerprints (
+            compiler TEXT NOT NULL,
+            context TEXT NOT NULL,
+            fingerprint TEXT NOT NULL,
+            checksum TEXT NOT NULL,
+            last_used REAL NOT NULL,
+            PRIMARY KEY (compiler, context, fingerprint)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS scores_last_used ON scores (last_used)",
+        "CREATE INDEX IF NOT EXISTS binaries_last_used ON binaries (last_used)",
+        "CREATE INDEX IF NOT EXISTS fingerprints_last_used ON fingerprints (last_used)",
+    ];
+
+    def __init__(self, path, compiler, context, benchmark, max_entries=1000000):
+        self.logger = logging.getLogger("ResultCache");
+
+        self.path = path;
+        self.compiler = compiler;
+        self.context = context;
+        self.benchmark = benchmark;
+        self.max_entries = max_entries;
+
+        self.connection = None;
+        self.pid = None;
+
+    def connect(self):
+        # Never use a connection that was opened by another process.
+        if self.connection is not None and self.pid == os.getpid():
+            return self.connection;
+
+        self.connection = sqlite3.connect(self.path, timeout=60, isolation_level=None);
+        self.pid = os.getpid();
+
+        # Many workers read and write at once.
+        self.connection.execute("PRAGMA journal_mode=WAL");
+
+        for statement in self.SCHEMA:
+            self.connection.execute(statement);
+
+        # Caches from before scores had errors take them to be exact.
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(scores)")];
+        if "error" not in columns:
+            self.connection.execute("ALTER TABLE scores ADD COLUMN error REAL NOT NULL DEFAULT 0");
+
+        return self.connection;
+
+    # Return `(score, error)`, or `None` if there is no score for
+    # `checksum`.
+    def get_score(self, checksum):
+        db = self.connect();
+
+        row = db.execute("SELECT score, error FROM scores"
+                         " WHERE compiler = ? AND context = ? AND benchmark = ? AND checksum = ?",
+                         (self.compiler, self.context, self.benchmark, checksum)).fetchone();
+        if row is None:
+            return None;
+
+        db.execute("UPDATE scores SET last_used = ?"
+                   " WHERE compiler = ? AND context = ? AND benchmark = ? AND checksum = ?",
+                   (time.time(), self.compiler, self.context, self.benchmark, checksum));
+
+        return (row[0], row[1]);
+
+    def put_score(self, checksum, score, error=0.0):
+        self.connect().execute("INSERT OR REPLACE INTO scores"
+                               " (compiler, context, benchmark, checksum, score, last_used, error)"
+                               " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                               (self.compiler, self.context, self.benchmark,
+                                checksum, score, time.time(), error));
+
+    def get_checksum(self, flags):
+        db = self.connect();
+        flags_str = " ".join(flags);
+
+        row = db.execute("SELECT checksum FROM binaries"
+                         " WHERE compiler = ? AND context = ? AND flags = ?",
+                         (self.compiler, self.context, flags_str)).fetchone();
+        if row is None:
+            return None;
+
+        db.execute("UPDATE binaries SET last_used = ?"
+                   " WHERE compiler = ? AND context = ? AND flags = ?",
+                   (time.time(), self.compiler, self.context, flags_str));
+
+        return row[0];
+
+    def put_checksum(self, flags, checksum):
+        self.connect().execute("INSERT OR REPLACE INTO binaries VALUES (?, ?, ?, ?, ?)",
+                               (self.compiler, self.context, " ".join(flags),
+                                checksum, time.time()));
+
+    def get_fingerprint_checksum(self, fingerprint):
+        db = self.connect();
+
+        row = db.execute("SELECT checksum FROM fingerprints"
+                         " WHERE compiler = ? AND context = ? AND fingerprint = ?",
+                         (self.compiler, self.context, fingerprint)).fetchone();
+        if row is None:
+            return None;
+
+        db.execute("UPDATE fingerprints SET last_used = ?"
+                   " WHERE compiler = ? AND context = ? AND fingerprint = ?",
+                   (time.time(), self.compiler, self.context, fingerprint));
+
+        return row[0];
+
+    def put_fingerprint_checksum(self, fingerprint, checksum):
+        self.connect().execute("INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?, ?)",
+                               (self.compiler, self.context, fingerprint,
+                                checksum, time.time()));
+
+    # Drop the least recently used entries of each table, so that
+    # none holds more than `max_entries`.
+    def evict(self):
+        db = self.connect();
+
+        for table in ["scores", "binaries", "fingerprints"]:
+            n_entries = db.execute("SELECT COUNT(*) FROM {}".format(table)).fetchone()[0];
+            n_evict = n_entries - self.max_entries;
+
+            if n_evict <= 0:
+                continue;
+
+            self.logger.info("Evicting {} of {} entries from \"{}\""\
+                             .format(n_evict, n_entries, table));
+
+            db.execute("DELETE FROM {} WHERE rowid IN"
+                       " (SELECT rowid FROM {} ORDER BY last_used ASC LIMIT ?)"\
+                       .format(table, table), (n_evict,));
+
+    def close(self):
+        if self.connection is not None and self.pid == os.getpid():
+            self.connection.close();
+
+        self.connection = None;
+        self.pid = None;
@@ -9,7 +9,25 @@
 
 # SPDX-License-Identifier: GPL-3.0-or-later
 
-import hashlib;
+import os, re, sys, time, signal, shutil, hashlib, tempfile, threading, subprocess;
+import logging;
+
+# What a worker is to do with a job `(iteration, variation, mode)`:
+#
+#   JOB_BENCHMARK: Score the binary, reusing any result we have for it.
+#   JOB_REMEASURE: Score the binary, even if we have a result for it.
+#   JOB_COMPILE:   Only build the binary, and report its checksum.
+#   JOB_CHEAP:     Score the binary with the worker context's
+#                  `benchmark_cheap`. Cheap scores are kept apart from
+#                  real ones, and never make it into any leaderboard.
+#   JOB_PROBE:     Only build the binary, like JOB_COMPILE, on behalf of
+#                  the driver's conflict table (see conflicts.py)
+#                  rather than the search.
+JOB_BENCHMARK = "benchmark";
+JOB_REMEASURE = "remeasure";
+JOB_COMPILE = "compile";
+JOB_CHEAP = "cheap";
+JOB_PROBE = "probe";
 
 class CompileRequest:
     def __init__(self):
@@ -35,3 +53,351 @@ def file_as_blockiter(afile, blocksize=65536):
 
 def get_checksum_for_filename(filename):
     return hash_bytestr_iter(file_as_blockiter(open(filename, 'rb')), hashlib.sha256());
+
+# Return a string identifying the C compiler `cc`: If any of its path,
+# size, modification time or contents change, so does its identity.
+def get_compiler_identity(cc):
+    path = shutil.which(cc);
+    if path is None:
+        path = cc;
+
+    path = os.path.realpath(path);
+    stat = os.stat(path);
+
+    identity = "{}:{}:{}:{}".format(path, stat.st_size, stat.st_mtime_ns,
+                                    get_checksum_for_filename(path));
+
+    return hashlib.sha256(identity.encode("utf-8")).hexdigest();
+
+# How a benchmark process went, as reported by wait4().
+class ProcessUsage:
+    def __init__(self, returncode, timed_out, wall_time, rusage):
+        self.returncode = returncode;
+        self.timed_out = timed_out;
+
+        # Seconds, from just before starting the process until it exited.
+        self.wall_time = wall_time;
+
+        # Seconds of CPU time the process spent in user space and in the kernel.
+        self.user_time = rusage.ru_utime;
+        self.sys_time = rusage.ru_stime;
+        self.cpu_time = rusage.ru_utime + rusage.ru_stime;
+
+        # Peak resident set size, in kilobytes.
+        self.max_rss = rusage.ru_maxrss;
+
+        self.context_switches = rusage.ru_nvcsw + rusage.ru_nivcsw;
+
+# Run `cmd` in `cwd`, throwing away its output, and return its
+# `ProcessUsage`. If it takes longer than `timeout` seconds, it is
+# killed. If `cpus` is given, the process is pinned to that set of CPUs.
+def run_with_rusage(cmd, cwd, timeout=None, cpus=None):
+    preexec_fn = None;
+    if cpus is not None:
+        preexec_fn = lambda: os.sched_setaffinity(0, cpus);
+
+    start = time.perf_counter();
+
+    process = subprocess.Popen(cmd, cwd=cwd,
+                               stdin=subprocess.DEVNULL,
+                               stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL,
+                               preexec_fn=preexec_fn);
+
+    # Once the process is reaped, its pid may be reused, so the timer
+    # must not kill it any more: `done` says it's too late, under `lock`.
+    lock = threading.Lock();
+    done = False;
+    killed = False;
+
+    def kill():
+        nonlocal killed;
+
+        with lock:
+            if done:
+                return;
+
+            killed = True;
+            process.kill();
+
+    timer = None;
+    if timeout is not None:
+        timer = threading.Timer(timeout, kill);
+        timer.start();
+
+    # Wait for the process to exit, but leave it to be reaped, so that
+    # a kill that gets in first only hits the zombie...
+    os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT);
+    end = time.perf_counter();
+
+    with lock:
+        done = True;
+
+    if timer is not None:
+        timer.cancel();
+
+    # ...and then reap it ourselves: Popen.wait() doesn't give us its
+    # rusage.
+    _, status, rusage = os.wait4(process.pid, 0);
+    process.returncode = os.waitstatus_to_exitcode(status);
+
+    # A process that exited by itself just before it would have been
+    # killed didn't time out.
+    timed_out = killed and process.returncode == -signal.SIGKILL;
+
+    return ProcessUsage(process.returncode, timed_out, end - start, rusage);
+
+# Return the set of CPUs that worker `idx` should run its benchmarks
+# on, or `None` if they can run anywhere.
+#
+# Set SIMPLETUNER_BENCHMARK_CPUS to a comma-separated list of CPUs
+# (e.g. "4,5,6,7") that nothing else runs on, and each worker pins its
+# benchmarks to one of them, in turn.
+def get_benchmark_cpus(idx):
+    if "SIMPLETUNER_BENCHMARK_CPUS" not in os.environ:
+        return None;
+
+    cpus = [int(cpu) for cpu in os.environ["SIMPLETUNER_BENCHMARK_CPUS"].split(",")
+            if len(cpu.strip()) > 0];
+
+    if len(cpus) == 0:
+        return None;
+
+    return {cpus[idx % len(cpus)]};
+
+# Content-addressed cache of object files, like ccache, shared between
+# workers and runs.
+#
+# An object is looked up by the compiler's identity, the hash of the
+# preprocessed source and the flags it was compiled with, less the
+# preprocessor-only ones, whose effect is already in the preprocessed
+# source. Variations that don't change a translation unit's flags, or
+# whose flags only affect other translation units, then reuse its
+# object instead of compiling it again. Preprocessing is much cheaper
+# than compiling.
+#
+# Worker contexts build in workspaces of their own, so absolute paths
+# into the workspace (e.g. of a source directory that configure was
+# given) make the same translation unit look different in every
+# worker and run. With a `workspace`, it is cut out of the line markers
+# of the preprocessed source, and out of the flags, before hashing.
+#
+# Objects are stored as `<directory>/<key[:2]>/<key[2:]>.o`, written
+# to a temporary file first and renamed into place, so that any number
+# of processes can share a directory.
+class ObjectCache:
+    # Options that only affect preprocessing, and that take a value,
+    # either joined or as the next argument.
+    PREPROCESSOR_OPTIONS = ["-D", "-U", "-I", "-isystem", "-iquote", "-idirafter",
+                            "-include", "-imacros"];
+
+    def __init__(self, directory, cc, workspace=None):
+        self.logger = logging.getLogger("ObjectCache");
+
+        self.directory = directory;
+        self.cc = cc;
+
+        # The workspace as it may appear in paths: as given, and with
+        # any symbolic links (e.g. to a tmpfs) resolved.
+        self.workspace_prefixes = [];
+        if workspace is not None:
+            self.workspace_prefixes = sorted(set([os.path.abspath(workspace), os.path.realpath(workspace)]),
+                                             key=len, reverse=True);
+
+        # Hashing the compiler takes a while, so only do it when the
+        # cache is first used.
+        self.compiler_identity = None;
+
+        self.n_hits = 0;
+        self.n_misses = 0;
+
+    # Return `flags` without the preprocessor-only options.
+    def normalise_flags(self, flags):
+        normalised = [];
+
+        skip = False;
+        for flag in flags:
+            if skip:
+                skip = False;
+                continue;
+
+            if flag in self.PREPROCESSOR_OPTIONS:
+                skip = True;
+                continue;
+
+            if any([flag.startswith(option) for option in self.PREPROCESSOR_OPTIONS]):
+                continue;
+
+            normalised.append(flag);
+
+        return normalised;
+
+    # Return the preprocessed source `preprocessed` (bytes) with the
+    # workspace cut out of the paths in its line markers (`# 12
+    # "/path/to/file.h" 2`).
+    def strip_workspace(self, preprocessed):
+        for prefix in self.workspace_prefixes:
+            preprocessed = re.sub(rb'^(# [0-9]+ ")' + re.escape(prefix.encode("utf-8")), rb"\1",
+                                  preprocessed, flags=re.MULTILINE);
+
+        return preprocessed;
+
+    # Return `flags` with the workspace cut out of them.
+    def strip_workspace_from_flags(self, flags):
+        for prefix in self.workspace_prefixes:
+            flags = [flag.replace(prefix, "") for flag in flags];
+
+        return flags;
+
+    # Return the key of the object `source` compiles to with `flags`,
+    # or `None` if it doesn't preprocess.
+    def get_key(self, source, flags, cwd):
+        res = subprocess.Popen([self.cc] + flags + ["-E", source], cwd=cwd,
+                               stdin=subprocess.DEVNULL,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL);
+
+        stdout, stderr = res.communicate();
+
+        if res.returncode != 0:
+            return None;
+
+        if self.compiler_identity is None:
+            self.compiler_identity = get_compiler_identity(self.cc);
+
+        hasher = hashlib.sha256();
+        hasher.update(self.compiler_identity.encode("utf-8"));
+        hasher.update(b"\0");
+        hasher.update(hashlib.sha256(self.strip_workspace(stdout)).hexdigest().encode("utf-8"));
+        hasher.update(b"\0");
+        hasher.update("\0".join(self.strip_workspace_from_flags(self.normalise_flags(flags))).encode("utf-8"));
+
+        return hasher.hexdigest();
+
+    def get_path(self, key):
+        return os.path.join(self.directory, key[:2], key[2:] + ".o");
+
+    # Compile `source` to the object file `output` with `flags`, both
+    # relative to `cwd`, reusing a cached object if there is one.
+    # Return `True` on success.
+    def compile(self, source, output, flags, cwd):
+        key = self.get_key(source, flags, cwd);
+
+        if key is not None:
+            path = self.get_path(key);
+
+            try:
+                shutil.copyfile(path, os.path.join(cwd, output));
+
+                # Keep track of when it was last used, for `evict`.
+                os.utime(path);
+
+                self.n_hits += 1;
+                self.logger.debug("Hit cached object \"{}\" for \"{}\"".format(key, source));
+                return True;
+
+            except FileNotFoundError:
+                pass;
+
+        self.n_misses += 1;
+
+        cmd = [self.cc] + flags + ["-c", source, "-o", output];
+
+        res = subprocess.Popen(cmd, cwd=cwd,
+                               stdin=subprocess.DEVNULL,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE);
+
+        stdout, stderr = res.communicate();
+
+        if res.returncode != 0:
+            self.logger.error("Failed to compile \"{}\":".format(" ".join(cmd)));
+            self.logger.error(stderr.decode("utf-8").strip());
+            return False;
+
+        if key is not None:
+            os.makedirs(os.path.dirname(path), exist_ok=True);
+
+            temporary = "{}.{}.tmp".format(path, os.getpid());
+            shutil.copyfile(os.path.join(cwd, output), temporary);
+            os.replace(temporary, path);
+
+        return True;
+
+    # Delete the least recently used objects until at most
+    # `max_entries` are left.
+    def evict(self, max_entries):
+        paths = [];
+        for root, dirs, files in os.walk(self.directory):
+            paths += [os.path.join(root, file) for file in files if file.endswith(".o")];
+
+        if len(paths) <= max_entries:
+            return;
+
+        paths.sort(key=lambda path: os.stat(path).st_mtime);
+
+        for path in paths[:len(paths) - max_entries]:
+            os.remove(path);
+
+        self.logger.info("Evicted {} objects from \"{}\"".format(len(paths) - max_entries, self.directory));
+
+# Return the `ObjectCache` for `cc` that worker contexts should build
+# their translation units through, or `None` if there isn't one.
+#
+# The driver points SIMPLETUNER_OBJECT_CACHE at the directory that
+# holds the objects, unless caching is turned off. Worker contexts pass
+# their `workspace`, so that their objects can be shared.
+def get_object_cache(cc, workspace=None):
+    if "SIMPLETUNER_OBJECT_CACHE" not in os.environ:
+        return None;
+
+    return ObjectCache(os.environ["SIMPLETUNER_OBJECT_CACHE"], cc, workspace=workspace);
+
+# Return the number of jobs that worker contexts should run their
+# builds with (e.g. `make -j`).
+#
+# The driver shares its core budget (--core-budget) out evenly between
+# the workers through SIMPLETUNER_MAKE_JOBS, so that parallel builds
+# don't oversubscribe the machine.
+def get_make_jobs():
+    if "SIMPLETUNER_MAKE_JOBS" not in os.environ:
+        return 1;
+
+    return max(1, int(os.environ["SIMPLETUNER_MAKE_JOBS"]));
+
+# Check that the same translation unit, built the way a configured
+# source tree builds it (by absolute path, with absolute include and
+# -B directories), in two different workspaces, comes out of the
+# object cache in the second. Run with `python3 common.py [CC]`.
+def test_object_cache_workspaces(cc="gcc"):
+    with tempfile.TemporaryDirectory() as directory:
+        cache_directory = os.path.join(directory, "objects");
+        keys = [];
+
+        for name in ["workspace-0", "another-workspace-1"]:
+            workspace = os.path.join(directory, name);
+            os.makedirs(os.path.join(workspace, "include"));
+            os.makedirs(os.path.join(workspace, "build"));
+
+            with open(os.path.join(workspace, "include", "square.h"), "w") as file:
+                print("static inline int square (int x) { return x * x; }", file=file);
+
+            with open(os.path.join(workspace, "work.c"), "w") as file:
+                print("#include \"square.h\"\nint work (int x) { return square (x) + 1; }", file=file);
+
+            flags = ["-O2", "-I" + os.path.join(workspace, "include"),
+                     "-B" + os.path.join(workspace, "build")];
+            source = os.path.join(workspace, "work.c");
+
+            object_cache = ObjectCache(cache_directory, cc, workspace=workspace);
+            keys.append(object_cache.get_key(source, flags, os.path.join(workspace, "build")));
+
+            assert object_cache.compile(source, "work.o", flags, os.path.join(workspace, "build"));
+
+        assert keys[0] is not None and keys[0] == keys[1], keys;
+        assert object_cache.n_hits == 1, object_cache.n_hits;
+
+    print("ObjectCache: objects are shared between workspaces");
+
+if __name__ == "__main__":
+    test_object_cache_workspaces(*sys.argv[1:2]);
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+# Flag configurations
+
+# This file is part of SimpleTuner
+
+# Copyright (C) 2021-2023 Embecosm <www.embecosm.com>
+# Contributor Maxim Blinov <maxim.blinov@embecosm.com>
+
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os;
+import json;
+
+from flag import Flag;
+
+def create_cmd_from_flaglist(config):
+    return [config.base_opt] + [str(flag) for flag in config.flags if flag.state != 0];
+
+def create_cmd_from_states(base_opt, flag_values, states):
+    return [base_opt] + [values[state] for values, state in zip(flag_values, states) if state != 0];
+
+# Render the flag states of a configuration once, so that the command
+# line of any variation of it can be built without going through every
+# flag again.
+def create_cmd_parts(flag_values, states):
+    return [values[state] if state != 0 else None
+            for values, state in zip(flag_values, states)];
+
+def create_cmd_from_parts(base_opt, flag_values, parts, variation):
+    parts = list(parts);
+
+    for flag_idx, state in variation:
+        parts[flag_idx] = flag_values[flag_idx][state] if state != 0 else None;
+
+    return [base_opt] + list(filter(None, parts));
+
+# Return a copy of the flag state vector `states`, with the
+# `(flag_idx, state)` pairs of `variation` applied.
+def apply_variation(states, variation):
+    states = list(states);
+
+    for flag_idx, state in variation:
+        states[flag_idx] = state;
+
+    return states;
+
+class Config:
+    def __init__(self, base_opt, flags):
+        self.base_opt = base_opt;
+        self.flags = flags;
+
+    def get_states(self):
+        return [flag.state for flag in self.flags];
+
+    def get_flag_values(self):
+        return [flag.values for flag in self.flags];
+
+    class JSONDecoder(json.JSONDecoder):
+        def __init__(self, *args, **kwargs):
+            json.JSONDecoder.__init__(self, object_hook=self.object_hook, *args, **kwargs)
+
+        def object_hook(self, dct):
+            if "base_opt" in dct:
+                base_opt = dct["base_opt"];
+
+                flags = [];
+                for dct_flag in dct["flags"]:
+                    flag = Flag(dct_flag["name"], dct_flag["flags"]);
+                    flag.state = dct_flag["state"];
+                    flag.n_states = dct_flag["n_states"];
+                    flag.exclusions = set(dct_flag["exclusions"]);
+                    flags.append(flag);
+
+                config = Config(base_opt, flags);
+                return config;
+
+            else:
+                return dct;
+
+    class JSONEncoder(json.JSONEncoder):
+        def default(self, obj):
+            if isinstance(obj, Config):
+                return {
+                    "base_opt": obj.base_opt,
+                    "flags": [
+                        {
+                            'name': flag.name,
+                            'flags': flag.values,
+                            'state': flag.state,
+                            'n_states': flag.n_states,
+                            'exclusions': list(flag.exclusions)
+                        } for flag in obj.flags
+                    ]
+                };
+
+            # Let the base class default method raise the TypeError
+            return json.JSONEncoder.default(self, obj)
+
+def load_config_from_filename(filename):
+    with open(filename, "r") as file:
+        return json.loads(file.read(), cls=Config.JSONDecoder);
+
+# Return the "stem" of a flag: the first word of the option it sets,
+# e.g. "analyzer" for `--param=analyzer-max-svalue-depth=N`, or "tree"
+# for `-ftree-vectorize`. Flags with the same stem are assumed to be
+# related.
+def get_flag_stem(flag):
+    value = flag.values[0];
+
+    if value.startswith("--param="):
+        value = value[len("--param="):];
+    else:
+        value = value.lstrip("-");
+
+        for prefix in ["fno-", "mno-", "f", "m"]:
+            if value.startswith(prefix):
+                value = value[len(prefix):];
+                break;
+
+    return value.split("=")[0].split("-")[0];
+
+def write_config(path, config):
+    with open(path, "w") as file:
+        print(json.dumps(obj=config, indent=4, cls=Config.JSONEncoder), file=file);
+
+# Write the flags of `config`, and `config` itself, out to
+# `iteration.N.flags` and `iteration.N.config` in `run_directory`. The
+# latter is what `--resume` picks up from.
+def write_iteration_config(run_directory, n_iterations, config):
+    with open(os.path.join(run_directory, "iteration.{}.flags".format(n_iterations)), "w") as file:
+        print(" ".join(create_cmd_from_flaglist(config)), file=file);
+
+    write_config(os.path.join(run_directory, "iteration.{}.config".format(n_iterations)), config);
+
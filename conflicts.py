@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+
+# Learned flag conflicts
+
+# This file is part of SimpleTuner
+
+# Copyright (C) 2021-2023 Embecosm <www.embecosm.com>
+# Contributor Maxim Blinov <maxim.blinov@embecosm.com>
+
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os;
+import logging;
+import collections;
+
+# Combinations of flag states that are known not to build.
+#
+# Flags that build fine on their own can still break the build
+# together, and the search has no way of knowing: it would try the
+# same broken combination again in every later iteration. Instead,
+# whenever a configuration fails to build, the table minimises it to
+# the flag states that are to blame, and from then on, the driver
+# fails any job that contains all of them without building it.
+#
+# Configurations are full flag state vectors. Minimising one is a
+# delta debugging search (ddmin) over the flag states in which it
+# differs from `reference`, the configuration the run started from,
+# which builds: it looks for the smallest set of them that still fails
+# to build when applied to `reference` on its own.
+#
+# That set only fails on top of `reference`, though, and may need some
+# of its flag states to (`-Wfloat-conversion` only breaks the build
+# with the `-Werror` of the reference). So the minimisation goes on to
+# move the other flags away from `reference`, half of them at a time,
+# and keeps the reference states of the ones that it can't move
+# without the failure going away. The conflict is both sets of flag
+# states together. Another conflict among the moved flags can hide a
+# flag state that the failure does depend on, so this is a heuristic.
+#
+# The builds the minimisation needs are run by whichever workers the
+# search leaves idle (see `WorkerPool`): `propose` hands out the
+# configurations to build, and `observe` takes whether they built.
+#
+# Learned conflicts are appended to `path`, one per line, so that they
+# survive a --resume.
+class ConflictTable:
+    def __init__(self, reference, flag_values, path=None, valid_states=None):
+        self.logger = logging.getLogger("ConflictTable");
+
+        self.reference = tuple(reference);
+        self.flag_values = flag_values;
+        self.path = path;
+
+        # flag_idx -> the state each flag is moved to, to find out
+        # whether a conflict depends on its reference state, or `None`
+        # if it can't be moved.
+        if valid_states is None:
+            valid_states = [range(len(values)) for values in flag_values];
+
+        self.moved_states = [];
+        for flag_idx, states in enumerate(valid_states):
+            other_states = [state for state in states if state != self.reference[flag_idx]];
+            self.moved_states.append(other_states[0] if len(other_states) > 0 else None);
+
+        # Known conflicts, as tuples of `(flag_idx, state)`
+        self.conflicts = [];
+
+        # Configurations that failed to build, waiting to be minimised
+        self.failures = collections.deque();
+
+        # Whether each configuration we had built for the minimisation
+        # built, or `None` while it is being built.
+        self.built = {};
+
+        # The running minimisation, and the configurations it is waiting
+        # on, of which `pending` haven't been handed out yet.
+        self.minimisation = None;
+        self.candidates = [];
+        self.pending = collections.deque();
+
+        # Set if it turns out that `reference` doesn't build, which
+        # leaves us nothing to minimise against.
+        self.disabled = False;
+
+        if self.path is not None and os.path.isfile(self.path):
+            self.load();
+
+    def __len__(self):
+        return len(self.conflicts);
+
+    # Return the first known conflict that `states` contains, or `None`.
+    def find(self, states):
+        for conflict in self.conflicts:
+            if all([states[flag_idx] == state for flag_idx, state in conflict]):
+                return conflict;
+
+        return None;
+
+    def describe(self, conflict):
+        return " ".join([self.flag_values[flag_idx][state] for flag_idx, state in conflict]);
+
+    # Record that `states` failed to build.
+    def add_failure(self, states):
+        if self.disabled or self.find(states) is not None:
+            return;
+
+        self.failures.append(tuple(states));
+        self.advance();
+
+    # Return up to `n_free` configurations to build.
+    def propose(self, n_free):
+        states = [];
+
+        while len(states) < n_free and len(self.pending) > 0:
+            candidate = self.pending.popleft();
+
+            if candidate in self.built:
+                continue;
+
+            self.built[candidate] = None;
+            states.append(candidate);
+
+        return states;
+
+    # Record whether `states`, which `propose` handed out, built. With
+    # `built` as `None`, it wasn't built after all, and has to be handed
+    # out again.
+    def observe(self, states, built):
+        states = tuple(states);
+
+        if built is None:
+            del self.built[states];
+            self.pending.appendleft(states);
+            return;
+
+        self.built[states] = built;
+        self.advance();
+
+    # Move the minimisation along as far as the results we have allow,
+    # starting on the next failure once it is done.
+    def advance(self):
+        while not self.disabled:
+            if self.minimisation is None:
+                if len(self.failures) == 0:
+                    return;
+
+                failure = self.failures.popleft();
+                if self.find(failure) is not None:
+                    continue;
+
+                self.minimisation = self.minimise(failure);
+                failed = None;
+            else:
+                if any([self.built.get(candidate) is None for candidate in self.candidates]):
+                    return;
+
+                failed = [not self.built[candidate] for candidate in self.candidates];
+
+            try:
+                if failed is None:
+                    self.candidates = next(self.minimisation);
+                else:
+                    self.candidates = self.minimisation.send(failed);
+            except StopIteration as e:
+                self.minimisation = None;
+                self.candidates = [];
+                self.pending.clear();
+
+                if e.value is not None:
+                    self.learn(e.value);
+
+                continue;
+
+            self.pending = collections.deque(
+                [candidate for candidate in dict.fromkeys(self.candidates)
+                 if candidate not in self.built]);
+
+    def apply(self, changes):
+        states = list(self.reference);
+
+        for flag_idx, state in changes:
+            states[flag_idx] = state;
+
+        return tuple(states);
+
+    # Minimise `failure`. Yields lists of configurations to build, and
+    # is sent back which of them failed to. Returns the conflict, or
+    # `None`.
+    #
+    # The conflict is `changes`, the flag states that `failure` doesn't
+    # share with `reference` that are to blame, plus the reference
+    # states of the other flags that it depends on.
+    def minimise(self, failure):
+        changes = [(flag_idx, state) for flag_idx, state in enumerate(failure)
+                   if state != self.reference[flag_idx]];
+
+        if len(changes) == 0:
+            return None;
+
+        # Make sure that the failure is down to the flags, and happens
+        # again, before we go looking for the ones to blame.
+        failed = yield [self.reference, failure];
+        if failed[0]:
+            self.logger.warning("The initial configuration doesn't build: Not learning any conflicts");
+            self.disabled = True;
+            return None;
+
+        if not failed[1]:
+            return None;
+
+        n = 2;
+        while len(changes) >= 2:
+            chunk_size = -(-len(changes) // n);
+            chunks = [changes[idx:idx + chunk_size] for idx in range(0, len(changes), chunk_size)];
+
+            # With two chunks, each is the other's complement.
+            complements = [];
+            if len(chunks) > 2:
+                complements = [[change for change in changes if change not in chunk]
+                               for chunk in chunks];
+
+            candidates = chunks + complements;
+            failed = yield [self.apply(candidate) for candidate in candidates];
+
+            if True in failed:
+                idx = failed.index(True);
+                changes = candidates[idx];
+
+                if idx < len(chunks):
+                    n = 2;
+                else:
+                    n = max(n - 1, 2);
+
+                continue;
+
+            if n >= len(changes):
+                break;
+
+            n = min(n * 2, len(changes));
+
+        changed = set([flag_idx for flag_idx, state in changes]);
+        others = [flag_idx for flag_idx in range(len(self.reference))
+                  if flag_idx not in changed and self.moved_states[flag_idx] is not None];
+
+        # Groups of flags that may be needed in their reference state,
+        # starting with all of them: if the failure survives moving a
+        # whole group, none of it is needed. Otherwise, split it.
+        needed = [];
+        groups = [others] if len(others) > 0 else [];
+        while len(groups) > 0:
+            failed = yield [self.apply(changes + [(flag_idx, self.moved_states[flag_idx]) for flag_idx in group])
+                            for group in groups];
+
+            split = [];
+            for group, group_failed in zip(groups, failed):
+                if group_failed:
+                    continue;
+
+                if len(group) == 1:
+                    needed += group;
+                else:
+                    split += [group[:len(group) // 2], group[len(group) // 2:]];
+
+            groups = split;
+
+        return tuple(sorted(changes + [(flag_idx, self.reference[flag_idx]) for flag_idx in needed]));
+
+    def learn(self, conflict):
+        if conflict in self.conflicts:
+            return;
+
+        self.conflicts.append(conflict);
+        self.logger.info("Learned that \"{}\" doesn't build".format(self.describe(conflict)));
+
+        if self.path is not None:
+            with open(self.path, "a") as file:
+                print(self.describe(conflict), file=file);
+
+    def load(self):
+        states_by_value = {};
+        for flag_idx, values in enumerate(self.flag_values):
+            for state, value in enumerate(values):
+                states_by_value[value] = (flag_idx, state);
+
+        with open(self.path, "r") as file:
+            for line in file:
+                values = line.split();
+
+                if len(values) == 0 or any([value not in states_by_value for value in values]):
+                    continue;
+
+                conflict = tuple(sorted([states_by_value[value] for value in values]));
+                if conflict not in self.conflicts:
+                    self.conflicts.append(conflict);
+
+        self.logger.info("Loaded {} conflicts from \"{}\"".format(len(self.conflicts), self.path));
@@ -16,11 +16,16 @@ import subprocess;
 from common import CompileResult
 from common import CompileRequest;
 from common import get_checksum_for_filename;
+from common import get_benchmark_cpus;
+from common import run_with_rusage;
+from common import get_object_cache;
+from measurement import measure;
 
 class ExampleWorkerContext:
     MAIN_C = \
         """
         #include <stdio.h>
+        #include <stdlib.h>
 
         #define ELEMS (1 << 10)
 
@@ -30,9 +35,11 @@ class ExampleWorkerContext:
         void work (void);
 
         int
-        main (void)
+        main (int argc, char **argv)
         {
-          for (int i = 0; i < 1E6; ++i)
+          int iterations = argc > 1 ? atoi (argv[1]) : 1E6;
+
+          for (int i = 0; i < iterations; ++i)
             work ();
 
           return 0;
@@ -54,13 +61,39 @@ class ExampleWorkerContext:
         }
         """;
 
+    SOURCES = ["main.c", "work.c"];
+
+    # Number of iterations of the `work` loop that `benchmark_cheap` runs,
+    # out of the 1E6 that `benchmark` does.
+    CHEAP_ITERATIONS = 50000;
+
+    # Execution times are noisy, so `benchmark` runs the binary at least
+    # MIN_REPLICATES times, and then until the 95% confidence interval of
+    # the mean is within MAX_RELATIVE_CI of it, or MAX_REPLICATES is hit.
+    MIN_REPLICATES = 3;
+    MAX_REPLICATES = 10;
+    MAX_RELATIVE_CI = 0.01;
+
+    # The benchmark types that run `./work`, and what they measure of it
+    # (see `common.ProcessUsage`):
+    #   execution:        Wall clock time, including starting the process.
+    #   cpu-time:         User and system CPU time.
+    #   max-rss:          Peak resident set size.
+    #   context-switches: Voluntary and involuntary context switches.
+    RUSAGE_METRICS = {
+        "execution": "wall_time",
+        "cpu-time": "cpu_time",
+        "max-rss": "max_rss",
+        "context-switches": "context_switches",
+    };
+
     # Return the "type" of benchmark your Worker supports.
 
     # This information will be used by the Simpletuner driver
     # to check the user-supplied --benchmark flag.
     @staticmethod
     def get_available_benchmark_types() -> list:
-        return ["execution", "size"];
+        return ["execution", "cpu-time", "max-rss", "context-switches", "size"];
 
     def __init__(self, idx, workspace, cc, benchmark_type):
         # Create a logger
@@ -78,6 +111,13 @@ class ExampleWorkerContext:
         # The 'type' of benchmark that will be running. This will be provided by the user via the `--benchmark` flag.
         self.benchmark_type = benchmark_type;
 
+        # CPUs to pin the benchmark to, if any (see `common.get_benchmark_cpus`).
+        self.benchmark_cpus = get_benchmark_cpus(idx);
+
+        # Objects of translation units that earlier variations, or other
+        # workers, already compiled with the same flags (see `common.ObjectCache`).
+        self.object_cache = get_object_cache(cc, workspace=workspace);
+
         random.seed(self.idx);
 
     # Initialise workspace, whatever that may be.
@@ -98,6 +138,41 @@ class ExampleWorkerContext:
         self.logger.info("Successfully setup workspace");
         return True;
 
+    # Pick up a workspace that `init_workspace` set up in an earlier run.
+    # Simpletuner will call this instead of `init_workspace` when resuming
+    # a run with `--resume`. If you don't implement it, `init_workspace`
+    # is called on the existing workspace instead.
+    def resume_workspace(self):
+        self.logger.debug("Resuming workspace in {}".format(self.workspace));
+
+        if not os.path.isfile(os.path.join(self.workspace, "main.c")) \
+           or not os.path.isfile(os.path.join(self.workspace, "work.c")):
+            return self.init_workspace();
+
+        return True;
+
+    # Optional: Return source files that are representative of what
+    # `compile` builds, as a list of `(path, args)`, where `args` are
+    # whatever else the compiler needs to compile `path` on its own
+    # (include directories, defines, and so on).
+    # ----
+    # Before the run starts, Simpletuner compiles each of them with `-S`
+    # and every state of every flag, and excludes the states that fail,
+    # rather than finding out one full build at a time. This is called
+    # after `init_workspace` (or `resume_workspace`).
+    def get_validation_sources(self):
+        return [(os.path.join(self.workspace, source), []) for source in self.SOURCES];
+
+    # Optional: Return the flags the compiler actually sees when
+    # `compile` is called with `flags`, if you add any of your own.
+    # ----
+    # With `--canonicalise-flags`, Simpletuner asks the compiler what
+    # state these leave it in, and skips building flags that leave it in
+    # the same state as flags it already built. This context passes
+    # `flags` through untouched, so it doesn't need to implement this.
+    # def get_effective_flags(self, flags):
+    #     return flags;
+
     # Return `True` if score `x` is "better" than score `y`.
     # ----
     # Note that in this example, all the benchmark types' worst-case value is infinity.
@@ -105,7 +180,7 @@ class ExampleWorkerContext:
     # bytes processed, or some other "bigger=better" type metric, then you would
     # put `return x > y` here.
     def better(self, x, y) -> float:
-        if self.benchmark_type == "execution" or self.benchmark_type == "size":
+        if self.benchmark_type in self.get_available_benchmark_types():
             return x < y;
 
 
@@ -116,7 +191,7 @@ class ExampleWorkerContext:
     # being selected to run again.
     # The same logic applies here as in the `better(self, x, y)` function above.
     def worst_possible_result(self) -> float:
-        if self.benchmark_type == "execution" or self.benchmark_type == "size":
+        if self.benchmark_type in self.get_available_benchmark_types():
             return float('inf');
 
 
@@ -128,7 +203,31 @@ class ExampleWorkerContext:
     # make sense to run both, since they will both run the same way. In this case, Simpletuner
     # will skip the `benchmark` step for a flag for which it already has a cached entry.
     def compile(self, flags) -> CompileResult:
-        cmd = [self.cc, "-o", "work", "main.c", "work.c"] + flags;
+        # Build each translation unit separately, so that the ones whose
+        # code a variation doesn't change can come out of the object cache.
+        for source in self.SOURCES:
+            output = os.path.splitext(source)[0] + ".o";
+
+            if self.object_cache is not None:
+                ok = self.object_cache.compile(source, output, flags, self.workspace);
+            else:
+                ok = self.run_cc(flags + ["-c", source, "-o", output]);
+
+            if not ok:
+                return CompileResult(False, None);
+
+        if not self.run_cc(flags + ["-o", "work"]
+                           + [os.path.splitext(source)[0] + ".o" for source in self.SOURCES]):
+            return CompileResult(False, None);
+
+        # Calculate the checksum for this file. We _really_ want to do this,
+        # as a lot of flags will have no effect on the binary, and this saves a lot of compute time.
+        checksum = get_checksum_for_filename(os.path.join(self.workspace, "work"));
+
+        return CompileResult(True, checksum);
+
+    def run_cc(self, args):
+        cmd = [self.cc] + args;
 
         self.logger.debug("[{}]: compile(): Executing \"{}\"" \
                           .format(self.workspace, " ".join(cmd)));
@@ -144,19 +243,16 @@ class ExampleWorkerContext:
             self.logger.error("[{}]: compile(): Exit code {}: Failed to compile:"\
                               .format(self.workspace, res.returncode));
             self.logger.error("stderr: \n" + stderr.decode("utf-8").strip());
-            return CompileResult(False, None);
+            return False;
 
-        # Calculate the checksum for this file. We _really_ want to do this,
-        # as a lot of flags will have no effect on the binary, and this saves a lot of compute time.
-        checksum = get_checksum_for_filename(os.path.join(self.workspace, "work"));
-
-        return CompileResult(True, checksum);
+        return True;
 
     # Run whatever benchmark the user specified in `--benchmark`.
     #   Upon failure, Return `None`.
-    #   Upon success, Return a floating-point arbitrary score value.
+    #   Upon success, Return a floating-point arbitrary score value, or
+    #   for noisy benchmarks, a `measurement.Measurement` of it.
     def benchmark(self):
-        if self.benchmark_type == "execution":
+        if self.benchmark_type in self.RUSAGE_METRICS:
             return self.run();
         elif self.benchmark_type == "size":
             return self.size();
@@ -167,39 +263,53 @@ class ExampleWorkerContext:
                               .format(self.benchmark_type));
             exit(1);
 
+    # Optional: Run a cheaper, rougher version of the benchmark.
+    #   Upon failure, Return `None`.
+    #   Upon success, Return a floating-point arbitrary score value.
+    # ----
+    # With `--halving-fraction`, Simpletuner scores every state variation
+    # with this first, and only runs `benchmark` on the most promising of
+    # them. The scores only need to rank binaries roughly the way
+    # `benchmark` would.
+    def benchmark_cheap(self):
+        if self.benchmark_type in self.RUSAGE_METRICS:
+            return self.run_once(iterations=self.CHEAP_ITERATIONS);
+        elif self.benchmark_type == "size":
+            # Measuring the size is as cheap as it gets.
+            return self.size();
+        else:
+            self.logger.error("Unreachable: self.benchmark_type: \"{}\" is invalid. Aborting"\
+                              .format(self.benchmark_type));
+            exit(1);
+
     def run(self):
+        return measure(self.run_once,
+                       min_replicates=self.MIN_REPLICATES,
+                       max_replicates=self.MAX_REPLICATES,
+                       max_relative_ci=self.MAX_RELATIVE_CI);
+
+    def run_once(self, iterations=None):
         cmd = ["./work"];
+        if iterations is not None:
+            cmd.append(str(iterations));
 
         self.logger.debug("[{}]: run(): Executing \"{}\"" \
                           .format(self.workspace, " ".join(cmd)));
 
-        start = time.time();
-
         timeout_sec = 30;
-        did_timeout_p = False;
-
-        res = subprocess.Popen(cmd, cwd=self.workspace,
-                               stdin=subprocess.DEVNULL,
-                               stdout=subprocess.PIPE,
-                               stderr=subprocess.PIPE);
 
-        try:
-            _, _ = res.communicate(timeout=timeout_sec);
-        except subprocess.TimeoutExpired:
-            did_timeout_p = True;
+        usage = run_with_rusage(cmd, self.workspace, timeout=timeout_sec,
+                                cpus=self.benchmark_cpus);
 
-        if did_timeout_p:
+        if usage.timed_out:
             self.logger.error("run() step timed out");
             return None;
 
-        if res.returncode != 0:
-            self.logger.error("run() step failed to run: exit code {}".format(res.returncode));
+        if usage.returncode != 0:
+            self.logger.error("run() step failed to run: exit code {}".format(usage.returncode));
             return None;
 
-        end = time.time();
-        delta = end - start;
-
-        return delta;
+        return float(getattr(usage, self.RUSAGE_METRICS[self.benchmark_type]));
 
     def size(self):
         return self.size_find_size_of_text_section();
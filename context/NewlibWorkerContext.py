@@ -7,7 +7,7 @@
 
 # SPDX-License-Identifier: GPL-3.0-or-later
 
-import os;
+import os, sys;
 import random;
 import logging;
 import time;
@@ -16,6 +16,10 @@ import subprocess;
 from common import CompileResult
 from common import CompileRequest;
 from common import get_checksum_for_filename;
+from template import get_template;
+from template import populate_workspace;
+from jobserver import get_make_args;
+from jobserver import get_jobserver_fds;
 
 class ProcessResult:
     def __init__(self, returncode, stdout, stderr):
@@ -24,6 +28,16 @@ class ProcessResult:
         self.stderr = stderr.decode("utf-8");
 
 class NewlibWorkerContext:
+    # A sample of libc and libm to check the flags against before the
+    # run (see `get_validation_sources`).
+    VALIDATION_SOURCES = [
+        "newlib/libc/string/memcpy.c",
+        "newlib/libc/string/strcmp.c",
+        "newlib/libc/stdlib/qsort.c",
+        "newlib/libc/stdio/vfprintf.c",
+        "newlib/libm/math/e_pow.c",
+    ];
+
     # Return the "type" of benchmark your Worker supports.
 
     # This information will be used by the Simpletuner driver
@@ -48,6 +62,21 @@ class NewlibWorkerContext:
         # The 'type' of benchmark that will be running. This will be provided by the user via the `--benchmark` flag.
         self.benchmark_type = benchmark_type;
 
+        self.march = "rv32im";
+        self.mabi = "ilp32";
+
+        self.newlib_source_dir = os.path.join(self.workspace);
+        self.newlib_build_dir = os.path.join(self.workspace, 'build', 'newlib')
+
+        # Newlib builds with make, so objects come out of the object cache
+        # (see `common.ObjectCache`) through a compiler wrapper.
+        self.cc_wrapper = [];
+        if "SIMPLETUNER_OBJECT_CACHE" in os.environ:
+            self.cc_wrapper = [sys.executable,
+                               os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+                                            "object-cache-cc.py"),
+                               "--workspace", self.workspace];
+
         random.seed(self.idx);
 
     # Initialise workspace, whatever that may be.
@@ -59,9 +88,6 @@ class NewlibWorkerContext:
     def init_workspace(self):
         self.logger.debug("Creating workspace in {}".format(self.workspace));
 
-        self.march = "rv32im";
-        self.mabi = "ilp32";
-
         if "NEWLIB_SOURCE_TAR" not in os.environ:
             self.logger.error("Please set the environment variable \"NEWLIB_SOURCE_TAR\""
                               " to contain the path to a newlib source tree.");
@@ -69,29 +95,70 @@ class NewlibWorkerContext:
 
         self.SOURCE_TAR = os.environ["NEWLIB_SOURCE_TAR"];
 
-        cmd = ["tar", "-xf", self.SOURCE_TAR,
-               "--directory", self.workspace];
+        template = get_template(self.SOURCE_TAR, self.workspace);
+        if template is None:
+            return False;
 
-        res = subprocess.Popen(cmd, cwd=self.workspace,
-                               stdin=subprocess.DEVNULL,
-                               stdout=subprocess.PIPE,
-                               stderr=subprocess.PIPE);
+        # Newlib is built out of tree, so nothing writes to the sources,
+        # and they can be hard links into the template.
+        if not populate_workspace(template, self.workspace, hardlink=True):
+            self.logger.error("init_workspace(): Failed to populate workspace");
+            return False;
 
-        stdout, stderr = res.communicate();
+        os.makedirs(self.newlib_build_dir);
 
-        if res.returncode != 0:
-            self.logger.error("init_workspace(): Failed to extract:" \
-                              .format(self.idx, file=sys.stderr));
-            self.logger.error(stderr.decode("utf-8").strip());
-            return False;
+        return True;
 
-        self.newlib_source_dir = os.path.join(self.workspace);
-        self.newlib_build_dir = os.path.join(self.workspace, 'build', 'newlib')
+    # Pick up a workspace that `init_workspace` set up in an earlier run.
+    # Simpletuner will call this instead of `init_workspace` when resuming
+    # a run with `--resume`.
+    def resume_workspace(self):
+        self.logger.debug("Resuming workspace in {}".format(self.workspace));
 
-        os.makedirs(self.newlib_build_dir);
+        # Extracting the tarball is what takes the time, so only do
+        # it again if the workspace doesn't look like it has been.
+        if not os.path.isdir(self.newlib_build_dir):
+            self.logger.warning("resume_workspace(): \"{}\" hasn't been set up, extracting again"\
+                                .format(self.workspace));
+            return self.init_workspace();
 
         return True;
 
+    # Return the sources to check the flags against, compiled the way
+    # the build compiles them (see `ExampleWorkerContext.get_validation_sources`).
+    # Their headers need the newlib.h that configure generates, so
+    # configure first, if that hasn't been done yet.
+    def get_validation_sources(self):
+        if not self.newlib_is_configured():
+            configure = self.newlib_configure();
+            if configure.returncode != 0:
+                self.logger.error("[{}]: newlib_configure(): Exit code {}: Failed to configure: {}" \
+                                  .format(self.workspace, configure.returncode, configure.stderr));
+                return [];
+
+        args = [
+            '-march=' + self.march,
+            '-mabi=' + self.mabi,
+            '-D_COMPILING_NEWLIB',
+            '-I' + self.newlib_build_dir,
+            '-isystem' + os.path.join(self.newlib_build_dir, "riscv32-unknown-elf", self.march, self.mabi, "newlib", "targ-include"),
+            '-isystem' + os.path.join(self.newlib_source_dir, "newlib", "libc", "include"),
+        ];
+
+        sources = [os.path.join(self.newlib_source_dir, source) for source in self.VALIDATION_SOURCES];
+
+        for source in sources:
+            if not os.path.isfile(source):
+                self.logger.warning("Validation source \"{}\" doesn't exist: Not checking flags against it"\
+                                    .format(source));
+
+        return [(source, args) for source in sources if os.path.isfile(source)];
+
+    # Return the flags the compiler sees when building with `flags` (see
+    # `ExampleWorkerContext.get_effective_flags`).
+    def get_effective_flags(self, flags):
+        return ['-march=' + self.march, '-mabi=' + self.mabi] + flags;
+
     # Return `True` if score `x` is "better" than score `y`.
     # ----
     # Note that in this example, all the benchmark types' worst-case value is infinity.
@@ -121,7 +188,7 @@ class NewlibWorkerContext:
     # that is, if flag 'A' and flag 'B' both generate the exact same executable, it doesn't
     # make sense to run both, since they will both run the same way. In this case, Simpletuner
     # will skip the `benchmark` step for a flag for which it already has a cached entry.
-    def newlib_clean(self, flags):
+    def newlib_clean(self):
         cmd = [
             'make',
             'clean'
@@ -129,6 +196,7 @@ class NewlibWorkerContext:
 
         res = subprocess.Popen(cmd,
                                cwd=self.newlib_build_dir,
+                               pass_fds=get_jobserver_fds(),
                                stdin=subprocess.DEVNULL,
                                stdout=subprocess.PIPE,
                                stderr=subprocess.PIPE);
@@ -137,8 +205,11 @@ class NewlibWorkerContext:
 
         return ProcessResult(res.returncode, stdout, stderr)
 
-    def newlib_configure(self, flags):
-        CC = " ".join([
+    # Configure newlib once, with no CFLAGS of its own: every build
+    # passes the flags under test to make instead, which hands them down
+    # to every sub-make.
+    def newlib_configure(self):
+        CC = " ".join(self.cc_wrapper + [
             'riscv32-unknown-elf-gcc',
             '-B' + os.path.join(self.newlib_build_dir, "riscv32-unknown-elf", self.march, self.mabi, "newlib"),
             '-isystem' + os.path.join(self.newlib_build_dir, "riscv32-unknown-elf", self.march, self.mabi, "newlib", "targ-include"),
@@ -150,8 +221,6 @@ class NewlibWorkerContext:
             '-mabi=' + self.mabi
             ]);
 
-        CFLAGS = " ".join(flags);
-
         cmd = [
             os.path.join(self.newlib_source_dir, 'newlib', 'configure'),
             '--with-multisubdir={}/{}'.format(self.march, self.mabi),
@@ -159,12 +228,13 @@ class NewlibWorkerContext:
             '--with-cross-host=x86_64-pc-linux-gnu',
             '--program-transform-name=s&^&riscv32-unknown-elf-&',
             '--disable-option-checking',
+            '--disable-dependency-tracking',
             '--with-target-subdir=riscv32-unknown-elf',
             '--build=x86_64-pc-linux-gnu',
             '--host=riscv32-unknown-elf',
             '--target=riscv32-unknown-elf',
             'CC=' + CC,
-            'CFLAGS=' + CFLAGS,
+            'CFLAGS=',
         ];
 
         res = subprocess.Popen(cmd,
@@ -179,11 +249,13 @@ class NewlibWorkerContext:
 
     def newlib_build(self, flags):
         cmd = [
-            'make'
-        ];
+            'make',
+            'CFLAGS=' + " ".join(flags)
+        ] + get_make_args();
 
         res = subprocess.Popen(cmd,
                                cwd=self.newlib_build_dir,
+                               pass_fds=get_jobserver_fds(),
                                stdin=subprocess.DEVNULL,
                                stdout=subprocess.PIPE,
                                stderr=subprocess.PIPE);
@@ -192,21 +264,28 @@ class NewlibWorkerContext:
 
         return ProcessResult(res.returncode, stdout, stderr)
 
+    def newlib_is_configured(self):
+        return os.path.isfile(os.path.join(self.newlib_build_dir, "Makefile"));
+
     def compile(self, flags) -> CompileResult:
         self.logger.debug("[{}]: compile(): Building newlib".format(self.workspace));
 
-        if len(os.listdir(self.newlib_build_dir)) != 0:
-            configure = self.newlib_clean(flags);
+        # Configuring takes longer than building, so it's only done the
+        # first time around. After that, make can't tell that the flags
+        # changed, so everything is cleaned out instead. Objects that
+        # don't change still come out of the object cache, if there is one.
+        if not self.newlib_is_configured():
+            configure = self.newlib_configure();
             if configure.returncode != 0:
-                self.logger.error("[{}]: newlib_configure(): Exit code {}: Failed to compile:" \
+                self.logger.error("[{}]: newlib_configure(): Exit code {}: Failed to configure: {}" \
                                   .format(self.workspace, configure.returncode, configure.stderr));
                 return CompileResult(False, None);
-
-        configure = self.newlib_configure(flags);
-        if configure.returncode != 0:
-            self.logger.error("[{}]: newlib_configure(): Exit code {}: Failed to compile:" \
-                              .format(self.workspace, configure.returncode, configure.stderr));
-            return CompileResult(False, None);
+        else:
+            clean = self.newlib_clean();
+            if clean.returncode != 0:
+                self.logger.error("[{}]: newlib_clean(): Exit code {}: Failed to clean: {}" \
+                                  .format(self.workspace, clean.returncode, clean.stderr));
+                return CompileResult(False, None);
 
         build = self.newlib_build(flags);
         if build.returncode != 0:
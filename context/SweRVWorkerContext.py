@@ -12,9 +12,13 @@ import random;
 import logging;
 import time;
 
-from simpletuner import CompileRequest;
-from simpletuner import CompileResult;
-from simpletuner import get_checksum_for_filename;
+from common import CompileRequest;
+from common import CompileResult;
+from common import get_checksum_for_filename;
+from template import get_template;
+from template import populate_workspace;
+from jobserver import get_make_args;
+from jobserver import get_jobserver_fds;
 
 class SweRVWorkerContext:
     @staticmethod
@@ -47,24 +51,57 @@ class SweRVWorkerContext:
 
         self.SOURCE_TAR = os.environ["SWERV_SOURCE_TAR"];
 
-        cmd = ["tar", "-xf", self.SOURCE_TAR,
-               "--directory", self.workspace];
+        template = get_template(self.SOURCE_TAR, self.workspace);
+        if template is None:
+            return False;
 
-        res = subprocess.Popen(cmd, cwd=self.workspace,
-                               stdin=subprocess.DEVNULL,
-                               stdout=subprocess.PIPE,
-                               stderr=subprocess.PIPE);
+        # SweRV is built in its source tree, so each worker needs a copy
+        # of its own (copy-on-write, where possible).
+        if not populate_workspace(template, self.workspace):
+            self.logger.error("init_workspace(): Failed to populate workspace");
+            return False;
 
-        stdout, stderr = res.communicate();
+        return True;
 
-        if res.returncode != 0:
-            self.logger.error("init_workspace(): Failed to extract:" \
-                              .format(self.idx, file=sys.stderr));
-            self.logger.error(stderr.decode("utf-8").strip());
-            return False;
+    def resume_workspace(self):
+        self.logger.debug("Resuming workspace in {}".format(self.workspace));
+
+        # Extracting the tarball is what takes the time, so only do
+        # it again if the workspace doesn't look like it has been.
+        if not os.path.isfile(os.path.join(self.workspace, "tools", "Makefile")):
+            self.logger.warning("resume_workspace(): \"{}\" hasn't been set up, extracting again"\
+                                .format(self.workspace));
+            return self.init_workspace();
 
         return True;
 
+    # Return the sources of the benchmark, to check the flags against
+    # before the run (see `ExampleWorkerContext.get_validation_sources`).
+    def get_validation_sources(self):
+        args = ["-march=" + self.march,
+                "-mabi=" + self.mabi,
+                "-fno-exceptions",
+                "-fno-asynchronous-unwind-tables"];
+
+        # TEST=cmark_iccm builds cmark.o from cmark.c (see `compile`).
+        sources = [os.path.join(self.workspace, "testbench", "asm", source)
+                   for source in ["cmark.c", "printf.c"]];
+
+        for source in sources:
+            if not os.path.isfile(source):
+                self.logger.warning("Validation source \"{}\" doesn't exist: Not checking flags against it"\
+                                    .format(source));
+
+        return [(source, args) for source in sources if os.path.isfile(source)];
+
+    # Return the flags the compiler sees when building with `flags` (see
+    # `ExampleWorkerContext.get_effective_flags`).
+    def get_effective_flags(self, flags):
+        return ["-march=" + self.march,
+                "-mabi=" + self.mabi,
+                "-Ofast"] + flags \
+            + ["-fno-exceptions", "-fno-asynchronous-unwind-tables"];
+
     def better(x, y):
         # Return True if score `x` is better than score `y`
         return x < y;
@@ -103,16 +140,14 @@ class SweRVWorkerContext:
                 "RV_ROOT={}".format(self.workspace),
                 "GCC_PREFIX=riscv32-unknown-elf",
                 "target=high_perf", "TEST=cmark_iccm",
-                "TEST_CFLAGS={}".format(" ".join(["-march=" + self.march,
-                                                  "-mabi=" + self.mabi,
-                                                  "-Ofast"] + flags \
-                                                 + ["-fno-exceptions", "-fno-asynchronous-unwind-tables"])),
-                "program.hex"];
+                "TEST_CFLAGS={}".format(" ".join(self.get_effective_flags(flags))),
+                "program.hex"] + get_make_args();
 
         self.logger.debug("compile(): Executing \"{}\"" \
                           .format(" ".join(make)));
 
         res = subprocess.Popen(make, cwd=self.workspace, env=self.env,
+                               pass_fds=get_jobserver_fds(),
                                stdin=subprocess.DEVNULL,
                                stdout=subprocess.PIPE,
                                stderr=subprocess.PIPE);
@@ -133,17 +168,23 @@ class SweRVWorkerContext:
     def benchmark(self):
         return self.run();
 
+    # Running the verilator model takes a while. The size of the code
+    # is a rough, but much cheaper, indication of how well it will do.
+    def benchmark_cheap(self):
+        return self.size();
+
     def run(self):
         make = ["make", "-f", "tools/Makefile",
                 "RV_ROOT={}".format(self.workspace),
                 "GCC_PREFIX=riscv32-unknown-elf",
                 "target=high_perf", "TEST=cmark_iccm",
-                "verilator"];
+                "verilator"] + get_make_args();
 
         self.logger.debug("run(): Executing \"{}\"" \
                           .format(" ".join(make)));
 
         res = subprocess.Popen(make, cwd=self.workspace,
+                               pass_fds=get_jobserver_fds(),
                                stdin=subprocess.DEVNULL,
                                stdout=subprocess.PIPE,
                                stderr=subprocess.PIPE);
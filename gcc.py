@@ -9,8 +9,9 @@
 
 # SPDX-License-Identifier: GPL-3.0-or-later
 
-import os, sys, re, subprocess, logging;
+import os, sys, re, json, fcntl, hashlib, subprocess, threading, logging;
 from flag import Flag;
+from common import get_compiler_identity;
 
 class GCCDriver:
     class Version:
@@ -25,24 +26,165 @@ class GCCDriver:
         def __str__(self):
             return repr(self);
 
-    def __init__(self, cc_path):
+    # A source file to check flags against (see `check_flags`), compiled
+    # with `args`. It is identified by the `digest` of its preprocessed
+    # contents and `args`, so that changing it or any header it
+    # includes makes for a different source.
+    class Source:
+        def __init__(self, path, args, digest):
+            self.path = path;
+            self.args = args;
+            self.digest = digest;
+
+        def __repr__(self):
+            return self.path;
+
+        def __str__(self):
+            return repr(self);
+
+    # With a `cache_directory`, everything we find out about the
+    # compiler is kept in a file there, keyed by the identity of the
+    # compiler binary (see `common.get_compiler_identity`): the output
+    # of `gcc -v` and `--help=...`, and which flags it accepts. Runs
+    # against the same compiler then don't have to ask it again. Call
+    # `save` to write out what was found.
+    #
+    # The fingerprints of command lines (see `get_fingerprint`) aren't
+    # kept there: there is one per command line, which would grow the
+    # file without bound, and what they built is already kept in the
+    # result cache (see `ResultCache`), which evicts them.
+    def __init__(self, cc_path, cache_directory=None):
         # self.bindir = bindir;
         # self.cc = os.path.join(self.bindir, tool_prefix + "gcc");
         self.cc = cc_path;
-        # self.logger = logging.getLogger("GCCDriver");
+        self.logger = logging.getLogger("GCCDriver");
         # self.logger.info("Using gcc = \"{}\"".format(self.cc));
 
-    def get_version(self):
-        res = subprocess.Popen([self.cc, "-v"],
+        # Output of successful introspection commands, by their
+        # arguments, and whether each flag is accepted, by flag. These
+        # are kept even without a `cache_directory`, for the lifetime
+        # of the driver.
+        self.outputs = {};
+        self.flag_validity = {};
+        self.source_validity = {};
+        self.lock = threading.Lock();
+
+        # Fingerprints of the command lines seen by this process.
+        self.fingerprints = {};
+
+        self.path_cache = None;
+        if cache_directory is not None:
+            os.makedirs(cache_directory, exist_ok=True);
+            self.path_cache = os.path.join(cache_directory,
+                                           "gcc-{}.json".format(get_compiler_identity(self.cc)));
+            self.load();
+
+    # Drivers are handed to worker processes, but locks can't be.
+    def __getstate__(self):
+        state = dict(self.__dict__);
+        del state["lock"];
+        return state;
+
+    def __setstate__(self, state):
+        self.__dict__.update(state);
+        self.lock = threading.Lock();
+
+    def load(self):
+        if not os.path.isfile(self.path_cache):
+            return;
+
+        try:
+            with open(self.path_cache, "r") as file:
+                cached = json.load(file);
+        except (OSError, ValueError) as e:
+            self.logger.warning("Ignoring unreadable compiler cache \"{}\": {}".format(self.path_cache, e));
+            return;
+
+        self.outputs.update(cached.get("outputs", {}));
+        self.flag_validity.update(cached.get("flags", {}));
+        self.source_validity.update(cached.get("sources", {}));
+
+        self.logger.debug("Loaded {} outputs, {} flags and {} sources from \"{}\""\
+                          .format(len(self.outputs), len(self.flag_validity),
+                                  len(self.source_validity), self.path_cache));
+
+    def save(self):
+        if self.path_cache is None:
+            return;
+
+        with self.lock:
+            # Someone else may have found out things about the same
+            # compiler in the meantime.
+            outputs = dict(self.outputs);
+            flag_validity = dict(self.flag_validity);
+            source_validity = {digest: dict(validity)
+                               for digest, validity in self.source_validity.items()};
+
+        # Other runs against the same compiler may be saving what they
+        # found out too: merge with theirs one at a time.
+        with open(self.path_cache + ".lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX);
+
+            if os.path.isfile(self.path_cache):
+                try:
+                    with open(self.path_cache, "r") as file:
+                        cached = json.load(file);
+
+                    outputs = dict(cached.get("outputs", {}), **outputs);
+                    flag_validity = dict(cached.get("flags", {}), **flag_validity);
+
+                    for digest, validity in cached.get("sources", {}).items():
+                        source_validity[digest] = dict(validity, **source_validity.get(digest, {}));
+                except (OSError, ValueError):
+                    pass;
+
+            partial = "{}.{}.partial".format(self.path_cache, os.getpid());
+            with open(partial, "w") as file:
+                json.dump({"cc": self.cc, "outputs": outputs, "flags": flag_validity,
+                           "sources": source_validity}, file);
+
+            os.replace(partial, self.path_cache);
+
+    # Run the compiler with `args`, and return `(stdout, stderr)`, or
+    # `None` if it failed. Only successful runs are remembered.
+    def run_cached(self, args):
+        key = "\0".join(args);
+
+        with self.lock:
+            if key in self.outputs:
+                return tuple(self.outputs[key]);
+
+        cmd = [self.cc] + args;
+
+        res = subprocess.Popen(cmd,
+                               stdin=subprocess.DEVNULL,
                                stdout=subprocess.PIPE,
                                stderr=subprocess.PIPE);
 
         stdout, stderr = res.communicate();
 
         if res.returncode != 0:
+            logging.error("gcc exited with return code {}:".format(res.returncode));
+            logging.error("Invocation: \"{}\"".format(" ".join(cmd)));
+            logging.error("stderr:");
+            logging.error(stderr.decode("utf-8"));
+            return None;
+
+        output = (stdout.decode("utf-8"), stderr.decode("utf-8"));
+
+        with self.lock:
+            self.outputs[key] = output;
+
+        return output;
+
+    def get_version(self):
+        output = self.run_cached(["-v"]);
+        if output is None:
             return None;
 
-        lines = [line.strip() for line in stderr.decode("utf-8").split('\n') if len(line.strip()) > 0];
+        stdout, stderr = output;
+
+        lines = [line.strip() for line in stderr.split('\n') if len(line.strip()) > 0];
 
         version_re = re.compile(r"gcc version ([0-9]+)\.([0-9]+)\.([0-9]+)");
         version = None;
@@ -63,16 +205,13 @@ class GCCDriver:
         return version;
 
     def get_target(self):
-        res = subprocess.Popen([self.cc, "-v"],
-                               stdout=subprocess.PIPE,
-                               stderr=subprocess.PIPE);
-
-        stdout, stderr = res.communicate();
-
-        if res.returncode != 0:
+        output = self.run_cached(["-v"]);
+        if output is None:
             return None;
 
-        lines = [line.strip() for line in stderr.decode("utf-8").split('\n') if len(line.strip()) > 0];
+        stdout, stderr = output;
+
+        lines = [line.strip() for line in stderr.split('\n') if len(line.strip()) > 0];
 
         target_re = re.compile(r"Target: (\S+)");
         target = None;
@@ -114,24 +253,14 @@ class GCCDriver:
                 r"([a-zA-Z0-9\-]+)\s+default (\-?[0-9]+) minimum (\-?[0-9]+) maximum (\-?[0-9]+)");
 
         if cflags is not None:
-            cmd = [self.cc] + cflags + ["-Q", "--help=params"]
+            output = self.run_cached(cflags + ["-Q", "--help=params"]);
         else:
-            cmd = [self.cc, "-Q", "--help=params"]
-
-        res = subprocess.Popen(cmd,
-                               stdout=subprocess.PIPE,
-                               stderr=subprocess.PIPE);
-
-        stdout, stderr = res.communicate();
+            output = self.run_cached(["-Q", "--help=params"]);
 
-        if res.returncode != 0:
-            logging.error("gcc exited with return code {}:".format(res.returncode));
-            logging.error("Invocation: \"{}\"".format(" ".join(cmd)));
-            logging.error("stderr:");
-            logging.error(stderr.decode("utf-8"));
+        if output is None:
             sys.exit(1);
 
-        stdout = stdout.decode("utf-8").strip();
+        stdout = output[0].strip();
         lines = stdout.split('\n');
 
         # The first line is always
@@ -285,21 +414,14 @@ class GCCDriver:
         re_param_simple = re.compile(r"\-f([a-zA-Z0-9\-]+)\s+(\[disabled\]|\[enabled\])?");
 
         if cflags is not None:
-            cmd = [self.cc] + cflags + ["-Q", "--help=optimizers"]
+            output = self.run_cached(cflags + ["-Q", "--help=optimizers"]);
         else:
-            cmd = [self.cc, "-Q", "--help=optimizers"]
+            output = self.run_cached(["-Q", "--help=optimizers"]);
 
-        res = subprocess.Popen(cmd,
-                               stdout=subprocess.PIPE,
-                               stderr=subprocess.PIPE);
-
-        stdout, stderr = res.communicate();
-
-        if res.returncode != 0:
-            # self.logger.error("[ERROR] gcc exited with {}".format(res.returncode));
+        if output is None:
             sys.exit(1);
 
-        stdout = stdout.decode("utf-8").strip();
+        stdout = output[0].strip();
         lines = stdout.split('\n');
 
         # The first line is always
@@ -376,6 +498,59 @@ class GCCDriver:
         return flags;
 
     def check_flag(self, flag):
+        return self.check_flags([flag]);
+
+    # Return a `Source` for the source file at `path`, compiled with
+    # `args`, or `None` if it doesn't even preprocess.
+    def get_source(self, path, args):
+        cmd = [self.cc] + args + ["-E", path];
+
+        res = subprocess.Popen(cmd,
+                               stdin=subprocess.DEVNULL,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE);
+
+        stdout, stderr = res.communicate();
+
+        if res.returncode != 0:
+            self.logger.warning("Failed to preprocess \"{}\":".format(path));
+            self.logger.warning(stderr.decode("utf-8").strip());
+            return None;
+
+        hasher = hashlib.sha256();
+        hasher.update(hashlib.sha256(stdout).hexdigest().encode("utf-8"));
+        hasher.update(b"\0");
+        hasher.update("\0".join(args).encode("utf-8"));
+
+        return GCCDriver.Source(path, args, hasher.hexdigest());
+
+    # Check that gcc accepts all of `flags` at once, with a single
+    # invocation. If it doesn't, at least one of them is broken (or they
+    # don't go together). By default, the flags are checked on an empty
+    # translation unit. With a `source` (see `get_source`), they are
+    # checked on that instead, which also catches flags that break on
+    # real code.
+    #
+    # Each flag that passes is remembered as accepted, and a single flag
+    # that fails as rejected, for the `source` it was checked on. Flags
+    # that only fail together with others aren't remembered either way.
+    def check_flags(self, flags, source=None):
+        flags = list(flags);
+
+        with self.lock:
+            if source is None:
+                validity = self.flag_validity;
+            else:
+                validity = self.source_validity.setdefault(source.digest, {});
+
+            known = [validity.get(flag) for flag in flags];
+
+        if False in known:
+            return False;
+
+        if len(flags) > 0 and None not in known:
+            return True;
+
         # self.logger.info("check_gcc_flag(): Checking {} variant of {} ({}/{})" \
         #                  .format(flag.flags[state], flag.name, state, flag.n_states - 1));
 
@@ -383,18 +558,115 @@ class GCCDriver:
                "-fno-diagnostics-color",  # Don't leave control codes in stdout/stderr
                "-S",  # Don't worry about the assembler or linker
                "-o", "/dev/null",  # No output
-               flag,
-               "-x", "c",  # Must specify language if taking input from stdin
-               "-"  # Take input from stdin
                ];
 
+        if source is None:
+            cmd += flags + [
+                "-x", "c",  # Must specify language if taking input from stdin
+                "-"  # Take input from stdin
+            ];
+        else:
+            cmd += source.args + flags + [source.path];
+
         res = subprocess.Popen(cmd, stdin=subprocess.DEVNULL,
                                stdout=subprocess.PIPE,
                                stderr=subprocess.PIPE);
 
         stdout, stderr = res.communicate();
 
-        return res.returncode == 0;
+        ok = res.returncode == 0;
+
+        with self.lock:
+            if ok:
+                for flag in flags:
+                    validity[flag] = True;
+            elif len(flags) == 1:
+                validity[flags[0]] = False;
+
+        return ok;
+
+    # What `get_fingerprint` asks gcc to list: every optimisation flag,
+    # parameter and target option, with the value it ends up with.
+    EFFECTIVE_OPTIONS = ["-Q", "--help=optimizers", "--help=params", "--help=target"];
+
+    # Return the name of the option `flag` sets, in the form the
+    # listing of `EFFECTIVE_OPTIONS` uses, e.g. "-ftree-vectorize" for
+    # "-fno-tree-vectorize", or "--param=max-unroll-times=" for
+    # "--param=max-unroll-times=8". Return `None` for anything else.
+    @staticmethod
+    def get_option_name(flag):
+        mo = re.match(r"^(\-\-param=[^=]+=)", flag);
+        if mo:
+            return mo.group(1);
+
+        mo = re.match(r"^(\-[fm])(no\-)?([^=]+)(=?)", flag);
+        if mo:
+            return mo.group(1) + mo.group(3) + mo.group(4);
+
+        return None;
+
+    # Return the names of the options that the listing of
+    # `EFFECTIVE_OPTIONS` covers.
+    def get_listed_options(self):
+        output = self.run_cached(self.EFFECTIVE_OPTIONS);
+        if output is None:
+            return set();
+
+        names = set();
+        for line in output[0].split('\n'):
+            fields = line.split();
+            if len(fields) == 0:
+                continue;
+
+            name = GCCDriver.get_option_name(fields[0]);
+            if name is not None:
+                names.add(name);
+
+        return names;
+
+    # Return a fingerprint of the state the compiler ends up in with
+    # `flags`, or `None` if it doesn't take them.
+    #
+    # The fingerprint is a digest of everything `EFFECTIVE_OPTIONS` lists,
+    # plus, verbatim, whichever of `flags` it doesn't list (e.g.
+    # optimisation levels, or warnings). Command lines with the same
+    # fingerprint differ only in ways that make no difference, such as
+    # setting a parameter to the value the optimisation level already
+    # sets it to, and should build the same binary. Listing the options
+    # is far cheaper than a build.
+    def get_fingerprint(self, flags):
+        key = hashlib.sha256("\0".join(flags).encode("utf-8")).hexdigest();
+
+        with self.lock:
+            if key in self.fingerprints:
+                return self.fingerprints[key];
+
+        listed = self.get_listed_options();
+
+        res = subprocess.Popen([self.cc] + flags + self.EFFECTIVE_OPTIONS,
+                               stdin=subprocess.DEVNULL,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE);
+
+        stdout, stderr = res.communicate();
+
+        if res.returncode != 0:
+            return None;
+
+        hasher = hashlib.sha256();
+        hasher.update(hashlib.sha256(stdout).hexdigest().encode("utf-8"));
+
+        for flag in flags:
+            if GCCDriver.get_option_name(flag) not in listed:
+                hasher.update(b"\0");
+                hasher.update(flag.encode("utf-8"));
+
+        fingerprint = hasher.hexdigest();
+
+        with self.lock:
+            self.fingerprints[key] = fingerprint;
+
+        return fingerprint;
 
 def main():
     # Logging initialization code taken from here:
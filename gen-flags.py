@@ -9,6 +9,7 @@
 
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import os;
 import json
 import logging;
 import argparse;
@@ -34,6 +35,13 @@ parser.add_argument("--base-opt",
                     default=GCCBaseOpt.O2.name,
                     help="C flags to start with. These can help the combined elimination process to find a local optimum faster. If you're trying to minimize size, try 'Os'. If you're trying to maximise performance, try 'O3' or 'Ofast'. Possible values: " + ", ".join([t.name for t in GCCBaseOpt]));
 
+parser.add_argument("--cache-directory", default=os.path.join(os.getcwd(), "workspace", "compilers"),
+                    help="Directory to keep what we find out about the C compiler in, shared"
+                    " with simpletuner.py (default: workspace/compilers).");
+
+parser.add_argument("--no-cache", action="store_true",
+                    help="Ask the C compiler about everything, and don't keep the answers.");
+
 args = parser.parse_args();
 
 def discretise_params(params):
@@ -154,7 +162,7 @@ def main():
         logger.error("You must provide a path to a C compiler. Aborting.");
         exit(1);
 
-    driver = GCCDriver(args.cc);
+    driver = GCCDriver(args.cc, cache_directory=None if args.no_cache else args.cache_directory);
     logger.info("GCC Version: {}".format(driver.get_version()));
     logger.info("GCC Target: {}".format(driver.get_target()));
 
@@ -173,6 +181,8 @@ def main():
     target_flags = get_target_flags();
     flags += target_flags;
 
+    driver.save();
+
     config = {
         'base_opt': base_opt,
         'flags': flags
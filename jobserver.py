@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+# GNU make jobserver
+
+# This file is part of SimpleTuner
+
+# Copyright (C) 2021-2023 Embecosm <www.embecosm.com>
+# Contributor Maxim Blinov <maxim.blinov@embecosm.com>
+
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os, re, select;
+
+from common import get_make_jobs;
+
+# A GNU make jobserver shared by every worker, with `--jobserver`.
+#
+# The jobserver is a pipe holding one token (byte) per job that may
+# run. Every make started with MAKEFLAGS="--jobserver-auth=R,W" takes
+# part: it runs one job for free, and has to read a token from the pipe
+# for every job it runs beyond that, writing it back once the job is
+# done. The driver owns the pipe and fills it with `n_tokens`, and
+# sets MAKEFLAGS before the worker contexts are created, so that all
+# their make invocations share the same budget.
+#
+# Each worker holds a token of its own while it builds, which pays for
+# the free job of its make, and hands it back once the build is done,
+# so that it doesn't hold on to a job while it only benchmarks, or
+# waits for work. With `n_tokens` in the pipe, at most that many build
+# jobs run across all workers at any time, and the cores of idle
+# workers go to the builds that are still running.
+#
+# Without `--jobserver`, any jobserver in MAKEFLAGS belongs to a make
+# that simpletuner.py itself was started from, and has to be dropped
+# with `clear_inherited_jobserver` before any worker context runs make:
+# its file descriptors aren't ours to hand on.
+class JobServer:
+    TOKEN = b"+";
+
+    def __init__(self, n_tokens):
+        self.n_tokens = n_tokens;
+        self.read_fd, self.write_fd = os.pipe();
+
+        for _ in range(n_tokens):
+            os.write(self.write_fd, self.TOKEN);
+
+    # GNU make 4.3 and later make the read end of the pipe non-blocking,
+    # and the pipe is shared with every make we start, so the read may
+    # fail with no token there, or with the token we were told about
+    # taken by someone else first: wait for one, and try again.
+    def acquire(self):
+        while True:
+            try:
+                os.read(self.read_fd, 1);
+                return;
+            except BlockingIOError:
+                select.select([self.read_fd], [], []);
+
+    def release(self):
+        os.write(self.write_fd, self.TOKEN);
+
+    def get_makeflags(self):
+        return "-j{} --jobserver-auth={},{}".format(self.n_tokens, self.read_fd, self.write_fd);
+
+RE_JOBSERVER_AUTH = re.compile(r"--jobserver-auth=([0-9]+),([0-9]+)");
+
+# Any way that a make can pass its jobserver on, including the fifo of
+# GNU make 4.4 and the option name of make before 4.2.
+RE_ANY_JOBSERVER = re.compile(r"\s*--jobserver-(auth|fds)=\S+");
+
+# Remove the jobserver of whatever make we were started from, if any,
+# from MAKEFLAGS.
+def clear_inherited_jobserver():
+    makeflags = os.environ.get("MAKEFLAGS");
+    if makeflags is None:
+        return;
+
+    os.environ["MAKEFLAGS"] = RE_ANY_JOBSERVER.sub("", makeflags);
+
+# Return the file descriptors of the jobserver in MAKEFLAGS, or `()`
+# if there isn't one. Make processes have to be started with these as
+# `pass_fds`, or they can't get at the jobserver.
+def get_jobserver_fds():
+    mo = RE_JOBSERVER_AUTH.search(os.environ.get("MAKEFLAGS", ""));
+    if not mo:
+        return ();
+
+    return (int(mo.group(1)), int(mo.group(2)));
+
+# Return the arguments that worker contexts should run make with to
+# build in parallel: nothing if there is a jobserver, which make picks
+# up from MAKEFLAGS by itself, or their share of the cores otherwise.
+def get_make_args():
+    if len(get_jobserver_fds()) > 0:
+        return [];
+
+    return ["-j{}".format(get_make_jobs())];
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+# Benchmark measurement
+
+# This file is part of SimpleTuner
+
+# Copyright (C) 2021-2023 Embecosm <www.embecosm.com>
+# Contributor Maxim Blinov <maxim.blinov@embecosm.com>
+
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import math;
+import statistics;
+
+# Two-sided 95% critical values of Student's t distribution, by
+# degrees of freedom. Past the end of the table, the normal
+# distribution is close enough.
+T_95 = [None,
+        12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+        2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+        2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042];
+
+def t_95(df):
+    if df < len(T_95):
+        return T_95[df];
+
+    return 1.960;
+
+# The samples of a noisy benchmark, such as an execution time.
+#
+# `ci` is the half-width of the 95% confidence interval of the mean,
+# so the true score lies within `mean` +/- `ci`. It is infinite until
+# there are at least two samples.
+class Measurement:
+    def __init__(self, samples):
+        self.samples = list(samples);
+        self.n = len(self.samples);
+
+        self.mean = statistics.mean(self.samples);
+        self.median = statistics.median(self.samples);
+
+        if self.n > 1:
+            self.stdev = statistics.stdev(self.samples);
+            self.ci = t_95(self.n - 1) * self.stdev / math.sqrt(self.n);
+        else:
+            self.stdev = float('inf');
+            self.ci = float('inf');
+
+    def relative_ci(self):
+        if self.mean == 0:
+            return 0.0 if self.ci == 0 else float('inf');
+
+        return self.ci / abs(self.mean);
+
+    def __str__(self):
+        return "{} +/- {} (median {}, {} samples)".format(self.mean, self.ci, self.median, self.n);
+
+# Call `run` until the confidence interval of the mean of its results
+# is within `max_relative_ci` of the mean, but at least
+# `min_replicates` and at most `max_replicates` times. Return the
+# `Measurement`, or `None` as soon as `run` fails (returns `None`).
+def measure(run, min_replicates=3, max_replicates=10, max_relative_ci=0.01):
+    samples = [];
+
+    while len(samples) < max_replicates:
+        sample = run();
+        if sample is None:
+            return None;
+
+        samples.append(sample);
+
+        if len(samples) >= min_replicates \
+           and Measurement(samples).relative_ci() <= max_relative_ci:
+            break;
+
+    return Measurement(samples);
+
+# Worker contexts' benchmarks return either a plain score, which is
+# taken to be exact, or a `Measurement`. Return `(score, error)` either
+# way, where `error` is the half-width of the confidence interval of
+# `score`.
+def score_and_error(result):
+    if result is None:
+        return (None, None);
+
+    if isinstance(result, Measurement):
+        return (result.mean, result.ci);
+
+    return (result, 0.0);
+
+# Return `True` if score `x` (+/- `x_error`) is lower than score `y`
+# (+/- `y_error`) by more than the noise in both of them can account
+# for.
+def significantly_better(x, x_error, y, y_error):
+    return y - x > math.sqrt(x_error ** 2 + y_error ** 2);
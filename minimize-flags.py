@@ -9,14 +9,29 @@
 
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import os;
 import copy;
 import logging;
 import argparse;
 import importlib;
+import collections;
+import multiprocessing as mp;
+import concurrent.futures;
 from tempfile import TemporaryDirectory;
 
+from cache import ResultCache;
+from common import get_compiler_identity;
+from jobserver import clear_inherited_jobserver;
+from measurement import score_and_error;
+from simpletuner import greater_than_one;
+from simpletuner import lookup_cached_score;
+
 parser = argparse.ArgumentParser(description='Remove redundant compiler flags.');
 
+parser.add_argument("-j", "--processes", type=greater_than_one, default=None,
+                    help="Number of worker contexts to score flags with in"
+                    " parallel (default: number of CPUs).");
+
 parser.add_argument("--cc", default=None,
                     help="C compiler to use for initial flag validation.");
 
@@ -32,6 +47,17 @@ parser.add_argument("--target", required=True, type=float,
 parser.add_argument("--starting-cflags-file", default=None,
                     help="C flags to start with. These can help speed up combined elimination. If you're trying to minimize size, try '-Os'. If you're trying to maximise performance, try '-O3' or '-Ofast'.");
 
+parser.add_argument("--cache-file", default=None,
+                    help="SQLite database of benchmark results shared with"
+                    " simpletuner.py (default: workspace/cache.sqlite3).");
+
+parser.add_argument("--cache-size", type=int, default=1000000,
+                    help="Keep at most this many binaries and command lines"
+                    " in the --cache-file (default: 1000000).");
+
+parser.add_argument("--no-cache", action="store_true",
+                    help="Don't use or update the --cache-file.");
+
 args = parser.parse_args();
 
 def get_worker_context_class(worker_context_classname):
@@ -41,50 +67,174 @@ def get_worker_context_class(worker_context_classname):
 
     return WorkerContext;
 
-def minimize(input_flags, target, worker):
-    current_flags = copy.deepcopy(input_flags);
-    compulsory_flags = [];
+# Return `(score, error)` for `flags`, or `None` if they fail to build
+# or benchmark. Binaries that have been scored before, by this run
+# (`binary_checksum_result_cache`) or an earlier one (`result_cache`,
+# if there is one), aren't benchmarked again. In particular, once a
+# binary is known to hit the target, every other set of flags that
+# builds it does too, without running anything.
+def evaluate(worker, flags, binary_checksum_result_cache, result_cache):
+    if result_cache is not None:
+        checksum = result_cache.get_checksum(flags);
+
+        if checksum is not None:
+            cached = lookup_cached_score(checksum, binary_checksum_result_cache, result_cache);
+            if cached is not None:
+                logging.debug("Hit cache result {} for flags \"{}\"".format(cached, " ".join(flags)));
+                return cached;
+
+    compile_result = worker.compile(flags);
+    if not compile_result.ok:
+        return None;
+
+    if result_cache is not None:
+        result_cache.put_checksum(flags, compile_result.checksum);
+
+    cached = lookup_cached_score(compile_result.checksum, binary_checksum_result_cache, result_cache);
+    if cached is not None:
+        logging.debug("Hit cache result {} for binary \"{}\"".format(cached, compile_result.checksum));
+        return cached;
+
+    score, error = score_and_error(worker.benchmark());
+
+    if score is None:
+        return None;
+
+    binary_checksum_result_cache[compile_result.checksum] = (score, error);
+
+    if result_cache is not None:
+        result_cache.put_score(compile_result.checksum, score, error);
+
+    return (score, error);
+
+# Whether `result`, a `(score, error)` from `evaluate`, hits `target`.
+# Scores that are measured rather than counted (see `Measurement`)
+# are means that come out slightly different every time, so a score
+# hits the target if the target is within its error of it.
+def hits_target(result, target):
+    if result is None:
+        return False;
+
+    score, error = result;
+    return abs(score - target) <= (error or 0.0);
+
+# Jobs are tuples of flags, results are `(flags, (score, error))`.
+def worker_func(worker, work_queue, result_queue, binary_checksum_result_cache, result_cache):
+    while True:
+        flags = work_queue.get(block=True);
+
+        if flags is None:
+            return;
+
+        result = evaluate(worker, list(flags), binary_checksum_result_cache, result_cache);
+        result_queue.put((flags, result), block=False);
+
+# Scores sets of flags on the workers, remembering every score.
+class Evaluator:
+    def __init__(self, n_workers, work_queue, result_queue):
+        self.n_workers = n_workers;
+        self.work_queue = work_queue;
+        self.result_queue = result_queue;
+
+        # flags -> (score, error), or `None`
+        self.scores = {};
+
+        # Sets of flags handed to the workers whose score we don't have
+        # yet. We never hand out more than there are workers, so that
+        # there's no backlog of jobs to wait for once we know the answer.
+        self.in_flight = set();
+
+    def collect(self):
+        flags, result = self.result_queue.get(block=True);
+        self.in_flight.discard(flags);
+        self.scores[flags] = result;
+
+    # Return the index of the first of `candidates` that hits `target`
+    # (see `hits_target`), or `None` if none of them do. The candidates are scored
+    # in parallel, in order, and as soon as every candidate up to a hit
+    # has been scored, that's the answer: the rest aren't waited for.
+    def first_hit(self, candidates, target):
+        candidates = [tuple(flags) for flags in candidates];
+        pending = collections.deque(candidates);
+
+        while True:
+            for idx, flags in enumerate(candidates):
+                if flags not in self.scores:
+                    break;
 
-    while len(current_flags) > 0:
-        compile_ok = worker.compile([] + compulsory_flags);
-        result = worker.benchmark();
+                if hits_target(self.scores[flags], target):
+                    return idx;
+            else:
+                return None;
 
-        benchmark_ok = compile_ok and (result == target);
+            while len(self.in_flight) < self.n_workers and len(pending) > 0:
+                flags = pending.popleft();
 
-        if benchmark_ok:
-            break;
+                if flags in self.scores or flags in self.in_flight:
+                    continue;
 
-        idx_mid = len(current_flags) // 2;
-        while not benchmark_ok:
-            include = current_flags[:idx_mid];
-            exclude = current_flags[idx_mid:];
+                self.work_queue.put(flags, block=False);
+                self.in_flight.add(flags);
 
-            logging.debug("include: " + ", ".join(include));
-            logging.debug("exclude: " + ", ".join(exclude));
+            self.collect();
 
-            compile_ok = worker.compile(include + compulsory_flags);
-            result = worker.benchmark();
-            benchmark_ok = compile_ok and (result == target);
+    # Collect the results still in flight.
+    def drain(self):
+        while len(self.in_flight) > 0:
+            self.collect();
 
-            if not benchmark_ok:
-                if len(exclude) == 1:
-                    compulsory_flag = exclude[0];
+# Delta debugging (ddmin): return a subset of `input_flags` that still
+# scores `target`, and from which no single flag can be removed
+# without missing it.
+#
+# The flags are split into `n` chunks. If one of the chunks on its own
+# hits the target, carry on with just that chunk; if leaving one of the
+# chunks out hits it, carry on without that chunk. Otherwise, split
+# into twice as many chunks, until they are single flags. All the
+# chunks and complements of a round are scored in parallel.
+def minimize(input_flags, target, evaluator):
+    flags = list(input_flags);
 
-                    logging.debug("Found failing flag: " + compulsory_flag);
-                    compulsory_flags.append(compulsory_flag);
-                    del current_flags[idx_mid:];
-                    break;
+    hit = evaluator.first_hit([[], flags], target);
 
-                logging.debug("Build failed");
-                idx_mid = (idx_mid + len(current_flags)) // 2;
+    if hit == 0:
+        logging.info("No flags at all hit the target");
+        return [];
 
-            else:
-                logging.debug("Build success");
-                del current_flags[idx_mid:];
+    if hit is None:
+        logging.error("The starting flags don't hit the target of {}: Nothing to minimize"\
+                      .format(target));
+        return flags;
+
+    n = 2;
+    while len(flags) >= 2:
+        chunks = [flags[len(flags) * i // n:len(flags) * (i + 1) // n] for i in range(n)];
+
+        # With two chunks, the complements are the chunks themselves.
+        complements = [];
+        if n > 2:
+            complements = [[flag for j, chunk in enumerate(chunks) if j != i for flag in chunk]
+                           for i in range(n)];
+
+        hit = evaluator.first_hit(chunks + complements, target);
+
+        if hit is None:
+            if n >= len(flags):
                 break;
 
-    logging.info("We're done - compulsory flags: " + str(compulsory_flags));
-    return compulsory_flags;
+            n = min(2 * n, len(flags));
+        elif hit < len(chunks):
+            flags = chunks[hit];
+            n = 2;
+        else:
+            flags = complements[hit - len(chunks)];
+            n = max(n - 1, 2);
+
+        logging.info("{} flags left, {} chunks, {} sets of flags scored"\
+                     .format(len(flags), n, len(evaluator.scores)));
+
+    logging.info("We're done - compulsory flags: " + str(flags));
+    return flags;
 
 def main():
     logging.basicConfig(
@@ -119,17 +269,84 @@ def main():
     else:
         logger.info("Will be using the benchmark \"{}\"".format(args.benchmark));
 
-    workspace = TemporaryDirectory();
-    logger.info("Using temporary workspace directory \"{}\"".format(workspace.name));
-
-    worker = WorkerContext(0, workspace.name, args.cc, args.benchmark);
-    worker.init_workspace();
-
     with open(args.starting_cflags_file, "r") as file:
         raw = file.read();
         starting_flags = [e.strip() for e in raw.split()]
 
-    minimized_flags = minimize(starting_flags, args.target, worker);
+    if args.no_cache:
+        result_cache = None;
+    elif args.cc is None:
+        # Cached results are only valid for the compiler that built the
+        # binaries, and we don't know which one the worker context uses.
+        logger.warning("No --cc given: Not using the result cache");
+        result_cache = None;
+    else:
+        path_cache = args.cache_file;
+        if path_cache is None:
+            os.makedirs(os.path.join(os.getcwd(), 'workspace'), exist_ok=True);
+            path_cache = os.path.join(os.getcwd(), 'workspace', 'cache.sqlite3');
+
+        logger.info("Using result cache \"{}\"".format(path_cache));
+        result_cache = ResultCache(path_cache, get_compiler_identity(args.cc),
+                                   worker_context_classname, args.benchmark,
+                                   max_entries=args.cache_size);
+
+    n_workers = args.processes if args.processes is not None else mp.cpu_count();
+
+    # Share the cores out between the workers' builds (see `common.get_make_jobs`).
+    os.environ["SIMPLETUNER_MAKE_JOBS"] = str(max(1, mp.cpu_count() // n_workers));
+    clear_inherited_jobserver();
+
+    workspace = TemporaryDirectory();
+    logger.info("Using temporary workspace directory \"{}\" with {} workers"\
+                .format(workspace.name, n_workers));
+
+    worker_ctxs = [];
+    for idx in range(n_workers):
+        worker_workspace = os.path.join(workspace.name, str(idx));
+        os.makedirs(worker_workspace);
+
+        worker_ctxs.append(WorkerContext(idx, worker_workspace, args.cc, args.benchmark));
+
+    # Set the workspaces up in parallel, as simpletuner.py does.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_workers) as executor:
+        init_workspaces_ok = list(executor.map(lambda worker: worker.init_workspace(), worker_ctxs));
+
+    for idx, ok in enumerate(init_workspaces_ok):
+        if not ok:
+            logger.error("Worker context #{} failed to initialize its workspace directory, aborting"\
+                         .format(idx));
+            exit(1);
+
+    # Binary checksum -> (score, error), shared between the workers.
+    manager = mp.Manager();
+    binary_checksum_result_cache = manager.dict();
+
+    work_queue = mp.Queue();
+    result_queue = mp.Queue();
+
+    workers = [mp.Process(target=worker_func,
+                          args=(worker, work_queue, result_queue,
+                                binary_checksum_result_cache, result_cache))
+               for worker in worker_ctxs];
+
+    for worker in workers:
+        worker.daemon = True;
+        worker.start();
+
+    evaluator = Evaluator(n_workers, work_queue, result_queue);
+
+    minimized_flags = minimize(starting_flags, args.target, evaluator);
+
+    evaluator.drain();
+    for worker in workers:
+        work_queue.put(None, block=False);
+    for worker in workers:
+        worker.join();
+
+    if result_cache is not None:
+        result_cache.evict();
+        result_cache.close();
     print("Reduced flags:");
     for flag in minimized_flags:
         print(flag);
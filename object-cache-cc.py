@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+# Compiler wrapper for the object cache
+
+# This file is part of SimpleTuner
+
+# Copyright (C) 2021-2023 Embecosm <www.embecosm.com>
+# Contributor Maxim Blinov <maxim.blinov@embecosm.com>
+
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Worker contexts that build with make can't call `ObjectCache` for
+# each translation unit themselves. Instead, they prefix the compiler
+# with this script, the way ccache is used:
+#
+#   make CC="/path/to/object-cache-cc.py riscv32-unknown-elf-gcc"
+#
+# or, so that objects can be shared between workspaces (see
+# `ObjectCache`),
+#
+#   make CC="/path/to/object-cache-cc.py --workspace WORKSPACE riscv32-unknown-elf-gcc"
+#
+# Plain compiles of a single source file to an object go through the
+# object cache in SIMPLETUNER_OBJECT_CACHE. Anything else (linking,
+# preprocessing, generating dependencies, several sources at once) is
+# handed straight to the compiler, as is everything when there is no
+# object cache.
+
+import os, sys;
+import logging;
+
+from common import get_object_cache;
+
+SOURCE_EXTENSIONS = [".c", ".i", ".s", ".S", ".cc", ".cpp", ".cxx"];
+
+# Options that take their value as the next argument.
+OPTIONS_WITH_VALUES = ["-o", "-x", "-D", "-U", "-I", "-isystem", "-iquote", "-idirafter",
+                       "-include", "-imacros", "-MF", "-MT", "-MQ", "-Xlinker",
+                       "-Xassembler", "-Xpreprocessor", "-aux-info"];
+
+# Return `(source, output, flags)` if `args` compile a single source
+# file to an object file, or `None` otherwise.
+def parse_args(args):
+    if "-c" not in args:
+        return None;
+
+    sources = [];
+    output = None;
+    flags = [];
+
+    idx = 0;
+    while idx < len(args):
+        arg = args[idx];
+
+        if arg == "-o" and idx + 1 < len(args):
+            output = args[idx + 1];
+            idx += 2;
+            continue;
+
+        if arg in OPTIONS_WITH_VALUES and idx + 1 < len(args):
+            flags += args[idx:idx + 2];
+            idx += 2;
+            continue;
+
+        # Dependency files are a side effect of preprocessing, which
+        # doesn't happen when an object comes out of the cache.
+        if arg.startswith("-M") or arg == "-":
+            return None;
+
+        if arg == "-c":
+            pass;
+        elif not arg.startswith("-") and os.path.splitext(arg)[1] in SOURCE_EXTENSIONS:
+            sources.append(arg);
+        else:
+            flags.append(arg);
+
+        idx += 1;
+
+    if len(sources) != 1:
+        return None;
+
+    if output is None:
+        output = os.path.splitext(os.path.basename(sources[0]))[0] + ".o";
+
+    return (sources[0], output, flags);
+
+def main():
+    argv = sys.argv[1:];
+
+    workspace = None;
+    if len(argv) >= 2 and argv[0] == "--workspace":
+        workspace = argv[1];
+        argv = argv[2:];
+
+    if len(argv) < 1:
+        print("usage: {} [--workspace WORKSPACE] CC [ARGS...]".format(sys.argv[0]), file=sys.stderr);
+        sys.exit(2);
+
+    logging.basicConfig(format="[%(asctime)s] [%(levelname)s] %(name)s: %(message)s");
+
+    cc = argv[0];
+    args = argv[1:];
+
+    object_cache = get_object_cache(cc, workspace=workspace);
+    parsed = parse_args(args);
+
+    if object_cache is None or parsed is None:
+        os.execvp(cc, [cc] + args);
+
+    source, output, flags = parsed;
+
+    sys.exit(0 if object_cache.compile(source, output, flags, os.getcwd()) else 1);
+
+if __name__ == "__main__":
+    main()
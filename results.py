@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+# Result bookkeeping
+
+# This file is part of SimpleTuner
+
+# Copyright (C) 2021-2023 Embecosm <www.embecosm.com>
+# Contributor Maxim Blinov <maxim.blinov@embecosm.com>
+
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import heapq;
+
+# Scores of the state variations of one iteration.
+#
+# Results arrive in whatever order the workers finish them, so they
+# are keyed by `(flag_idx, state)`, and the best variation of each flag
+# is kept up to date as they come in. That way the driver never has to
+# search through the results of an iteration, picking promotions and
+# exclusions only looks at as many results as it needs, and the full
+# list is only sorted once, when the iteration is written out.
+class IterationResults:
+    def __init__(self):
+        self.scores = {};
+        self.errors = {};
+        self.checksums = {};
+
+        # flag_idx -> (state, score) of the best variation of that flag
+        self.best_per_flag = {};
+        self.best_score = float('inf');
+        self.best_error = 0.0;
+
+    def __len__(self):
+        return len(self.scores);
+
+    def __contains__(self, state_variation):
+        return state_variation in self.scores;
+
+    def record(self, state_variation, score, checksum, error=0.0):
+        flag_idx, state = state_variation;
+
+        self.scores[state_variation] = score;
+        self.errors[state_variation] = error;
+        self.checksums[state_variation] = checksum;
+
+        best = self.best_per_flag.get(flag_idx);
+        if best is None or score < best[1]:
+            self.best_per_flag[flag_idx] = (state, score);
+
+        if score < self.best_score:
+            self.best_score = score;
+            self.best_error = error;
+
+    def get_score(self, state_variation):
+        return self.scores[state_variation];
+
+    def get_error(self, state_variation):
+        return self.errors[state_variation];
+
+    def get_checksum(self, state_variation):
+        return self.checksums[state_variation];
+
+    # Return every `(state_variation, score)` pair, best first.
+    def sorted(self):
+        return sorted(self.scores.items(), key=lambda e: e[1]);
+
+    # Return up to `n` of the worst `(state_variation, score)` pairs
+    # scoring worse than `threshold`, worst last.
+    def worst(self, n, threshold):
+        worst = heapq.nlargest(n, self.scores.items(), key=lambda e: e[1]);
+        worst.reverse();
+        return [e for e in worst if e[1] > threshold];
+
+    # Return up to `n` `(state_variation, score)` pairs, each of a
+    # different flag and scoring better than `threshold`, best first.
+    def best_of_distinct_flags(self, n, threshold):
+        best = heapq.nsmallest(n, self.best_per_flag.items(), key=lambda e: e[1][1]);
+
+        return [((flag_idx, state), score)
+                for flag_idx, (state, score) in best
+                if score < threshold];
@@ -11,14 +11,25 @@
 
 import sys, os, re;
 
+from simpletuner import parse_leaderboard_line;
+
 def main():
     results = [];
 
     with open(sys.argv[1], "r") as file:
         for line in file:
             line = line.strip();
-            flags, score = line.split(",");
-            results.append((flags, float(score)));
+
+            # Flags can contain commas themselves (-Wl,...), so leave
+            # the parsing to simpletuner.py.
+            try:
+                flags, score, error = parse_leaderboard_line(line);
+            except ValueError:
+                # Most likely the last line, cut short by whatever
+                # interrupted the run.
+                continue;
+
+            results.append((flags, score));
 
     results.sort(key=lambda x: x[1], reverse=False);
 
@@ -11,15 +11,35 @@
 
 import os, sys, re, time, random, subprocess, shutil, string, json;
 from datetime import datetime;
-import copy;
 import random;
 import logging;
+import collections;
 import multiprocessing as mp;
 import argparse;
 import importlib;
+import concurrent.futures;
 
 from flag import Flag;
 from gcc import GCCDriver;
+from cache import ResultCache;
+from common import get_compiler_identity;
+from common import ObjectCache;
+from common import JOB_BENCHMARK;
+from common import JOB_REMEASURE;
+from common import JOB_COMPILE;
+from common import JOB_CHEAP;
+from common import JOB_PROBE;
+from jobserver import JobServer;
+from jobserver import clear_inherited_jobserver;
+from conflicts import ConflictTable;
+from config import load_config_from_filename;
+from config import create_cmd_from_states;
+from config import create_cmd_parts;
+from config import create_cmd_from_parts;
+from config import apply_variation;
+from config import write_config;
+from strategy.GroupTesting import GroupTesting;
+from measurement import score_and_error;
 
 # See: https://stackoverflow.com/a/13941865 - we need this to catch
 # `queue.Empty` exceptions
@@ -34,14 +54,46 @@ def greater_than_one(value):
             "{} must be an integer greater than 1".format(value));
     return ivalue
 
+def non_negative(value):
+    ivalue = int(value)
+    if ivalue < 0:
+        raise argparse.ArgumentTypeError(
+            "{} must be a non-negative integer".format(value));
+    return ivalue
+
+def fraction(value):
+    fvalue = float(value)
+    if fvalue <= 0.0 or fvalue > 1.0:
+        raise argparse.ArgumentTypeError(
+            "{} must be a number in the range (0, 1]".format(value));
+    return fvalue
+
 
 parser.add_argument("-j", "--processes", type=greater_than_one,
                     default=None, # Will use mp.cpu_count();
                     help="Number of processes to spawn");
 
+parser.add_argument("--core-budget", type=greater_than_one, default=None,
+                    metavar="N",
+                    help="Number of cores that the builds of all the workers"
+                    " together may use. Each worker context runs its builds"
+                    " with an even share of them, if it can build in parallel"
+                    " (default: number of CPUs).");
+
+parser.add_argument("--jobserver", action="store_true",
+                    help="Share a GNU make jobserver of --core-budget jobs"
+                    " between the workers, instead of giving each worker a"
+                    " fixed share of the cores. Builds that are still running"
+                    " then get the cores of idle workers.");
+
 parser.add_argument("--context", default=None,
                     help="Specify which worker context class to use. This is a user-defined classname.");
 
+parser.add_argument("--strategy", default="CombinedElimination",
+                    help="Specify which search strategy to use: a class in"
+                    " the strategy/ directory, such as CombinedElimination"
+                    " (the default), GeneticAlgorithm or HillClimbing.");
+
 parser.add_argument("--benchmark", default=None,
                     help="Specify which benchmark to run. This parameter is specific to whatever worker context you selected in the --context parameter.");
 
@@ -51,63 +103,379 @@ parser.add_argument("--config", default=None, dest="path_config",
 parser.add_argument("--cc", default=None, dest="path_cc",
                     help="C compiler to use for initial flag validation.");
 
+parser.add_argument("--no-source-check", action="store_true",
+                    help="Don't check the flags against the worker context's"
+                    " own sources before the run. Flags are still checked"
+                    " on an empty translation unit.");
+
 parser.add_argument("--setup-workspace-only", action="store_true",
                     help="Exit after setting up a workspace for each"
                     " worker thread. Useful for when debugging your"
                     " worker context's `init_workspace` procedure.");
 
-args = parser.parse_args();
+parser.add_argument("--resume", default=None, metavar="RUN_DIRECTORY",
+                    help="Resume an interrupted run from the last"
+                    " iteration.N.config in RUN_DIRECTORY, reusing its"
+                    " worker directories and the results recorded in its"
+                    " global_leaderboard.live. --cc, --context and"
+                    " --benchmark must match those of the original run.");
+
+parser.add_argument("--workspace-tmpfs", nargs="?", const="/dev/shm", default=None,
+                    metavar="DIRECTORY",
+                    help="Put the worker directories on a RAM-backed file"
+                    " system, such as a tmpfs (default: /dev/shm). The run"
+                    " directory stays where it is, and links to them. They"
+                    " are deleted at the end of the run.");
+
+parser.add_argument("--streaming", action="store_true",
+                    help="Don't wait for every state variation of an"
+                    " iteration to finish before promoting. Instead, decide"
+                    " as soon as --streaming-quorum of the variations have"
+                    " been scored and one of them beats the baseline, and"
+                    " immediately start dispatching variations of the updated"
+                    " configuration to free workers.");
+
+parser.add_argument("--streaming-quorum", type=fraction, default=0.5,
+                    help="Fraction of an iteration's state variations that"
+                    " must have been scored before --streaming is allowed to"
+                    " promote (default: 0.5).");
+
+parser.add_argument("--verify-baseline-every", type=greater_than_one, default=None,
+                    metavar="N",
+                    help="The baseline of each iteration is normally the score"
+                    " of the variation that was promoted in the previous"
+                    " iteration. For noisy benchmarks, re-measure the baseline"
+                    " from scratch every N iterations instead.");
+
+parser.add_argument("--dormant-after", type=greater_than_one, default=None,
+                    metavar="K",
+                    help="Stop testing a state variation once it has built a"
+                    " binary identical to the baseline's in K consecutive"
+                    " iterations. Dormant variations are re-probed every"
+                    " --reprobe-dormant-every iterations, and whenever a"
+                    " related flag is promoted.");
+
+parser.add_argument("--reprobe-dormant-every", type=greater_than_one, default=5,
+                    metavar="N",
+                    help="Test dormant state variations again every N"
+                    " iterations (default: 5).");
+
+parser.add_argument("--halving-fraction", type=fraction, default=None,
+                    metavar="F",
+                    help="Screen every state variation with the worker"
+                    " context's cheap benchmark first, and only run the real"
+                    " benchmark on the best fraction F of them. The worker"
+                    " context must implement benchmark_cheap().");
+
+parser.add_argument("--surrogate", action="store_true",
+                    help="Test the state variations of each iteration in the"
+                    " order that a model of the results of earlier iterations"
+                    " expects to do best.");
+
+parser.add_argument("--surrogate-top-k", type=greater_than_one, default=None,
+                    metavar="K",
+                    help="Implies --surrogate. Only test the K state variations"
+                    " that the model expects to do best, plus a random"
+                    " --surrogate-explore share of the rest.");
+
+parser.add_argument("--surrogate-explore", type=fraction, default=0.05,
+                    metavar="F",
+                    help="Share of the state variations left out by"
+                    " --surrogate-top-k to test anyway, at random (default: 0.05).");
+
+parser.add_argument("--canonicalise-flags", action="store_true",
+                    help="Before building a job, ask the compiler what state"
+                    " its flags leave it in (with -Q --help=optimizers,"
+                    " params and target), and reuse the result of any"
+                    " earlier build whose flags leave it in the same state.");
+
+parser.add_argument("--no-conflicts", action="store_true",
+                    help="Don't learn which combinations of flags fail to"
+                    " build, and keep building them (see conflicts.py).");
+
+parser.add_argument("--group-testing", action="store_true",
+                    help="Before Combined Elimination, find the state variations"
+                    " that don't change the binary by compiling groups of them"
+                    " together, and start them out as dormant.");
+
+parser.add_argument("--group-size", type=greater_than_one, default=16,
+                    metavar="N",
+                    help="Compile up to N state variations together with"
+                    " --group-testing (default: 16).");
+
+parser.add_argument("--cache-file", default=None,
+                    help="SQLite database in which to keep benchmark results"
+                    " across runs (default: workspace/cache.sqlite3).");
+
+parser.add_argument("--cache-size", type=greater_than_one, default=1000000,
+                    metavar="N",
+                    help="Keep at most N binaries and N command lines in the"
+                    " --cache-file, and N objects in the object cache,"
+                    " evicting the least recently used ones (default: 1000000).");
+
+parser.add_argument("--no-cache", action="store_true",
+                    help="Don't use or update the --cache-file, the"
+                    " object cache in workspace/objects, nor the compiler"
+                    " cache in workspace/compilers.");
+
+parser.add_argument("--max-promotions", type=greater_than_one, default=1,
+                    metavar="N",
+                    help="Promote up to N improving flags per iteration. If"
+                    " more than one flag is up for promotion, their"
+                    " combination is scored first, and backed off to a"
+                    " smaller set if it does worse than the best single"
+                    " flag (default: 1).");
+
+parser.add_argument("--max-exclusions", type=non_negative, default=3,
+                    metavar="N",
+                    help="Exclude the N worst scoring state variations from"
+                    " further consideration after every iteration, as long as"
+                    " they do worse than the baseline (default: 3).");
+
+parser.add_argument("--seed", type=int, default=0,
+                    help="Seed for the random choices of --strategy"
+                    " GeneticAlgorithm and HillClimbing (default: 0).");
+
+parser.add_argument("--population", type=greater_than_one, default=32,
+                    metavar="N",
+                    help="Number of configurations in each generation of"
+                    " --strategy GeneticAlgorithm (default: 32).");
+
+parser.add_argument("--generations", type=greater_than_one, default=50,
+                    metavar="N",
+                    help="Number of generations that --strategy"
+                    " GeneticAlgorithm breeds (default: 50).");
+
+parser.add_argument("--neighbours", type=greater_than_one, default=16,
+                    metavar="N",
+                    help="Number of single flag changes that --strategy"
+                    " HillClimbing tries at each step (default: 16).");
+
+parser.add_argument("--restarts", type=non_negative, default=5,
+                    metavar="N",
+                    help="Number of times --strategy HillClimbing restarts"
+                    " from a random perturbation of the best configuration"
+                    " when it gets stuck (default: 5).");
+
+args = None;
 
 workspace_file_all = None;
 workspace_file_stdout = None;
 workspace_file_stderr = None;
 
-def check_cc_flags_worker(work_queue, result_queue):
-    while True:
-        work = work_queue.get(block=True);
-        if work is None:
-            return;
+# Return which of `states`, a list of `(flag_idx, state)` of `config`,
+# fail `check`, which takes a list of flag values and returns whether
+# they all passed. Also return how many batches were checked.
+#
+# Rather than running the compiler once per flag value, the values are
+# checked in batches of up to `CHECK_BATCH_SIZE` at a time, with at most
+# one state of each flag per batch (so that e.g. "-ffoo" and
+# "-fno-foo" never meet). Almost every batch passes, and only a batch
+# that fails gets split in half and checked again, until we are down
+# to the values that fail on their own. Values that only fail in
+# combination with others end up passing, just as they would when
+# checked one by one.
+#
+# Up to `n_workers` batches are checked at once.
+CHECK_BATCH_SIZE = 64;
 
-        flag, flag_idx, state, driver = work;
-        ok = driver.check_flag(flag.values[flag.state]);
+def find_rejected_states(config, states, check, n_workers):
+    # Layer k holds the k-th of the states of every flag that has one.
+    layers = [];
+    n_flag_states = {};
+    for flag_idx, state in states:
+        k = n_flag_states.get(flag_idx, 0);
+        n_flag_states[flag_idx] = k + 1;
 
-        result_queue.put((flag, flag_idx, state, ok), block=False);
+        if k == len(layers):
+            layers.append([]);
+        layers[k].append((flag_idx, state));
 
-def check_cc_flags(driver, config):
-    work_queue = mp.Queue();
-    result_queue = mp.Queue();
-    n_workers = mp.cpu_count();
+    # Small enough to keep every worker busy, though.
+    batch_size = max(1, min(CHECK_BATCH_SIZE, -(-len(states) // n_workers)));
 
-    workers = [mp.Process(name="check_cc_flags_worker#" + str(i),
-                          target=check_cc_flags_worker,
-                          args=(work_queue, result_queue))
-               for i in range(n_workers)];
+    batches = [layer[idx:idx + batch_size]
+               for layer in layers
+               for idx in range(0, len(layer), batch_size)];
 
-    for worker in workers:
-        worker.daemon = True;
-        worker.start();
+    def check_batch(batch):
+        values = [config.flags[flag_idx].values[state] for flag_idx, state in batch];
+        return (batch, check(values));
+
+    n_batches = 0;
+    rejected = [];
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_workers) as executor:
+        pending = set(executor.submit(check_batch, batch) for batch in batches);
 
-    for flag_idx, flag in enumerate(config.flags):
-        for state in flag.all_states():
-            work_queue.put((flag, flag_idx, state, driver), block=False);
+        while len(pending) > 0:
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED);
 
-    for _ in range(n_workers):
-        work_queue.put(None, block=False);
+            for future in done:
+                batch, ok = future.result();
+                n_batches += 1;
 
-    for _ in config.flags:
-        flag, flag_idx, state, ok = result_queue.get(block=True);
+                if ok:
+                    continue;
 
-        if not ok:
-            config.flags[flag_idx].exclusions = config.flags[flag_idx].exclusions.union({state});
+                if len(batch) == 1:
+                    rejected.append(batch[0]);
+                    continue;
+
+                half = len(batch) // 2;
+                pending.add(executor.submit(check_batch, batch[:half]));
+                pending.add(executor.submit(check_batch, batch[half:]));
+
+    return (rejected, n_batches);
+
+# Check every state of every flag in `config` against the compiler, and
+# exclude the ones it rejects.
+def check_cc_flags(driver, config, n_workers):
+    logger = logging.getLogger("SimpleTuner-Driver");
+
+    states = [(flag_idx, state)
+              for flag_idx, flag in enumerate(config.flags)
+              for state in flag.all_states()];
+
+    excluded, n_batches = find_rejected_states(config, states, driver.check_flags, n_workers);
+
+    for flag_idx, state in excluded:
+        logger.debug("Excluding \"{}\": rejected by the compiler"\
+                     .format(config.flags[flag_idx].values[state]));
+
+        config.flags[flag_idx].exclusions = config.flags[flag_idx].exclusions.union({state});
+
+    logger.info("Checked {} flag values in {} batches: {} rejected"\
+                .format(len(states), n_batches, len(excluded)));
 
     return config;
 
-def worker_func(worker_ctx, work_queue, result_queue, binary_checksum_result_cache):
+# Check every valid state of every flag in `config` against the
+# representative sources of the worker context (see
+# `get_validation_sources` in context/ExampleWorkerContext.py), on top
+# of the base optimisation level, and exclude the ones that fail to
+# compile any of them. This finds the flags that only break on real
+# code, e.g. by crashing the compiler, before they cost a full build
+# each in the middle of the run.
+#
+# Sources that don't compile to begin with are left out. If every state
+# of a flag fails, the flag is left alone: the baseline won't build
+# either, and the run has to say so.
+def check_cc_flags_on_sources(driver, config, validation_sources, n_workers):
+    logger = logging.getLogger("SimpleTuner-Driver");
+
+    sources = [];
+    for path, source_args in validation_sources:
+        source = driver.get_source(path, [config.base_opt] + source_args);
+
+        if source is None or not driver.check_flags([], source):
+            logger.warning("Not checking flags against \"{}\": it doesn't compile with \"{}\""\
+                           .format(path, " ".join([config.base_opt] + source_args)));
+            continue;
+
+        sources.append(source);
+
+    if len(sources) == 0:
+        return config;
+
+    states = [(flag_idx, state)
+              for flag_idx, flag in enumerate(config.flags)
+              for state in flag.valid_states()];
+
+    def check(values):
+        return all(driver.check_flags(values, source) for source in sources);
+
+    excluded, n_batches = find_rejected_states(config, states, check, n_workers);
+
+    by_flag = {};
+    for flag_idx, state in excluded:
+        by_flag.setdefault(flag_idx, []).append(state);
+
+    n_excluded = 0;
+    for flag_idx, states_excluded in sorted(by_flag.items()):
+        flag = config.flags[flag_idx];
+
+        if len(states_excluded) == len(flag.valid_states()):
+            logger.warning("Every state of \"{}\" fails to compile the worker context's sources"\
+                           .format(flag.name));
+            continue;
+
+        for state in states_excluded:
+            logger.debug("Excluding \"{}\": fails to compile the worker context's sources"\
+                         .format(flag.values[state]));
+
+        flag.exclusions = flag.exclusions.union(set(states_excluded));
+        n_excluded += len(states_excluded);
+
+        if flag.state in flag.exclusions:
+            flag.state = flag.valid_states()[0];
+
+    logger.info("Checked {} flag values against {} sources in {} batches: {} excluded"\
+                .format(len(states), len(sources), n_batches, n_excluded));
+
+    return config;
+
+# Workers don't get sent command lines. Each worker holds the flag
+# values of the config from the start, plus the flag states of the
+# configuration of the current iteration, which the driver broadcasts
+# through the worker's own `config_queue` whenever it changes. A job is
+# then just `(iteration, variation, mode)`, and the worker builds the
+# command line itself. The job `mode` is one of the JOB_* modes in
+# common.py.
+#
+# Results are `(iteration, variation, mode, score, error, checksum,
+# skipped)`, where `error` is the half-width of the confidence interval
+# of `score` (see measurement.py), or 0 if the score is exact.
+
+# Look `checksum` up in the run's own cache first, then in the
+# persistent one (if any). Return `(score, error)`, or `None`.
+def lookup_cached_score(checksum, binary_checksum_result_cache, result_cache):
+    if checksum in binary_checksum_result_cache:
+        return binary_checksum_result_cache[checksum];
+
+    if result_cache is None:
+        return None;
+
+    cached = result_cache.get_score(checksum);
+    if cached is not None:
+        binary_checksum_result_cache[checksum] = cached;
+
+    return cached;
+
+# Look up the checksum of the binary that some command line with
+# `fingerprint` built, the same way. Return it, or `None`.
+def lookup_fingerprint_checksum(fingerprint, binary_checksum_result_cache, result_cache):
+    key = ("fingerprint", fingerprint);
+    if key in binary_checksum_result_cache:
+        return binary_checksum_result_cache[key];
+
+    if result_cache is None:
+        return None;
+
+    checksum = result_cache.get_fingerprint_checksum(fingerprint);
+    if checksum is not None:
+        binary_checksum_result_cache[key] = checksum;
+
+    return checksum;
+
+# With --canonicalise-flags, `driver` is a `GCCDriver`, and jobs whose
+# flags have the same fingerprint (see `GCCDriver.get_fingerprint`) as
+# flags that were built before reuse what those got, without building
+# anything. The fingerprint covers the flags the compiler actually
+# sees, which worker contexts that add flags of their own return from
+# `get_effective_flags`.
+def worker_func(worker_ctx, base_opt, flag_values, work_queue, config_queue, result_queue,
+                binary_checksum_result_cache, result_cache, replayed_results, jobserver,
+                driver):
     idx = worker_ctx.idx;
     logger = logging.getLogger("Worker#{}".format(idx));
 
     logger.debug("Started");
-    
+
+    iteration = None;
+    states = None;
+
     while True:
         job = work_queue.get(block=True);
 
@@ -115,100 +483,233 @@ def worker_func(worker_ctx, work_queue, result_queue, binary_checksum_result_cac
             logger.debug("Exiting");
             return;
 
-        flags, state_variation = job;
+        job_iteration, variation, mode = job;
+        remeasure = mode == JOB_REMEASURE;
+
+        # The driver broadcasts a new configuration before handing out
+        # any jobs for it, so if we're behind, the update is waiting
+        # for us.
+        while iteration is None or iteration < job_iteration:
+            iteration, states = config_queue.get(block=True);
+
+        # ...and if we're ahead, the job belongs to an iteration that
+        # the driver has already moved on from: don't bother. (Probes
+        # set every flag, so they don't depend on the iteration.)
+        if iteration > job_iteration and mode != JOB_PROBE:
+            logger.debug("Skipping stale job for iteration {}".format(job_iteration));
+            result_queue.put((job_iteration, variation, mode, None, None, None, True), block=False);
+            continue;
+
+        flags = create_cmd_from_states(base_opt, flag_values,
+                                       apply_variation(states, variation));
         flags_str = " ".join(flags)
 
-        if state_variation is None:
-            logger.debug("Got job with state variation (<None>), flags \"{}\""\
-                  .format(flags_str));
-        else:
-            logger.debug("Got job with state variation ({}, {}), flags \"{}\""\
-                  .format(state_variation[0], state_variation[1], flags_str));
+        logger.debug("Got job with state variation ({}), flags \"{}\""\
+                     .format(", ".join(["{}, {}".format(flag_idx, state) for flag_idx, state in variation])
+                             if len(variation) > 0 else "<None>",
+                             flags_str));
+
+        # If we're resuming a run that already tried these exact
+        # flags, take its word for it.
+        if flags_str in replayed_results and mode == JOB_BENCHMARK:
+            score, error = replayed_results[flags_str] or (None, None);
+            logger.debug("Replaying result {} (+/- {}) for flags \"{}\"".format(score, error, flags_str));
+
+            result = (iteration, variation, mode, score, error, None, False);
+            result_queue.put(result, block=False);
+            continue;
+
+        # If an earlier run already built these exact flags, and we
+        # know the score of the binary it got, there's nothing to do.
+        if result_cache is not None and not remeasure:
+            checksum = result_cache.get_checksum(flags);
+
+            if checksum is not None and (mode == JOB_COMPILE or mode == JOB_PROBE):
+                logger.debug("Hit persistent cache checksum \"{}\" for flags \"{}\""\
+                             .format(checksum, flags_str));
+
+                result_queue.put((iteration, variation, mode, None, None, checksum, False), block=False);
+                continue;
+
+            if checksum is not None and mode == JOB_BENCHMARK:
+                cached = lookup_cached_score(checksum, binary_checksum_result_cache, result_cache);
+
+                if cached is not None:
+                    score, error = cached;
+                    logger.debug("Hit persistent cache result \"{}\" for flags \"{}\"! Re-using result {}"\
+                                 .format(checksum, flags_str, score));
+
+                    result = (iteration, variation, mode, score, error, checksum, False);
+                    result_queue.put(result, block=False);
+                    continue;
+
+        fingerprint = None;
+        if driver is not None and not remeasure:
+            if hasattr(worker_ctx, "get_effective_flags"):
+                fingerprint = driver.get_fingerprint(worker_ctx.get_effective_flags(flags));
+            else:
+                fingerprint = driver.get_fingerprint(flags);
+
+        if fingerprint is not None:
+            checksum = lookup_fingerprint_checksum(fingerprint, binary_checksum_result_cache, result_cache);
+
+            # The checksum is all we need for the jobs that only build,
+            # but the others need a score for it, too.
+            cached = None;
+            if checksum is not None:
+                if mode == JOB_COMPILE or mode == JOB_PROBE:
+                    cached = (None, None);
+                elif mode == JOB_CHEAP:
+                    cached = binary_checksum_result_cache.get((JOB_CHEAP, checksum));
+                else:
+                    cached = lookup_cached_score(checksum, binary_checksum_result_cache, result_cache);
+
+            if cached is not None:
+                score, error = cached;
+                logger.debug("Hit fingerprint \"{}\" for flags \"{}\"! Re-using checksum \"{}\""\
+                             .format(fingerprint, flags_str, checksum));
+
+                if result_cache is not None:
+                    result_cache.put_checksum(flags, checksum);
+
+                result = (iteration, variation, mode, score, error, checksum, False);
+                result_queue.put(result, block=False);
+                continue;
+
+        # We only need a token of the --jobserver while we build.
+        if jobserver is not None:
+            jobserver.acquire();
+
+        try:
+            compile_result = worker_ctx.compile(flags);
+        finally:
+            if jobserver is not None:
+                jobserver.release();
 
-        compile_result = worker_ctx.compile(flags);
         if compile_result.ok:
             logger.debug("Successfully compiled with flags \"{}\"".format(flags_str));
             checksum = compile_result.checksum;
 
+            if result_cache is not None:
+                result_cache.put_checksum(flags, checksum);
+
+            if fingerprint is not None:
+                binary_checksum_result_cache[("fingerprint", fingerprint)] = checksum;
+
+                if result_cache is not None:
+                    result_cache.put_fingerprint_checksum(fingerprint, checksum);
+
         else:
-            logger.warning("Failed to compile with flags \"{}\"".format(flags_str));
+            # Probes are expected to fail, that's what they're for.
+            if mode == JOB_PROBE:
+                logger.debug("Failed to compile with flags \"{}\"".format(flags_str));
+            else:
+                logger.warning("Failed to compile with flags \"{}\"".format(flags_str));
+
             # Can't benchmark what we can't build: return.
-            result_queue.put((flags, state_variation, None), block=False);
+            result_queue.put((iteration, variation, mode, None, None, None, False), block=False);
+            continue;
+
+        if mode == JOB_COMPILE or mode == JOB_PROBE:
+            result_queue.put((iteration, variation, mode, None, None, checksum, False), block=False);
+            continue;
+
+        if mode == JOB_CHEAP:
+            cached = binary_checksum_result_cache.get((JOB_CHEAP, checksum));
+
+            if cached is None:
+                cached = score_and_error(worker_ctx.benchmark_cheap());
+
+                if cached[0] is not None:
+                    binary_checksum_result_cache[(JOB_CHEAP, checksum)] = cached;
+                else:
+                    logger.warning("Failed to run cheap benchmark with flags \"{}\"".format(flags_str));
+
+            score, error = cached;
+            result_queue.put((iteration, variation, mode, score, error, checksum, False), block=False);
             continue;
 
-        if checksum in binary_checksum_result_cache:
-            score = binary_checksum_result_cache[checksum];
+        cached = None;
+        if not remeasure:
+            cached = lookup_cached_score(checksum, binary_checksum_result_cache, result_cache);
+
+        if cached is not None:
+            score, error = cached;
             logger.debug("Hit cache result \"{}\"! Re-using result {}"\
                          .format(checksum, score));
 
-            result = (flags, state_variation, score);
+            result = (iteration, variation, mode, score, error, checksum, False);
             result_queue.put(result, block=False);
             continue;
 
-        score = worker_ctx.benchmark();
+        measurement = worker_ctx.benchmark();
+        score, error = score_and_error(measurement);
         if score is not None:
             logger.debug("Successful benchmark, got score {} with flags \"{}\""\
-                         .format(str(score), flags_str));
-            binary_checksum_result_cache[checksum] = score;
+                         .format(str(measurement), flags_str));
+            binary_checksum_result_cache[checksum] = (score, error);
+
+            if result_cache is not None:
+                result_cache.put_score(checksum, score, error);
 
         else:
             logger.warning("Failed to benchmark with flags \"{}\"".format(flags_str));
 
-        result = (flags, state_variation, score);
+        result = (iteration, variation, mode, score, error, checksum, False);
         result_queue.put(result, block=False);
 
-def create_cmd_from_flaglist(config):
-    return [config.base_opt] + [str(flag) for flag in config.flags if flag.state != 0];
+# Return `(n_iterations, filename)` of the last `iteration.N.config`
+# written to `run_directory`, or `None` if there isn't one.
+def find_last_iteration_config(run_directory):
+    config_re = re.compile(r"^iteration\.([0-9]+)\.config$");
+    last = None;
 
-class Config:
-    def __init__(self, base_opt, flags):
-        self.base_opt = base_opt;
-        self.flags = flags;
+    for filename in os.listdir(run_directory):
+        mo = config_re.match(filename);
+        if not mo:
+            continue;
+
+        n_iterations = int(mo.group(1));
+        if last is None or n_iterations > last[0]:
+            last = (n_iterations, os.path.join(run_directory, filename));
 
-    class JSONDecoder(json.JSONDecoder):
-        def __init__(self, *args, **kwargs):
-            json.JSONDecoder.__init__(self, object_hook=self.object_hook, *args, **kwargs)
+    return last;
 
-        def object_hook(self, dct):
-            if "base_opt" in dct:
-                base_opt = dct["base_opt"];
+# Parse a line of a leaderboard into `(flags, score, error)`. Lines
+# are "flags,score,error", but older leaderboards have no error, in
+# which case it is 0. Raises `ValueError` for a malformed line.
+def parse_leaderboard_line(line):
+    fields = line.rsplit(",", 2);
 
-                flags = [];
-                for dct_flag in dct["flags"]:
-                    flag = Flag(dct_flag["name"], dct_flag["flags"]);
-                    flag.state = dct_flag["state"];
-                    flag.n_states = dct_flag["n_states"];
-                    flag.exclusions = set(dct_flag["exclusions"]);
-                    flags.append(flag);
+    if len(fields) == 3:
+        try:
+            return (fields[0], float(fields[1]), float(fields[2]));
+        except ValueError:
+            pass;
 
-                config = Config(base_opt, flags);
-                return config;
+    flags, score = line.rsplit(",", 1);
+    return (flags, float(score), 0.0);
+
+# Read a `global_leaderboard.live` file back into a dictionary mapping
+# command lines to `(score, error)`. Failures (recorded as "inf") map
+# to `None`.
+def load_leaderboard_from_filename(filename):
+    results = {};
 
-            else:
-                return dct;
-
-    class JSONEncoder(json.JSONEncoder):
-        def default(self, obj):
-            if isinstance(obj, Config):
-                return {
-                    "base_opt": obj.base_opt,
-                    "flags": [
-                        {
-                            'name': flag.name,
-                            'flags': flag.values,
-                            'state': flag.state,
-                            'n_states': flag.n_states,
-                            'exclusions': list(flag.exclusions)
-                        } for flag in obj.flags
-                    ]
-                };
-
-            # Let the base class default method raise the TypeError
-            return json.JSONEncoder.default(self, obj)
-
-def load_config_from_filename(filename):
     with open(filename, "r") as file:
-        return json.loads(file.read(), cls=Config.JSONDecoder);
+        for line in file:
+            line = line.strip();
+
+            try:
+                flags, score, error = parse_leaderboard_line(line);
+            except ValueError:
+                # Most likely the last line, cut short by whatever
+                # interrupted the run.
+                continue;
+
+            results[flags] = (score, error) if score != float('inf') else None;
+
+    return results;
 
 def create_run_directory(simpletuner_directory):
     random_suffix = "".join(
@@ -244,6 +745,294 @@ def create_workspace_directory():
 
     return simpletuner_directory;
 
+# Return the directory that the worker directories of `run_directory`
+# go in with --workspace-tmpfs.
+def get_tmpfs_run_directory(tmpfs_directory, run_directory):
+    return os.path.join(tmpfs_directory, "simpletuner-" + os.path.basename(run_directory));
+
+# Create the directory of worker `idx` in `run_directory`. With
+# `tmpfs_directory`, the directory really lives in there, and
+# `run_directory` only holds a symbolic link to it, so that the run
+# directory looks the same either way.
+def create_worker_directory(run_directory, idx, tmpfs_directory=None):
+    worker_workspace = os.path.join(run_directory, str(idx));
+
+    # A link left over from a run whose tmpfs has since been cleared
+    # (e.g. by a reboot): set it up again where it was.
+    if os.path.islink(worker_workspace):
+        os.makedirs(os.readlink(worker_workspace), exist_ok=True);
+        return worker_workspace;
+
+    if tmpfs_directory is None:
+        os.mkdir(worker_workspace);
+        return worker_workspace;
+
+    tmpfs_workspace = os.path.join(get_tmpfs_run_directory(tmpfs_directory, run_directory), str(idx));
+    os.makedirs(tmpfs_workspace);
+    os.symlink(tmpfs_workspace, worker_workspace);
+
+    return worker_workspace;
+
+# Remove the worker directories of `run_directory` that are links to
+# a tmpfs, along with what they link to. This goes by the links rather
+# than --workspace-tmpfs, which a --resume may not have been given
+# again.
+def remove_tmpfs_worker_directories(run_directory):
+    tmpfs_run_directories = set();
+
+    for filename in os.listdir(run_directory):
+        worker_workspace = os.path.join(run_directory, filename);
+        if not filename.isdigit() or not os.path.islink(worker_workspace):
+            continue;
+
+        tmpfs_workspace = os.readlink(worker_workspace);
+        shutil.rmtree(tmpfs_workspace, ignore_errors=True);
+        os.remove(worker_workspace);
+
+        tmpfs_run_directories.add(os.path.dirname(tmpfs_workspace));
+
+    # ...and the directories they were in, once they're empty.
+    for tmpfs_run_directory in tmpfs_run_directories:
+        try:
+            os.rmdir(tmpfs_run_directory);
+        except OSError:
+            pass;
+
+# Return the number of bytes that the files under `path` take up,
+# counting files with several hard links once.
+def get_directory_size(path):
+    size = 0;
+    inodes = set();
+
+    for root, dirs, files in os.walk(path):
+        for file in files:
+            stat = os.lstat(os.path.join(root, file));
+
+            if stat.st_ino in inodes:
+                continue;
+
+            inodes.add(stat.st_ino);
+            size += stat.st_blocks * 512;
+
+    return size;
+
+def get_free_space(path):
+    stat = os.statvfs(path);
+    return stat.f_bavail * stat.f_frsize;
+
+def write_leaderboard_entry(file, flags, score, error=0.0):
+    # FIXME: This should trigger some kind of assertion failure.
+    if score is None:
+        score = float('inf');
+
+    if error is None:
+        error = 0.0;
+
+    print("{},{},{}".format(" ".join(flags), score, error), file=file);
+    file.flush();
+
+### Phase 1: Flag discovery
+# Before we go and run the "real" search routine, first we find out
+# what each flag does individually, what impact it has, and if it works
+# at all.
+#
+# What the compiler accepts is kept in `cache_directory`, if given (see
+# `GCCDriver`), so later runs against the same compiler don't have to
+# check the same flags again.
+def discover_flags(path_cc, path_config, n_workers, cache_directory=None):
+    logger = logging.getLogger("SimpleTuner-Driver");
+
+    config = load_config_from_filename(path_config);
+
+    # Trim flags (useful for debug)
+    # all_cc_flags = all_cc_flags[-20:-1];
+
+    driver = GCCDriver(path_cc, cache_directory=cache_directory);
+
+    config = check_cc_flags(driver, config, n_workers);
+    driver.save();
+
+    # Now, all_cc_flags may have excluded flags (because they
+    # miscompiled.) It is not impossible that some flags had every
+    # state excluded, and such flags we should simply remove from
+    # consideration.
+    config.flags = list(filter(
+        lambda cc_flag: cc_flag.n_states > len(cc_flag.exclusions),
+        config.flags)
+    );
+
+    # Calculate how many flag values we had in the beginning, and how many we have now.
+    len_all_cc_flags_before = sum([flag.n_states for flag in config.flags]);
+    len_all_cc_flags_after = sum([flag.n_states - len(flag.exclusions) for flag in config.flags]);
+
+    logger.info("flags before excluding broken flags: {} entries.".format(len_all_cc_flags_before));
+    logger.info("flags after excluding broken flags: {} entries.".format(len_all_cc_flags_after));
+
+    # Fixup the flag initial state. We want to pick state 0 as much as
+    # possible, but if that became an excluded state after being tested, then we need to update it.
+    for flag in config.flags:
+        flag.state = flag.valid_states()[0];
+
+    return config;
+
+# The driver's end of the workers. Hands out the jobs that a search
+# (`GroupTesting`, or one of the strategies in strategy/) proposes,
+# broadcasts each new configuration to the workers before any of its
+# jobs, and feeds the results back to the search, recording every
+# score in the live global leaderboard along the way.
+#
+# With a `conflicts` table (see conflicts.py), every configuration that
+# fails to build is handed to it to minimise, on whichever workers the
+# search leaves idle, and jobs that contain a known conflict fail
+# straight away instead of being built. Failures replayed from
+# `replayed_results` (see `load_leaderboard_from_filename`) aren't
+# handed to it: they may have failed to benchmark rather than build.
+class WorkerPool:
+    def __init__(self, n_workers, base_opt, flag_values, work_queue, config_queues,
+                 result_queue, f_live_global_leaderboard, conflicts=None, replayed_results=None):
+        self.logger = logging.getLogger("SimpleTuner-Driver");
+
+        self.n_workers = n_workers;
+        self.base_opt = base_opt;
+        self.flag_values = flag_values;
+        self.work_queue = work_queue;
+        self.config_queues = config_queues;
+        self.result_queue = result_queue;
+        self.f_live_global_leaderboard = f_live_global_leaderboard;
+        self.conflicts = conflicts;
+        self.replayed_results = replayed_results if replayed_results is not None else {};
+
+        # Number of jobs that have been handed to the work queue but whose
+        # result we haven't picked up yet. We never hand out more jobs than
+        # we have workers, so that a promotion in --streaming mode doesn't
+        # leave a backlog of stale jobs sitting in the queue.
+        self.n_in_flight = 0;
+
+        # The rendered flags of each iteration's configuration, as
+        # broadcast to the workers. We need these to turn results back
+        # into command lines.
+        self.iteration_parts = {};
+        self.iteration_states = {};
+
+        # Results of jobs that contain a known conflict, which the
+        # search gets without them ever being built.
+        self.known_failures = collections.deque();
+
+        # Number of flag combinations scored, and of jobs that were
+        # never built because of a known conflict.
+        self.n_tests = 0;
+        self.n_conflicts_skipped = 0;
+
+    def broadcast(self, iteration, states):
+        self.iteration_parts[iteration] = create_cmd_parts(self.flag_values, states);
+        self.iteration_states[iteration] = states;
+
+        for config_queue in self.config_queues:
+            config_queue.put((iteration, states), block=False);
+
+    def run(self, search):
+        while not search.done:
+            if search.n_iterations not in self.iteration_parts:
+                self.broadcast(search.n_iterations, search.config.get_states());
+
+            for job in search.propose(self.n_workers - self.n_in_flight):
+                if self.skip_known_conflict(job):
+                    continue;
+
+                self.work_queue.put(job, block=False);
+                self.n_in_flight += 1;
+
+            if self.conflicts is not None:
+                self.propose_probes(search.n_iterations);
+
+            if len(self.known_failures) > 0:
+                search.observe(*self.known_failures.popleft());
+                continue;
+
+            if self.n_in_flight == 0:
+                self.logger.fatal("{} has nothing left to run, but isn't done: This is a bug."\
+                                  .format(type(search).__name__));
+                sys.exit(1);
+
+            result = self.get_result();
+            if result is not None:
+                search.observe(*result);
+
+        # Whatever the search didn't get to is of no use to the next one.
+        self.known_failures.clear();
+
+    # If `job` contains a known conflict, queue up its failure for the
+    # search, and return `True`.
+    def skip_known_conflict(self, job):
+        if self.conflicts is None:
+            return False;
+
+        iteration, variation, mode = job;
+
+        conflict = self.conflicts.find(apply_variation(self.iteration_states[iteration], variation));
+        if conflict is None:
+            return False;
+
+        self.logger.debug("Not building state variation ({}): it contains \"{}\", which doesn't build"\
+                          .format(", ".join(["{}, {}".format(flag_idx, state) for flag_idx, state in variation]),
+                                  self.conflicts.describe(conflict)));
+
+        self.n_conflicts_skipped += 1;
+        self.known_failures.append((iteration, variation, mode, None, None, None));
+        return True;
+
+    # Hand out the builds the conflict table wants to whichever workers
+    # are left. Each is a variation that sets every flag, so that it
+    # builds the same configuration whatever the iteration.
+    def propose_probes(self, iteration):
+        for probe in self.conflicts.propose(self.n_workers - self.n_in_flight):
+            variation = tuple(enumerate(probe));
+
+            self.work_queue.put((iteration, variation, JOB_PROBE), block=False);
+            self.n_in_flight += 1;
+
+    # Return the next result as `(iteration, variation, mode, score,
+    # error, checksum)`, or `None` if the worker skipped the job, or it
+    # was one of the conflict table's.
+    def get_result(self):
+        iteration, variation, mode, score, error, checksum, skipped = self.result_queue.get(block=True);
+        self.n_in_flight -= 1;
+
+        if mode == JOB_PROBE:
+            self.conflicts.observe([state for flag_idx, state in variation],
+                                   None if skipped else checksum is not None);
+            return None;
+
+        if skipped:
+            return None;
+
+        job_flags = create_cmd_from_parts(self.base_opt, self.flag_values,
+                                          self.iteration_parts[iteration], variation);
+
+        # A job that didn't build has no checksum, nor a score. Neither
+        # has a replayed one (see `worker_func`).
+        replayed = mode == JOB_BENCHMARK and " ".join(job_flags) in self.replayed_results;
+
+        if self.conflicts is not None and checksum is None and score is None and not replayed:
+            self.conflicts.add_failure(apply_variation(self.iteration_states[iteration], variation));
+
+        # Only real scores are worth recording, and replayed ones are
+        # in the leaderboard already.
+        if mode == JOB_BENCHMARK or mode == JOB_REMEASURE:
+            self.n_tests += 1;
+
+            if not replayed:
+                write_leaderboard_entry(self.f_live_global_leaderboard, job_flags, score, error);
+
+        return (iteration, variation, mode, score, error, checksum);
+
+    # Results of an iteration that was decided early may still be in
+    # flight. They're of no use to the search any more, but they are
+    # still valid measurements, so record them.
+    def drain(self):
+        while self.n_in_flight > 0:
+            self.get_result();
+
 def work():
     global args;
 
@@ -258,8 +1047,17 @@ def work():
     # Create the main './workspace/' directory, if it doesn't exist already.
     simpletuner_directory = create_workspace_directory();
 
-    # Create a unique run directory
-    run_directory = create_run_directory(simpletuner_directory);
+    # Create a unique run directory, unless we're picking up where an
+    # earlier one left off.
+    if args.resume is not None:
+        run_directory = os.path.realpath(args.resume);
+
+        if not os.path.isdir(run_directory):
+            logging.error("Can't resume: Run directory \"{}\" does not exist"\
+                          .format(run_directory));
+            sys.exit(1);
+    else:
+        run_directory = create_run_directory(simpletuner_directory);
 
     # Create logging formatter separately, to then apply to each stream handler as they're created:
     # https://stackoverflow.com/a/11582124
@@ -274,7 +1072,7 @@ def work():
     logging.root.setLevel(logging.NOTSET);
     logger = logging.getLogger("SimpleTuner-Driver")
 
-    if args.path_config is None:
+    if args.path_config is None and args.resume is None:
         logger.error("You must provide a config file to use for combined elimination. Please generate one, or use a pre-generated one from the config/ directory. Aborting.");
         exit(1);
 
@@ -302,6 +1100,16 @@ def work():
     else:
         logger.info("Will be using the WorkerContext class \"{}\"".format(worker_context_classname));
 
+    # The search strategy class that we will be using
+    strategy_module = importlib.import_module("{}.{}".format("strategy", args.strategy));
+    SearchStrategy = getattr(strategy_module, args.strategy, None);
+
+    if SearchStrategy is None or not hasattr(SearchStrategy, "from_args"):
+        logger.error("Unknown search strategy: \"{}\"".format(args.strategy));
+        sys.exit(1);
+    else:
+        logger.info("Will be using the search strategy \"{}\"".format(args.strategy));
+
     if args.benchmark is None:
         logger.error("You must provide a benchmark to use via the --benchmark flag. Aborting.");
         logger.error("Valid --benchmark arguments: " + ", ".join(
@@ -318,8 +1126,6 @@ def work():
     else:
         logger.info("Will be using the benchmark \"{}\"".format(args.benchmark));
 
-    n_tests = 0;
-
     if args.processes is not None:
         n_core_count = args.processes;
     else:
@@ -327,6 +1133,21 @@ def work():
 
     logger.info("Running with {} processes".format(n_core_count));
 
+    # Workers that build in parallel get an even share of the cores (see
+    # `common.get_make_jobs`).
+    n_core_budget = args.core_budget if args.core_budget is not None else mp.cpu_count();
+    os.environ["SIMPLETUNER_MAKE_JOBS"] = str(max(1, n_core_budget // n_core_count));
+
+    # ...or, with --jobserver, the cores of whichever workers are idle
+    # (see jobserver.py). Every worker needs a token to build at all.
+    jobserver = None;
+    if args.jobserver:
+        jobserver = JobServer(max(n_core_budget, n_core_count));
+        os.environ["MAKEFLAGS"] = jobserver.get_makeflags();
+        logger.info("Sharing a make jobserver of {} jobs between the workers".format(jobserver.n_tokens));
+    else:
+        clear_inherited_jobserver();
+
     # Global leaderboard to record _all_ results
     global_leaderboard = [];
 
@@ -337,41 +1158,47 @@ def work():
     # The current best result on the leaderboard
     best_flagpath = None;
 
-    ### Phase 1: Flag discovery
-    # Before we go and run the "real" search routine, first we find
-    # out what each flag does individually, what impact it has, and if
-    # it works at all.
-    flags = [];
+    # What we find out about the compiler is kept across runs (see
+    # `GCCDriver`).
+    path_compiler_cache = None;
+    if not args.no_cache:
+        path_compiler_cache = os.path.join(simpletuner_directory, "compilers");
 
-    config = load_config_from_filename(args.path_config);
+    # Results recorded by the run we're resuming, if any.
+    replayed_results = {};
+    first_iteration = 0;
 
-    # Trim flags (useful for debug)
-    # all_cc_flags = all_cc_flags[-20:-1];
+    if args.resume is not None:
+        last_iteration = find_last_iteration_config(run_directory);
 
-    driver = GCCDriver(args.path_cc);
+        # A run that was interrupted during its first iteration starts
+        # over from the config it started with.
+        path_initial_config = os.path.join(run_directory, "initial.config");
+        if last_iteration is None and os.path.isfile(path_initial_config):
+            last_iteration = (0, path_initial_config);
 
-    config = check_cc_flags(driver, config);
+        if last_iteration is None:
+            logger.error("Can't resume: \"{}\" doesn't contain any iteration.N.config files"\
+                         .format(run_directory));
+            sys.exit(1);
 
-    # Now, all_cc_flags may have excluded flags (because they
-    # miscompiled.) It is not impossible that some flags had every
-    # state excluded, and such flags we should simply remove from
-    # consideration.
-    config.flags = list(filter(
-        lambda cc_flag: cc_flag.n_states > len(cc_flag.exclusions),
-        config.flags)
-    );
+        first_iteration, path_iteration_config = last_iteration;
+        logger.info("Resuming from \"{}\"".format(path_iteration_config));
 
-    # Calculate how many flag values we had in the beginning, and how many we have now.
-    len_all_cc_flags_before = sum([flag.n_states for flag in config.flags]);
-    len_all_cc_flags_after = sum([flag.n_states - len(flag.exclusions) for flag in config.flags]);
+        # The config was written out after testing the flags and
+        # fixing up their states, so it can be used as-is.
+        config = load_config_from_filename(path_iteration_config);
 
-    logger.info("flags before excluding broken flags: {} entries.".format(len_all_cc_flags_before));
-    logger.info("flags after excluding broken flags: {} entries.".format(len_all_cc_flags_after));
+        path_live_global_leaderboard = os.path.join(run_directory, "global_leaderboard.live");
+        if os.path.isfile(path_live_global_leaderboard):
+            replayed_results = load_leaderboard_from_filename(path_live_global_leaderboard);
 
-    # Fixup the flag initial state. We want to pick state 0 as much as
-    # possible, but if that became an excluded state after being tested, then we need to update it.
-    for flag in config.flags:
-        flag.state = flag.valid_states()[0];
+        logger.info("Replaying {} results from \"{}\""\
+                    .format(len(replayed_results), path_live_global_leaderboard));
+
+    else:
+        config = discover_flags(args.path_cc, args.path_config, n_core_count,
+                                cache_directory=path_compiler_cache);
 
     # flags = config.flags;
 
@@ -392,13 +1219,41 @@ def work():
     # workspace_file_stderr = open(os.path.join(run_directory, "stderr.log"), "w");
     # print("workspace_file_stderr: {}".format(workspace_file_stderr));
 
-    # Create worker directories, and then the workers themselves.
+    # Worker contexts set up from a tarball extract it only once, into
+    # a template shared by all workers and runs (see template.py).
+    os.environ["SIMPLETUNER_TEMPLATE_DIRECTORY"] = os.path.join(simpletuner_directory, "templates");
+
+    # Worker contexts build translation units through a shared object
+    # cache (see `common.get_object_cache`), unless told otherwise.
+    if not args.no_cache and "SIMPLETUNER_OBJECT_CACHE" not in os.environ:
+        os.environ["SIMPLETUNER_OBJECT_CACHE"] = os.path.join(simpletuner_directory, "objects");
+
+    if "SIMPLETUNER_OBJECT_CACHE" in os.environ:
+        logger.info("Using object cache \"{}\"".format(os.environ["SIMPLETUNER_OBJECT_CACHE"]));
+        ObjectCache(os.environ["SIMPLETUNER_OBJECT_CACHE"], args.path_cc).evict(args.cache_size);
+
+    if args.workspace_tmpfs is not None:
+        if not os.path.isdir(args.workspace_tmpfs):
+            logger.error("--workspace-tmpfs: \"{}\" is not a directory".format(args.workspace_tmpfs));
+            sys.exit(1);
+
+        logger.info("Putting worker directories in \"{}\", which has {:.1f} MiB free"\
+                    .format(get_tmpfs_run_directory(args.workspace_tmpfs, run_directory),
+                            get_free_space(args.workspace_tmpfs) / 2**20));
+
+    # Create worker directories, and then the workers themselves. When
+    # resuming, the directories of the original run are reused.
     worker_ctxs = [];
+    resuming_workspaces = [];
     for idx in range(n_core_count):
         worker_workspace = os.path.join(run_directory, str(idx));
 
-        os.mkdir(worker_workspace);
+        resuming_workspace = args.resume is not None and os.path.isdir(worker_workspace);
+        if not resuming_workspace:
+            create_worker_directory(run_directory, idx, args.workspace_tmpfs);
+
         worker_ctxs.append(WorkerContext(idx, worker_workspace, args.path_cc, args.benchmark));
+        resuming_workspaces.append(resuming_workspace);
 
     # Create shared dictionary mapping checksums to run times. This
     # avoids having to run binaries for which the result didn't
@@ -406,20 +1261,64 @@ def work():
     manager = mp.Manager();
     binary_checksum_result_cache = manager.dict();
 
+    # ...and the same across runs, for the same compiler, worker context
+    # and benchmark.
+    if args.no_cache:
+        result_cache = None;
+    else:
+        path_cache = args.cache_file;
+        if path_cache is None:
+            path_cache = os.path.join(simpletuner_directory, "cache.sqlite3");
+
+        logger.info("Using result cache \"{}\"".format(path_cache));
+
+        result_cache = ResultCache(path_cache, get_compiler_identity(args.path_cc),
+                                   worker_context_classname, args.benchmark,
+                                   max_entries=args.cache_size);
+        result_cache.evict();
+        result_cache.close();
+
+    # Skip building flags that make no difference to the compiler (see
+    # `worker_func`).
+    canonicaliser = None;
+    if args.canonicalise_flags:
+        canonicaliser = GCCDriver(args.path_cc, cache_directory=path_compiler_cache);
+
+        # Ask for what every fingerprint needs before the workers get
+        # their copies, so that they don't all have to. Only this
+        # process saves the compiler cache.
+        canonicaliser.get_listed_options();
+        canonicaliser.save();
+
     work_queue = mp.Queue();
     result_queue = mp.Queue();
+    config_queues = [mp.Queue() for _ in worker_ctxs];
+
+    flag_values = config.get_flag_values();
 
     logger.debug("Creating {} worker processes".format(n_core_count));
     workers = [mp.Process(target=worker_func,
-                          args=(worker_ctx, work_queue, result_queue, binary_checksum_result_cache))
-               for worker_ctx in worker_ctxs];
+                          args=(worker_ctx, config.base_opt, flag_values,
+                                work_queue, config_queue, result_queue,
+                                binary_checksum_result_cache, result_cache,
+                                replayed_results, jobserver, canonicaliser))
+               for worker_ctx, config_queue in zip(worker_ctxs, config_queues)];
     logger.debug("Done creating {} worker processes".format(n_core_count));
 
     logger.debug("Initializing {} worker contexts".format(n_core_count));
 
-    init_workspaces_ok = [];
-    for worker_ctx in worker_ctxs:
-        init_workspaces_ok.append(worker_ctx.init_workspace());
+    # Worker contexts that can pick up an existing workspace implement
+    # `resume_workspace`. Everything else gets set up from scratch. The
+    # workspaces are set up in parallel: that's mostly waiting for tar
+    # and cp (see template.py).
+    def init_worker_ctx(worker_ctx, resuming_workspace):
+        if resuming_workspace and hasattr(worker_ctx, "resume_workspace"):
+            return worker_ctx.resume_workspace();
+
+        return worker_ctx.init_workspace();
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_core_count) as executor:
+        init_workspaces_ok = list(executor.map(init_worker_ctx, worker_ctxs, resuming_workspaces));
 
     if any([not ok for ok in init_workspaces_ok]):
         logger.error("Atleast one workspace failed to initialize its workspace directory, aborting");
@@ -427,11 +1326,41 @@ def work():
 
     logger.debug("Done initializing {} worker contexts".format(n_core_count));
 
+    # Workspaces grow as they build, and a full tmpfs fails every build
+    # from then on, so keep an eye on the space.
+    if args.workspace_tmpfs is not None:
+        used = sum([get_directory_size(worker_ctx.workspace) for worker_ctx in worker_ctxs]);
+        free = get_free_space(args.workspace_tmpfs);
+
+        logger.info("Worker directories take up {:.1f} MiB of \"{}\", {:.1f} MiB left"\
+                    .format(used / 2**20, args.workspace_tmpfs, free / 2**20));
+
+        if free < used:
+            logger.warning("--workspace-tmpfs: \"{}\" has less space left than the worker"
+                           " directories already take up. Builds may run out of space."\
+                           .format(args.workspace_tmpfs));
+
     # If the user called us with "--setup-workspace-only", we are
     # done.
     if args.setup_workspace_only:
         sys.exit(0);
 
+    # Now that there are workspaces, weed out the flags that break on
+    # the worker context's own sources. A run we're resuming did that
+    # already.
+    if args.resume is None and not args.no_source_check \
+       and hasattr(WorkerContext, "get_validation_sources"):
+        driver = GCCDriver(args.path_cc, cache_directory=path_compiler_cache);
+
+        config = check_cc_flags_on_sources(driver, config, worker_ctxs[0].get_validation_sources(),
+                                           n_core_count);
+        driver.save();
+
+    # Keep the config we start from, for a --resume of a run that is
+    # interrupted before it finishes its first iteration.
+    if args.resume is None:
+        write_config(os.path.join(run_directory, "initial.config"), config);
+
     for idx, worker in enumerate(workers):
         logger.debug("Starting Worker #{}".format(idx));
         worker.start();
@@ -439,149 +1368,47 @@ def work():
     logger.debug("Started {} workers".format(n_core_count));
 
     f_live_global_leaderboard = open(
-        os.path.join(run_directory, "global_leaderboard.live"), "w");
-
-    n_iterations = 0;
+        os.path.join(run_directory, "global_leaderboard.live"),
+        "a" if args.resume is not None else "w");
+
+    if args.halving_fraction is not None and not hasattr(WorkerContext, "benchmark_cheap"):
+        logger.warning("Worker context \"{}\" has no cheap benchmark: Ignoring --halving-fraction"\
+                       .format(worker_context_classname));
+        args.halving_fraction = None;
+
+    # Learn which combinations of flags don't build, and stop building
+    # them (see conflicts.py).
+    conflicts = None;
+    if not args.no_conflicts:
+        conflicts = ConflictTable(config.get_states(), flag_values,
+                                  path=os.path.join(run_directory, "conflicts"),
+                                  valid_states=[flag.valid_states() for flag in config.flags]);
+
+    pool = WorkerPool(n_core_count, config.base_opt, flag_values,
+                      work_queue, config_queues, result_queue,
+                      f_live_global_leaderboard, conflicts=conflicts,
+                      replayed_results=replayed_results);
+
+    # Sort out which state variations make no difference at all before
+    # the search has to go through them one by one.
+    noops = None;
+
+    if args.group_testing:
+        group_testing = GroupTesting(config, run_directory, args.group_size,
+                                     first_iteration=first_iteration);
+        pool.run(group_testing);
+
+        noops = group_testing.noops;
+
+    search = SearchStrategy.from_args(config, run_directory, args,
+                                      first_iteration=first_iteration,
+                                      noops=noops);
 
     ### Enter main loop:
-    while True:
-        logger.info("Running iteration {}".format(n_iterations));
-
-        # First, get the baseline for the current flag configuration
-        work_queue.put((create_cmd_from_flaglist(config), None), block=False);
-        result = result_queue.get(block=True);
-
-        _, _, score = result;
-
-        if score is None:
-            logger.fatal("Failed to get baseline: This is unrecoverable. It may be the case that there's one or two flags causing the failure.");
-            sys.exit(1);
-
-        baseline_config = config;
-        baseline = score;
-
-        # Instantiate all the jobs we're working on
-        state_variation_and_scores = [];
-        n_jobs = 0;
-
-        for flag_idx, flag in enumerate(config.flags):
-            for other_state in flag.other_states():
-                state_variation = (flag_idx, other_state)
-                state_variation_and_scores.append((state_variation, None));
-
-                state_variation_config = copy.deepcopy(config);
-                state_variation_config.flags[flag_idx].state = other_state;
-
-                work_queue.put((create_cmd_from_flaglist(state_variation_config),
-                                state_variation),
-                               block=False);
-                n_jobs += 1;
-
-        # It may be the case that we've reached the end of
-        # state_variations (all have been excluded but one). In which
-        # case we are done.
-        if n_jobs == 0:
-            logger.info("Did not find any state variations to test: We are done.");
-            break;
-
-        # Wait for the results
-        while n_jobs > 0:
-            result = result_queue.get(block=True);
-            n_jobs -= 1;
-
-            job_flags, state_variation, score = result;
+    pool.run(search);
+    pool.drain();
 
-            # FIXME: This should trigger some kind of assertion failure.
-            if score is None:
-                score = float('inf');
-
-            flag_idx, other_state = state_variation;
-
-            # Save to file
-            print("{},{}".format(" ".join(job_flags), score),
-                  file=f_live_global_leaderboard);
-            f_live_global_leaderboard.flush();
-
-            # print("state_variation_and_scores: {}".format(state_variation_and_scores));
-            # print("looking for: {}, {}".format(flag_idx, other_state));
-
-            idxes = [i for i, e in enumerate(state_variation_and_scores) if e[0][0] == flag_idx and e[0][1] == other_state];
-            # debug("idxes: {}".format(idxes));
-
-            state_variation_and_scores[idxes[0]] = (state_variation, score);
-
-        # Now sort the list, with best state variation at the top and
-        # worst the worst at the bottom.
-        state_variation_and_scores.sort(key=lambda e: e[1]);
-
-        # Write out to file for debugging
-        with open(os.path.join(run_directory, "iteration.{}".format(n_iterations)), "w") as file:
-            print("current flags: {}".format(" ".join(create_cmd_from_flaglist(baseline_config))), file=file);
-            print("baseline: {}".format(baseline), file=file);
-
-            print("State variations:", file=file);
-
-            for state_variation, score in state_variation_and_scores:
-                flag_idx, state = state_variation;
-                print("{},{}".format(config.flags[flag_idx].values[state], score), file=file);
-
-        # Also write out the baseline flags to a separate file for ease of use
-        with open(os.path.join(run_directory, "iteration.{}.flags".format(n_iterations)), "w") as file:
-            print(" ".join(create_cmd_from_flaglist(baseline_config)), file=file);
-
-        with open(os.path.join(run_directory, "iteration.{}.config".format(n_iterations)), "w") as file:
-            print(json.dumps(obj=baseline_config, indent=4, cls=Config.JSONEncoder), file=file);
-
-        # Now, we can do something to the baseline set of flags with
-        # this information.
-
-        # ...If noone beat the baseline, then actually we don't have any more work to do.
-
-        have_better_than_baseline_p = False;
-        for state_variation, score in state_variation_and_scores:
-            if score < baseline:
-                have_better_than_baseline_p = True;
-                break;
-
-        if not have_better_than_baseline_p:
-            logger.info("Iteration {}: No state variable variation managed to beat the current baseline of {}: Exiting."\
-                        .format(n_iterations, baseline));
-            break;
-
-        # Exclude some flags from the worst states.
-        MAX_EXCLUSIONS = 3;
-        to_exclude = min(MAX_EXCLUSIONS, len(state_variation_and_scores));
-
-        for state_variation, score in state_variation_and_scores[-to_exclude:]:
-            flag_idx, other_state = state_variation;
-            config.flags[flag_idx].exclusions = config.flags[flag_idx].exclusions.union({other_state});
-
-        # Promote some flags to the best states.
-        MAX_PROMOTIONS = 1;
-        to_promote = min(MAX_PROMOTIONS, len(state_variation_and_scores));
-        have_promoted = [];
-
-        for state_variation, score in state_variation_and_scores[0 : to_promote]:
-            flag_idx, other_state = state_variation;
-
-            # We don't want to re-promote a flag index that we've
-            # already promoted - that would be a de-motion!
-            if flag_idx in have_promoted:
-                continue;
-
-            # If we have fewer better scores than to_promote, exit early.
-            if baseline <= score:
-                break;
-
-            have_promoted.append(flag_idx);
-
-            # We don't want to go back to the old state... or do we?
-            current_state = config.flags[flag_idx].state;
-            config.flags[flag_idx].exclusions = config.flags[flag_idx].exclusions.union({current_state});
-            config.flags[flag_idx].state = other_state;
-
-        # Now that we've adjusted the current flag state, go to the next iteration.
-        n_iterations += 1;
+    n_tests = pool.n_tests;
 
     # If we're here, we broke out of the loop because we have no more
     # work to do. Close workers, close queues, and exit.
@@ -596,9 +1423,27 @@ def work():
     work_queue.close();
     result_queue.close()
 
+    for config_queue in config_queues:
+        config_queue.close();
+
+    # What's left in the worker directories is of no more use, and
+    # it's taking up memory.
+    remove_tmpfs_worker_directories(run_directory);
+
+    if args.workspace_tmpfs is not None:
+        shutil.rmtree(get_tmpfs_run_directory(args.workspace_tmpfs, run_directory), ignore_errors=True);
+
+    if result_cache is not None:
+        result_cache.evict();
+        result_cache.close();
+
     logger.info("All done, tested {} flag combinations."\
                 .format(n_tests));
 
+    if conflicts is not None and len(conflicts) > 0:
+        logger.info("Learned {} combinations of flags that don't build, and skipped building {} jobs for them."\
+                    .format(len(conflicts), pool.n_conflicts_skipped));
+
     f_final_global_leaderboard = open(
         os.path.join(run_directory, "global_leaderboard.final"), "w");
 
@@ -621,6 +1466,9 @@ def test_worker_context():
     wc.size();
 
 def main():
+    global args;
+    args = parser.parse_args();
+
     work();
 
 if __name__ == "__main__":
@@ -0,0 +1,565 @@
+#!/usr/bin/env python3
+
+# Combined Elimination search strategy
+
+# This file is part of SimpleTuner
+
+# Copyright (C) 2021-2023 Embecosm <www.embecosm.com>
+# Contributor Maxim Blinov <maxim.blinov@embecosm.com>
+
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os, sys;
+import math;
+import logging;
+import collections;
+
+from common import JOB_BENCHMARK;
+from common import JOB_REMEASURE;
+from common import JOB_CHEAP;
+from config import create_cmd_from_flaglist;
+from config import get_flag_stem;
+from config import write_iteration_config;
+from results import IterationResults;
+from measurement import significantly_better;
+from surrogate import SurrogateModel;
+
+# Combined Elimination, driven one result at a time.
+#
+# The driver asks for jobs with `propose()` whenever it has free
+# workers, and hands every result back through `observe()`. Jobs are
+# tagged with the iteration they belong to, so that results for a
+# configuration that has since been promoted away from are simply
+# discarded.
+#
+# Without `streaming`, an iteration is only decided once every state
+# variation has been scored, as in the classic algorithm. With
+# `streaming`, the iteration is decided as soon as `streaming_quorum`
+# of the variations have come back and at least one of them beats the
+# baseline: the remaining variations of that iteration are dropped and
+# variations of the new configuration are handed out straight away, so
+# the workers never drain.
+#
+# Each iteration promotes up to `max_promotions` improving variations
+# of distinct flags. Flags can interfere with each other, so when more
+# than one is up for promotion, the combination (and successive halves
+# of it, best variations first) is scored before anything is promoted,
+# and the best scoring of those, or failing that the best single
+# variation, wins.
+#
+# Scores can come with an error (see measurement.py), in which case a
+# variation has to beat the baseline by more than the noise in both to
+# be promoted.
+#
+# Only the very first iteration measures its baseline. After that, the
+# new configuration is exactly the variation (or combination) that was
+# promoted, so its score and binary checksum become the next baseline,
+# unless `verify_baseline_every` asks for a periodic re-measurement.
+#
+# With `halving_fraction`, every state variation is first screened
+# with the worker context's cheap benchmark, and only that fraction of
+# them, best cheap scores first, gets the real benchmark.
+#
+# With `surrogate`, the state variations of an iteration are handed
+# out in the order that a model trained on earlier iterations (see
+# surrogate.py) expects to do best, and with `surrogate_top_k`, only
+# the top K of them, plus a `surrogate_explore` share of the rest
+# picked at random, are tested.
+#
+# Many state variations don't change the binary at all. With
+# `dormant_after`, a state variation that builds the same binary as the
+# baseline in that many consecutive iterations goes dormant: it is
+# left out of later iterations, except for a re-probe every
+# `reprobe_dormant_every` iterations, and it wakes up again as soon as
+# a related flag (see `get_flag_stem`) is promoted or a re-probe finds
+# that it does make a difference after all. State variations can also
+# start out `dormant`, e.g. when `GroupTesting` found them to be no-ops.
+#
+# A variation is a tuple of `(flag_idx, state)` pairs to apply on top
+# of the current configuration. The baseline is the empty variation.
+class CombinedElimination:
+    def __init__(self, config, run_directory, streaming=False, streaming_quorum=1.0,
+                 verify_baseline_every=None, max_promotions=1, max_exclusions=3,
+                 first_iteration=0, dormant_after=None, reprobe_dormant_every=5,
+                 dormant=None, halving_fraction=None, surrogate=False,
+                 surrogate_top_k=None, surrogate_explore=0.05):
+        self.logger = logging.getLogger("CombinedElimination");
+
+        self.config = config;
+        self.run_directory = run_directory;
+        self.streaming = streaming;
+        self.streaming_quorum = streaming_quorum;
+        self.verify_baseline_every = verify_baseline_every;
+        self.max_promotions = max_promotions;
+        self.max_exclusions = max_exclusions;
+        self.dormant_after = dormant_after;
+        self.reprobe_dormant_every = reprobe_dormant_every;
+        self.halving_fraction = halving_fraction;
+        self.surrogate_top_k = surrogate_top_k;
+        self.surrogate_explore = surrogate_explore;
+
+        self.surrogate = None;
+        if surrogate or surrogate_top_k is not None:
+            self.surrogate = SurrogateModel();
+
+        # state_variation -> number of consecutive iterations in which
+        # it built the same binary as the baseline
+        self.identical_streaks = {};
+
+        # state_variation -> iteration in which it went dormant
+        self.dormant = dict(dormant) if dormant is not None else {};
+
+        self.flag_stems = [get_flag_stem(flag) for flag in config.flags];
+
+        self.baseline = None;
+        self.baseline_error = 0.0;
+        self.baseline_checksum = None;
+
+        # Set when the next iteration should test every state variation,
+        # dormant or not, however unpromising.
+        self.test_everything = False;
+
+        self.n_iterations = first_iteration;
+        self.done = False;
+
+        self.start_iteration();
+
+    # Create the search from simpletuner.py's command line arguments.
+    # The no-ops that group testing found start out dormant, as if they
+    # had gone dormant just before the first iteration.
+    @staticmethod
+    def from_args(config, run_directory, args, first_iteration=0, noops=None):
+        dormant = None;
+        if noops is not None:
+            dormant = dict([(state_variation, first_iteration - 1)
+                            for state_variation in noops]);
+
+        return CombinedElimination(config, run_directory,
+                                   streaming=args.streaming,
+                                   streaming_quorum=args.streaming_quorum,
+                                   verify_baseline_every=args.verify_baseline_every,
+                                   max_promotions=args.max_promotions,
+                                   max_exclusions=args.max_exclusions,
+                                   first_iteration=first_iteration,
+                                   dormant_after=args.dormant_after,
+                                   reprobe_dormant_every=args.reprobe_dormant_every,
+                                   dormant=dormant,
+                                   halving_fraction=args.halving_fraction,
+                                   surrogate=args.surrogate,
+                                   surrogate_top_k=args.surrogate_top_k,
+                                   surrogate_explore=args.surrogate_explore);
+
+    def start_iteration(self):
+        self.logger.info("Running iteration {}".format(self.n_iterations));
+
+        self.results = IterationResults();
+        self.cheap_results = IterationResults();
+        self.pending = collections.deque();
+
+        # Set while we're scoring combinations of promotion candidates.
+        self.candidates = None;
+        self.combinations = None;
+
+        # We only need to measure the baseline if we didn't carry one
+        # over from the previous iteration, or if it's time to verify
+        # it. If we do, it goes out first, but unlike the state
+        # variations nothing waits on it before they are dispatched.
+        self.remeasure_baseline = self.baseline is not None;
+
+        if self.verify_baseline_every is not None and self.n_iterations > 0 \
+           and self.n_iterations % self.verify_baseline_every == 0:
+            self.logger.info("Iteration {}: Re-measuring baseline".format(self.n_iterations));
+            self.baseline = None;
+
+        if self.baseline is None:
+            self.pending.append(());
+
+        n_dormant = 0;
+        n_reprobed = 0;
+
+        state_variations = [];
+
+        # State variations that we're not testing this iteration: dormant
+        # ones that aren't due for a re-probe, and ones that the surrogate
+        # model doesn't think are worth it.
+        left_out = [];
+
+        for flag_idx, flag in enumerate(self.config.flags):
+            for other_state in flag.other_states():
+                state_variation = (flag_idx, other_state);
+
+                if state_variation in self.dormant:
+                    n_dormant += 1;
+
+                    if (self.n_iterations - self.dormant[state_variation]) \
+                       % self.reprobe_dormant_every != 0:
+                        left_out.append(state_variation);
+                        continue;
+
+                    n_reprobed += 1;
+
+                state_variations.append(state_variation);
+
+        # If nothing is left to test but dormant state variations, or
+        # the last iteration came up empty without them, give them all
+        # one last look before giving up.
+        test_everything = len(state_variations) == 0 or self.test_everything;
+        self.test_everything = False;
+
+        if test_everything:
+            state_variations += left_out;
+            n_reprobed += len(left_out);
+            left_out = [];
+
+        if n_dormant > 0:
+            self.logger.info("Iteration {}: {} state variations are dormant, re-probing {} of them"\
+                             .format(self.n_iterations, n_dormant, n_reprobed));
+
+        # Most promising state variations first. That is what gets
+        # handed out first, and in --streaming mode, what the iteration
+        # is most likely decided on.
+        if self.surrogate is not None and len(self.surrogate) > 0:
+            if self.surrogate_top_k is not None and not test_everything:
+                n_state_variations = len(state_variations);
+
+                state_variations, rest = self.surrogate.select(state_variations,
+                                                               self.surrogate_top_k,
+                                                               self.surrogate_explore);
+                left_out += rest;
+
+                self.logger.info("Iteration {}: Testing the {} most promising of {} state variations, and {} more at random"\
+                                 .format(self.n_iterations, min(self.surrogate_top_k, n_state_variations),
+                                         n_state_variations,
+                                         max(0, len(state_variations) - self.surrogate_top_k)));
+            else:
+                state_variations = self.surrogate.rank(state_variations);
+
+        self.pending.extend([(state_variation,) for state_variation in state_variations]);
+
+        self.n_variations = len(state_variations);
+        self.n_left_out = len(left_out);
+
+        # Set while the state variations are being screened with the
+        # cheap benchmark.
+        self.screening = self.halving_fraction is not None and self.n_variations > 1;
+
+        # It may be the case that we've reached the end of
+        # state_variations (all have been excluded but one). In which case
+        # we are done.
+        if self.n_variations == 0:
+            self.logger.info("Did not find any state variations to test: We are done.");
+            self.done = True;
+
+    # Return up to `n_free` jobs of the form
+    # `(iteration, variation, mode)`.
+    def propose(self, n_free):
+        jobs = [];
+
+        while len(jobs) < n_free and len(self.pending) > 0:
+            variation = self.pending.popleft();
+
+            if len(variation) == 0 and self.remeasure_baseline:
+                mode = JOB_REMEASURE;
+            elif len(variation) > 0 and self.screening:
+                mode = JOB_CHEAP;
+            else:
+                mode = JOB_BENCHMARK;
+
+            jobs.append((self.n_iterations, variation, mode));
+
+        return jobs;
+
+    def observe(self, iteration, variation, mode, score, error, checksum):
+        if self.done or iteration != self.n_iterations:
+            self.logger.debug("Discarding result for iteration {}, we are at iteration {}"\
+                              .format(iteration, self.n_iterations));
+            return;
+
+        # FIXME: This should trigger some kind of assertion failure.
+        if score is None and len(variation) > 0:
+            score = float('inf');
+            error = 0.0;
+
+        if mode == JOB_CHEAP:
+            self.cheap_results.record(variation[0], score, checksum, error);
+
+            if len(self.cheap_results) == self.n_variations:
+                self.finish_screening();
+
+            return;
+
+        if self.combinations is not None:
+            # In --streaming mode, single variations of this iteration
+            # may still be trickling in. It's too late for them.
+            if variation not in self.combinations:
+                return;
+
+            self.combinations[variation] = (score, error, checksum);
+
+            if all([e is not None for e in self.combinations.values()]):
+                self.finish_combinations();
+
+            return;
+
+        if len(variation) == 0:
+            if score is None:
+                self.logger.fatal("Failed to get baseline: This is unrecoverable. It may be the case that there's one or two flags causing the failure.");
+                sys.exit(1);
+
+            if self.remeasure_baseline:
+                self.logger.info("Iteration {}: Re-measured baseline: {}"\
+                                 .format(self.n_iterations, score));
+
+            self.baseline = score;
+            self.baseline_error = error;
+            self.baseline_checksum = checksum;
+
+        else:
+            self.results.record(variation[0], score, checksum, error);
+
+        if self.ready():
+            self.finish_iteration();
+
+    def ready(self):
+        if self.baseline is None or self.screening:
+            return False;
+
+        n_results = len(self.results);
+
+        if n_results == self.n_variations:
+            return True;
+
+        if not self.streaming:
+            return False;
+
+        # Only cut an iteration short if we actually have something to
+        # promote. Otherwise, keep waiting: the variation that beats
+        # the baseline may still be in flight.
+        return n_results >= self.streaming_quorum * self.n_variations \
+            and self.beats_baseline(self.results.best_score, self.results.best_error);
+
+    # Return `True` if `score` (+/- `error`) is an improvement on the
+    # baseline that isn't just down to noise. Exact scores only need to
+    # be lower.
+    def beats_baseline(self, score, error):
+        return significantly_better(score, error, self.baseline, self.baseline_error);
+
+    # Successive halving: now that every state variation has a cheap
+    # score, hand the `halving_fraction` most promising of them out for
+    # the real benchmark.
+    def finish_screening(self):
+        self.screening = False;
+
+        ranked = self.cheap_results.sorted();
+
+        # Whatever failed to build or run won't do any better with the
+        # real benchmark, but it still counts as a result: these are
+        # the first state variations to get excluded.
+        n_failed = 0;
+        while len(ranked) > 0 and ranked[-1][1] == float('inf'):
+            state_variation, score = ranked.pop();
+            self.results.record(state_variation, score, None);
+            n_failed += 1;
+
+        n_selected = min(len(ranked), max(1, int(math.ceil(self.halving_fraction * len(ranked)))));
+
+        for state_variation, _ in ranked[:n_selected]:
+            self.pending.append((state_variation,));
+
+        self.n_variations = n_selected + n_failed;
+
+        self.logger.info("Iteration {}: Benchmarking the best {} of {} state variations by their cheap score"\
+                         .format(self.n_iterations, n_selected, len(ranked)));
+
+        if self.ready():
+            self.finish_iteration();
+
+    def finish_iteration(self):
+        baseline_config = self.config;
+        baseline = self.baseline;
+        config = self.config;
+        n_iterations = self.n_iterations;
+        results = self.results;
+
+        if len(results) < self.n_variations:
+            self.logger.info("Iteration {}: Deciding after {} of {} state variations"\
+                             .format(n_iterations, len(results), self.n_variations));
+
+        # Anything not yet handed out belongs to a configuration that
+        # is about to change.
+        self.pending.clear();
+
+        # Now sort the results, with best state variation at the top and
+        # worst the worst at the bottom.
+        state_variation_and_scores = results.sorted();
+
+        # Write out to file for debugging
+        with open(os.path.join(self.run_directory, "iteration.{}".format(n_iterations)), "w") as file:
+            print("current flags: {}".format(" ".join(create_cmd_from_flaglist(baseline_config))), file=file);
+            print("baseline: {}".format(baseline), file=file);
+
+            print("State variations:", file=file);
+
+            for state_variation, score in state_variation_and_scores:
+                flag_idx, state = state_variation;
+                print("{},{}".format(config.flags[flag_idx].values[state], score), file=file);
+
+            if len(self.cheap_results) > 0:
+                print("Cheap scores:", file=file);
+
+                for state_variation, score in self.cheap_results.sorted():
+                    flag_idx, state = state_variation;
+                    print("{},{}".format(config.flags[flag_idx].values[state], score), file=file);
+
+        # Also write out the baseline flags to a separate file for ease of use
+        write_iteration_config(self.run_directory, n_iterations, baseline_config);
+
+        if self.dormant_after is not None or len(self.dormant) > 0:
+            self.update_dormant();
+
+        if self.surrogate is not None:
+            for state_variation, score in results.scores.items():
+                self.surrogate.observe(state_variation, baseline, score);
+
+        # Now, we can do something to the baseline set of flags with
+        # this information.
+
+        # Pick the flags to promote to their best states. We don't want
+        # to promote two states of the same flag - one of them would
+        # be a de-motion! Nor do we want to promote noise.
+        candidates = [(state_variation, score)
+                      for state_variation, score in results.best_of_distinct_flags(self.max_promotions, baseline)
+                      if self.beats_baseline(score, results.get_error(state_variation))];
+
+        if len(candidates) == 0 and results.best_score < baseline:
+            self.logger.info("Iteration {}: Best score {} +/- {} is within the noise of the baseline of {} +/- {}"\
+                             .format(n_iterations, results.best_score, results.best_error,
+                                     baseline, self.baseline_error));
+
+        # ...If noone beat the baseline, then actually we don't have any more work to do,
+        # unless one of the state variations that we left out would have.
+        if len(candidates) == 0 and self.n_left_out > 0:
+            self.logger.info("Iteration {}: No state variable variation managed to beat the current baseline of {}: Testing the {} state variations that were left out."\
+                             .format(n_iterations, baseline, self.n_left_out));
+            self.test_everything = True;
+            self.n_iterations += 1;
+            self.start_iteration();
+            return;
+
+        if len(candidates) == 0:
+            self.logger.info("Iteration {}: No state variable variation managed to beat the current baseline of {}: Exiting."\
+                             .format(n_iterations, baseline));
+            self.done = True;
+            return;
+
+        # Exclude some flags from the worst states. Only states that
+        # actually do worse than the baseline, mind: with dormant
+        # variations out of the picture, the worst of the rest may
+        # well be an improvement.
+        for state_variation, score in results.worst(self.max_exclusions, baseline):
+            flag_idx, other_state = state_variation;
+            config.flags[flag_idx].exclusions = config.flags[flag_idx].exclusions.union({other_state});
+
+        best_state_variation, best_score = candidates[0];
+
+        if len(candidates) == 1:
+            self.promote((best_state_variation,), best_score,
+                         results.get_error(best_state_variation),
+                         results.get_checksum(best_state_variation));
+            return;
+
+        # The candidates each beat the baseline on their own, but that
+        # doesn't mean they do so together. Score the combination of
+        # all of them, and of successive halves of it, before deciding.
+        self.candidates = candidates;
+        self.combinations = {};
+
+        n_combined = len(candidates);
+        while n_combined > 1:
+            variation = tuple([e[0] for e in candidates[:n_combined]]);
+
+            self.combinations[variation] = None;
+            self.pending.append(variation);
+
+            n_combined //= 2;
+
+        self.logger.info("Iteration {}: Scoring {} combinations of the best {} state variations"\
+                         .format(n_iterations, len(self.combinations), len(candidates)));
+
+    # Track which state variations keep building the same binary as
+    # the baseline, and put them to sleep (or wake them up) accordingly.
+    def update_dormant(self):
+        if self.baseline_checksum is None:
+            return;
+
+        # When screening, every state variation got built for its cheap
+        # score, even if it didn't make it to the real benchmark.
+        checksums = dict(self.cheap_results.checksums);
+        checksums.update(self.results.checksums);
+
+        for state_variation, checksum in checksums.items():
+            if checksum is not None and checksum == self.baseline_checksum:
+                streak = self.identical_streaks.get(state_variation, 0) + 1;
+                self.identical_streaks[state_variation] = streak;
+
+                if self.dormant_after is not None and streak >= self.dormant_after \
+                   and state_variation not in self.dormant:
+                    self.dormant[state_variation] = self.n_iterations;
+
+            else:
+                self.identical_streaks.pop(state_variation, None);
+
+                if state_variation in self.dormant:
+                    self.logger.debug("Iteration {}: Waking up state variation {}, it changes the binary now"\
+                                      .format(self.n_iterations, state_variation));
+                    del self.dormant[state_variation];
+
+    def finish_combinations(self):
+        best_state_variation, best_score = self.candidates[0];
+
+        options = [((best_state_variation,), best_score,
+                    self.results.get_error(best_state_variation),
+                    self.results.get_checksum(best_state_variation))];
+
+        for variation, (score, error, checksum) in self.combinations.items():
+            options.append((variation, score, error, checksum));
+
+        # Best score first, and of equally good options, the one that
+        # promotes the most flags.
+        variation, score, error, checksum = min(options, key=lambda e: (e[1], -len(e[0])));
+
+        self.logger.info("Iteration {}: Promoting {} of {} state variations together, scoring {} (best single variation: {})"\
+                         .format(self.n_iterations, len(variation), len(self.candidates),
+                                 score, best_score));
+
+        self.promote(variation, score, error, checksum);
+
+    def promote(self, variation, score, error, checksum):
+        config = self.config;
+
+        for flag_idx, other_state in variation:
+            # We don't want to go back to the old state... or do we?
+            current_state = config.flags[flag_idx].state;
+            config.flags[flag_idx].exclusions = config.flags[flag_idx].exclusions.union({current_state});
+            config.flags[flag_idx].state = other_state;
+
+        # Promoting a flag may well change what its relatives do.
+        promoted_stems = set([self.flag_stems[flag_idx] for flag_idx, _ in variation]);
+
+        for state_variation in list(self.dormant.keys()):
+            if self.flag_stems[state_variation[0]] in promoted_stems:
+                del self.dormant[state_variation];
+                self.identical_streaks.pop(state_variation, None);
+
+        # The new configuration is exactly the one that `variation` was
+        # scored with, so there's no need to measure it again.
+        self.baseline = score;
+        self.baseline_error = error;
+        self.baseline_checksum = checksum;
+
+        self.logger.debug("Iteration {}: Carrying over baseline {} (checksum {})"\
+                          .format(self.n_iterations, self.baseline, self.baseline_checksum));
+
+        # Now that we've adjusted the current flag state, go to the next iteration.
+        self.n_iterations += 1;
+        self.start_iteration();
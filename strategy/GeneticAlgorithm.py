@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+
+# Genetic algorithm search strategy
+
+# This file is part of SimpleTuner
+
+# Copyright (C) 2021-2023 Embecosm <www.embecosm.com>
+# Contributor Maxim Blinov <maxim.blinov@embecosm.com>
+
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os;
+import copy;
+import random;
+import logging;
+import collections;
+
+from common import JOB_BENCHMARK;
+from config import create_cmd_from_states;
+from config import apply_variation;
+from config import write_iteration_config;
+from measurement import significantly_better;
+
+# A generational genetic algorithm over flag states, with
+# `--strategy GeneticAlgorithm`.
+#
+# An individual is a complete vector of flag states. Each generation
+# of `population` individuals is scored in parallel, and the next one
+# is bred from it: the `N_ELITE` best individuals carry over as they
+# are, and the rest are children of two parents, each the best of
+# `TOURNAMENT_SIZE` individuals picked at random, that take every flag
+# from either parent with equal probability, and then change each flag
+# to another of its valid states with probability
+# `MUTATIONS / number of flags`. The starting configuration is part of
+# the first generation, so the result is never worse than it.
+#
+# Combined Elimination moves its configuration from iteration to
+# iteration, but here the workers keep the starting configuration, and
+# an individual is handed out as the variation that turns that into
+# it. Each generation is an iteration. Individuals that have been
+# scored before aren't scored again, and ones that fail to build or run
+# score infinity.
+#
+# Scores are noisy, so a tournament contestant only beats the others
+# if it is significantly better than them, the elites are the
+# individuals whose scores are best even at the top of their error
+# bars, and the best configuration so far only changes for one that is
+# significantly better, as in Hill Climbing.
+#
+# State variations that group testing found to be no-ops are never
+# mutated to.
+class GeneticAlgorithm:
+    TOURNAMENT_SIZE = 3;
+    N_ELITE = 2;
+    MUTATIONS = 2.0;
+
+    def __init__(self, config, run_directory, population=32, generations=50,
+                 seed=0, first_iteration=0, noops=None):
+        self.logger = logging.getLogger("GeneticAlgorithm");
+
+        self.config = config;
+        self.run_directory = run_directory;
+        self.population_size = population;
+        self.random = random.Random(seed);
+
+        self.initial_states = tuple(config.get_states());
+        self.flag_values = config.get_flag_values();
+
+        noops = noops if noops is not None else set();
+
+        # flag_idx -> states it can be mutated to
+        self.mutations = [[state for state in flag.valid_states()
+                           if state == flag.state or (flag_idx, state) not in noops]
+                          for flag_idx, flag in enumerate(config.flags)];
+        self.mutation_rate = min(1.0, self.MUTATIONS / max(1, len(config.flags)));
+
+        # states -> (score, error) of every individual scored so far
+        self.scores = {};
+
+        self.best = self.initial_states;
+        self.best_score = float('inf');
+        self.best_error = 0.0;
+
+        # A --resume starts from the config written out at the end of
+        # generation `first_iteration`, so that generation is done, and
+        # the run only has whatever is left of its `generations`.
+        if os.path.isfile(os.path.join(run_directory, "iteration.{}.config".format(first_iteration))):
+            first_iteration += 1;
+
+        self.n_iterations = first_iteration;
+        self.last_iteration = generations;
+        self.done = False;
+
+        if self.n_iterations >= self.last_iteration:
+            self.logger.info("All {} generations are done already: Exiting.".format(generations));
+            self.done = True;
+            return;
+
+        self.population = [self.initial_states] \
+            + [self.mutate(self.initial_states) for i in range(population - 1)];
+
+        self.start_generation();
+
+    # Create the search from simpletuner.py's command line arguments.
+    @staticmethod
+    def from_args(config, run_directory, args, first_iteration=0, noops=None):
+        return GeneticAlgorithm(config, run_directory,
+                                population=args.population,
+                                generations=args.generations,
+                                seed=args.seed,
+                                first_iteration=first_iteration,
+                                noops=noops);
+
+    def start_generation(self):
+        self.logger.info("Running generation {}".format(self.n_iterations));
+
+        # Only score the individuals that we haven't seen before, once.
+        self.pending = collections.deque();
+        for individual in self.population:
+            if individual not in self.scores and individual not in self.pending:
+                self.pending.append(individual);
+
+        self.n_outstanding = len(self.pending);
+
+        if self.n_outstanding == 0:
+            self.finish_generation();
+
+    def propose(self, n_free):
+        jobs = [];
+
+        while len(jobs) < n_free and len(self.pending) > 0:
+            individual = self.pending.popleft();
+            jobs.append((self.n_iterations, self.to_variation(individual), JOB_BENCHMARK));
+
+        return jobs;
+
+    def observe(self, iteration, variation, mode, score, error, checksum):
+        if self.done or iteration != self.n_iterations:
+            self.logger.debug("Discarding result for generation {}, we are at generation {}"\
+                              .format(iteration, self.n_iterations));
+            return;
+
+        if score is None:
+            score = float('inf');
+            error = 0.0;
+
+        self.scores[tuple(apply_variation(self.initial_states, variation))] = (score, error);
+
+        self.n_outstanding -= 1;
+        if self.n_outstanding == 0:
+            self.finish_generation();
+
+    def finish_generation(self):
+        n_iterations = self.n_iterations;
+
+        # Rank by the top of the error bars, so that an individual that
+        # only looks good because of noise doesn't make it as an elite.
+        ranked = sorted(self.population, key=lambda individual: sum(self.scores[individual]));
+
+        score, error = self.scores[ranked[0]];
+        if significantly_better(score, error, self.best_score, self.best_error):
+            self.best = ranked[0];
+            self.best_score = score;
+            self.best_error = error;
+
+        self.logger.info("Generation {}: Best score {} (best so far {})"\
+                         .format(n_iterations, score, self.best_score));
+
+        # Write out to file for debugging
+        with open(os.path.join(self.run_directory, "iteration.{}".format(n_iterations)), "w") as file:
+            print("best so far: {}".format(self.best_score), file=file);
+
+            print("Population:", file=file);
+
+            for individual in ranked:
+                print("{},{},{}".format(" ".join(create_cmd_from_states(self.config.base_opt,
+                                                                        self.flag_values,
+                                                                        individual)),
+                                        *self.scores[individual]), file=file);
+
+        # Also write out the best flags so far to a separate file for
+        # ease of use, and for --resume to start from.
+        write_iteration_config(self.run_directory, n_iterations, self.config_with_states(self.best));
+
+        self.n_iterations += 1;
+
+        if self.n_iterations == self.last_iteration:
+            self.logger.info("Generation {}: Last generation done, best score {}: Exiting."\
+                             .format(n_iterations, self.best_score));
+            self.done = True;
+            return;
+
+        self.population = ranked[:self.N_ELITE] \
+            + [self.mutate(self.crossover(self.select(ranked), self.select(ranked)))
+               for i in range(self.population_size - min(self.N_ELITE, len(ranked)))];
+
+        self.start_generation();
+
+    # Tournament selection. The contestants are picked at random, so
+    # when none is significantly better than the others, the first one
+    # wins.
+    def select(self, population):
+        contestants = [self.random.choice(population) for i in range(self.TOURNAMENT_SIZE)];
+
+        winner = contestants[0];
+        for contestant in contestants[1:]:
+            score, error = self.scores[contestant];
+            if significantly_better(score, error, *self.scores[winner]):
+                winner = contestant;
+
+        return winner;
+
+    # Uniform crossover.
+    def crossover(self, x, y):
+        return tuple([x_state if self.random.random() < 0.5 else y_state
+                      for x_state, y_state in zip(x, y)]);
+
+    def mutate(self, individual):
+        individual = list(individual);
+
+        for flag_idx, states in enumerate(self.mutations):
+            if len(states) > 1 and self.random.random() < self.mutation_rate:
+                individual[flag_idx] = self.random.choice(
+                    [state for state in states if state != individual[flag_idx]]);
+
+        return tuple(individual);
+
+    def to_variation(self, individual):
+        return tuple([(flag_idx, state)
+                      for flag_idx, (state, initial_state) in enumerate(zip(individual, self.initial_states))
+                      if state != initial_state]);
+
+    def config_with_states(self, states):
+        config = copy.deepcopy(self.config);
+
+        for flag, state in zip(config.flags, states):
+            flag.state = state;
+
+        return config;
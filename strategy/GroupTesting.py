@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+# Group testing of state variations
+
+# This file is part of SimpleTuner
+
+# Copyright (C) 2021-2023 Embecosm <www.embecosm.com>
+# Contributor Maxim Blinov <maxim.blinov@embecosm.com>
+
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os, sys;
+import logging;
+import collections;
+
+from common import JOB_COMPILE;
+
+# Adaptive group testing of state variations, run before the search
+# strategy with `--group-testing`.
+#
+# Most state variations build exactly the same binary as the baseline,
+# and compiling each of them on its own just to find that out is most
+# of the work of an iteration. Instead, apply groups of up to
+# `group_size` variations (of distinct flags) at once, and compare the
+# binary with the baseline's. If it is the same, every variation in the
+# group is taken to be a no-op. If it isn't, or the group doesn't
+# build, split it in two and test each half again, down to single
+# variations, which are effective.
+#
+# Nothing is benchmarked: the jobs are compile only. The variations
+# found to be no-ops end up in `noops`, which the search strategy can
+# use to skip them (Combined Elimination starts them out as dormant).
+#
+# Variations that undo each other within a group make the group look
+# like a no-op. Dormant variations are re-probed regularly, which
+# catches those.
+class GroupTesting:
+    def __init__(self, config, run_directory, group_size, first_iteration=0):
+        self.logger = logging.getLogger("GroupTesting");
+
+        self.config = config;
+        self.run_directory = run_directory;
+        self.group_size = group_size;
+
+        # Group testing happens on the configuration that the first
+        # iteration starts from.
+        self.n_iterations = first_iteration;
+
+        self.baseline_checksum = None;
+
+        self.noops = set();
+        self.effective = set();
+
+        self.n_compiles = 0;
+
+        # Groups handed out or waiting to be, whose results we don't
+        # have yet. We need the baseline before anything else.
+        self.pending = collections.deque([()]);
+        self.n_outstanding = 1;
+
+        self.done = False;
+
+    # Split the state variations into groups of at most `group_size`,
+    # none of which vary the same flag twice.
+    def make_groups(self):
+        layers = [];
+
+        for flag_idx, flag in enumerate(self.config.flags):
+            for layer, other_state in enumerate(flag.other_states()):
+                if layer == len(layers):
+                    layers.append([]);
+
+                layers[layer].append((flag_idx, other_state));
+
+        groups = [];
+        for layer in layers:
+            for start in range(0, len(layer), self.group_size):
+                groups.append(tuple(layer[start:start + self.group_size]));
+
+        return groups;
+
+    def propose(self, n_free):
+        jobs = [];
+
+        while len(jobs) < n_free and len(self.pending) > 0:
+            jobs.append((self.n_iterations, self.pending.popleft(), JOB_COMPILE));
+
+        return jobs;
+
+    def observe(self, iteration, variation, mode, score, error, checksum):
+        self.n_outstanding -= 1;
+        self.n_compiles += 1;
+
+        if len(variation) == 0:
+            if checksum is None:
+                self.logger.fatal("Failed to build baseline: This is unrecoverable. It may be the case that there's one or two flags causing the failure.");
+                sys.exit(1);
+
+            self.baseline_checksum = checksum;
+
+            groups = self.make_groups();
+            self.pending.extend(groups);
+            self.n_outstanding += len(groups);
+
+            self.logger.info("Testing {} state variations in {} groups"\
+                             .format(sum([len(group) for group in groups]), len(groups)));
+
+        elif checksum is not None and checksum == self.baseline_checksum:
+            self.noops.update(variation);
+
+        elif len(variation) == 1:
+            self.effective.add(variation[0]);
+
+        else:
+            # Something in here makes a difference: bisect. The halves
+            # go first, so that groups are narrowed down one at a time.
+            half = len(variation) // 2;
+
+            self.pending.appendleft(variation[half:]);
+            self.pending.appendleft(variation[:half]);
+            self.n_outstanding += 2;
+
+        if self.n_outstanding == 0:
+            self.finish();
+
+    def finish(self):
+        self.logger.info("Classified {} state variations with {} compiles: {} no-ops, {} effective"\
+                         .format(len(self.noops) + len(self.effective), self.n_compiles,
+                                 len(self.noops), len(self.effective)));
+
+        # Write out to file for debugging
+        with open(os.path.join(self.run_directory, "group_testing"), "w") as file:
+            for label, state_variations in [("effective", self.effective), ("noop", self.noops)]:
+                for flag_idx, state in sorted(state_variations):
+                    print("{},{}".format(self.config.flags[flag_idx].values[state], label), file=file);
+
+        self.done = True;
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+# Hill climbing search strategy
+
+# This file is part of SimpleTuner
+
+# Copyright (C) 2021-2023 Embecosm <www.embecosm.com>
+# Contributor Maxim Blinov <maxim.blinov@embecosm.com>
+
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os, sys;
+import copy;
+import random;
+import logging;
+import collections;
+
+from common import JOB_BENCHMARK;
+from config import create_cmd_from_flaglist;
+from config import write_iteration_config;
+from measurement import significantly_better;
+
+# Stochastic hill climbing with random restarts, with
+# `--strategy HillClimbing`.
+#
+# Each step scores `neighbours` single flag changes of the current
+# configuration, picked at random from the ones not yet tried there,
+# and moves to the best of them if it beats the current configuration
+# by more than the noise in both. Unlike Combined Elimination, which
+# scores every state variation before it moves, this moves as soon as
+# a batch finds something better.
+#
+# Once every single flag change of the current configuration has been
+# tried without finding anything better, it is a local optimum. Up to
+# `restarts` times, the climb then starts again from the best
+# configuration so far with `PERTURBATION` random flag changes applied.
+# Each step is an iteration.
+#
+# State variations that group testing found to be no-ops are never
+# tried.
+class HillClimbing:
+    PERTURBATION = 4;
+
+    def __init__(self, config, run_directory, neighbours=16, restarts=5,
+                 seed=0, first_iteration=0, noops=None):
+        self.logger = logging.getLogger("HillClimbing");
+
+        self.config = config;
+        self.run_directory = run_directory;
+        self.neighbours = neighbours;
+        self.restarts = restarts;
+        self.random = random.Random(seed);
+
+        self.noops = set(noops) if noops is not None else set();
+
+        # Score of the current configuration, once it has been measured.
+        self.current_score = None;
+        self.current_error = 0.0;
+
+        # Single flag changes already tried on the current configuration
+        self.tried = set();
+
+        self.best = None;
+        self.best_score = float('inf');
+
+        self.n_restarts = 0;
+
+        self.n_iterations = first_iteration;
+        self.done = False;
+
+        self.start_step();
+
+    # Create the search from simpletuner.py's command line arguments.
+    @staticmethod
+    def from_args(config, run_directory, args, first_iteration=0, noops=None):
+        return HillClimbing(config, run_directory,
+                            neighbours=args.neighbours,
+                            restarts=args.restarts,
+                            seed=args.seed,
+                            first_iteration=first_iteration,
+                            noops=noops);
+
+    # Return every single flag change of the current configuration.
+    def moves(self):
+        return [(flag_idx, other_state)
+                for flag_idx, flag in enumerate(self.config.flags)
+                for other_state in flag.other_states()
+                if (flag_idx, other_state) not in self.noops];
+
+    def start_step(self):
+        self.logger.info("Running step {}".format(self.n_iterations));
+
+        self.results = {};
+        self.pending = collections.deque();
+
+        # The current configuration is only measured when we get to it
+        # by a restart. Otherwise, we already scored it as a neighbour.
+        if self.current_score is None:
+            self.pending.append(());
+
+        untried = [move for move in self.moves() if move not in self.tried];
+        for move in self.random.sample(untried, min(self.neighbours, len(untried))):
+            self.pending.append((move,));
+
+        self.n_outstanding = len(self.pending);
+
+        if self.n_outstanding == 0:
+            self.finish_step();
+
+    def propose(self, n_free):
+        jobs = [];
+
+        while len(jobs) < n_free and len(self.pending) > 0:
+            jobs.append((self.n_iterations, self.pending.popleft(), JOB_BENCHMARK));
+
+        return jobs;
+
+    def observe(self, iteration, variation, mode, score, error, checksum):
+        if self.done or iteration != self.n_iterations:
+            self.logger.debug("Discarding result for step {}, we are at step {}"\
+                              .format(iteration, self.n_iterations));
+            return;
+
+        if score is None:
+            score = float('inf');
+            error = 0.0;
+
+        if len(variation) == 0:
+            if self.best is None and score == float('inf'):
+                self.logger.fatal("Failed to get baseline: This is unrecoverable. It may be the case that there's one or two flags causing the failure.");
+                sys.exit(1);
+
+            self.current_score = score;
+            self.current_error = error;
+        else:
+            self.results[variation[0]] = (score, error);
+            self.tried.add(variation[0]);
+
+        self.n_outstanding -= 1;
+        if self.n_outstanding == 0:
+            self.finish_step();
+
+    def finish_step(self):
+        n_iterations = self.n_iterations;
+
+        # Write out to file for debugging
+        with open(os.path.join(self.run_directory, "iteration.{}".format(n_iterations)), "w") as file:
+            print("current flags: {}".format(" ".join(create_cmd_from_flaglist(self.config))), file=file);
+            print("current score: {}".format(self.current_score), file=file);
+
+            print("State variations:", file=file);
+
+            for (flag_idx, state), (score, error) in sorted(self.results.items(), key=lambda e: e[1][0]):
+                print("{},{}".format(self.config.flags[flag_idx].values[state], score), file=file);
+
+        moved = False;
+
+        if len(self.results) > 0:
+            move, (score, error) = min(self.results.items(), key=lambda e: e[1][0]);
+
+            if significantly_better(score, error, self.current_score, self.current_error):
+                flag_idx, state = move;
+
+                self.logger.info("Step {}: Moving to {} ({} -> {})"\
+                                 .format(n_iterations, self.config.flags[flag_idx].values[state],
+                                         self.current_score, score));
+
+                self.config.flags[flag_idx].state = state;
+                self.current_score = score;
+                self.current_error = error;
+                self.tried = set();
+                moved = True;
+
+        if self.current_score < self.best_score:
+            self.best = self.config.get_states();
+            self.best_score = self.current_score;
+
+        # Also write out the best flags so far to a separate file for
+        # ease of use, and for --resume to start from.
+        write_iteration_config(self.run_directory, n_iterations, self.config_with_states(self.best));
+
+        self.n_iterations += 1;
+
+        if not moved and len(self.tried) < len(self.moves()):
+            self.start_step();
+            return;
+
+        if not moved:
+            if self.n_restarts == self.restarts:
+                self.logger.info("Step {}: Reached a local optimum of {}, best score {}: Exiting."\
+                                 .format(n_iterations, self.current_score, self.best_score));
+                self.done = True;
+                return;
+
+            self.n_restarts += 1;
+            self.restart();
+
+            self.logger.info("Step {}: Reached a local optimum of {}: Restart {} of {}, from {}"\
+                             .format(n_iterations, self.current_score, self.n_restarts, self.restarts,
+                                     " ".join(create_cmd_from_flaglist(self.config))));
+
+            self.current_score = None;
+            self.current_error = 0.0;
+            self.tried = set();
+
+        self.start_step();
+
+    # Go back to the best configuration so far, and make up to
+    # `PERTURBATION` random changes to flags.
+    def restart(self):
+        for flag, state in zip(self.config.flags, self.best):
+            flag.state = state;
+
+        moves = self.moves();
+        self.random.shuffle(moves);
+
+        perturbed = set();
+        for flag_idx, state in moves:
+            if len(perturbed) == self.PERTURBATION:
+                break;
+
+            if flag_idx in perturbed:
+                continue;
+
+            self.config.flags[flag_idx].state = state;
+            perturbed.add(flag_idx);
+
+    def config_with_states(self, states):
+        config = copy.deepcopy(self.config);
+
+        for flag, state in zip(config.flags, states):
+            flag.state = state;
+
+        return config;
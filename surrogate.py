@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+# Surrogate model of state variation effects
+
+# This file is part of SimpleTuner
+
+# Copyright (C) 2021-2023 Embecosm <www.embecosm.com>
+# Contributor Maxim Blinov <maxim.blinov@embecosm.com>
+
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import math;
+import random;
+
+# Predicts what a state variation will do to the score, from what it
+# did in earlier iterations.
+#
+# Every result Combined Elimination gets is the baseline with exactly
+# one state variation applied, so the model is a ridge regression of
+# the relative change in score, `(score - baseline) / baseline`, over
+# one-hot indicators of the state variations. Only one indicator is
+# ever set at a time, so the regression decomposes into one shrunken
+# mean per state variation:
+#
+#   prediction = sum of its relative changes / (number of them + `shrinkage`)
+#
+# which can be updated one result at a time, and pulls variations that
+# have only been seen once or twice towards "no effect". Variations
+# that have never been seen are predicted to have no effect at all.
+class SurrogateModel:
+    def __init__(self, shrinkage=1.0, seed=0):
+        self.shrinkage = shrinkage;
+
+        # state_variation -> sum of relative changes, and number of them
+        self.sums = {};
+        self.counts = {};
+
+        self.random = random.Random(seed);
+
+    def __len__(self):
+        return len(self.counts);
+
+    def observe(self, state_variation, baseline, score):
+        # Failures don't say anything about how well a variation does
+        # when it works.
+        if baseline is None or baseline == 0 or math.isinf(score) or math.isinf(baseline):
+            return;
+
+        delta = (score - baseline) / abs(baseline);
+
+        self.sums[state_variation] = self.sums.get(state_variation, 0.0) + delta;
+        self.counts[state_variation] = self.counts.get(state_variation, 0) + 1;
+
+    def predict(self, state_variation):
+        count = self.counts.get(state_variation);
+        if count is None:
+            return 0.0;
+
+        return self.sums[state_variation] / (count + self.shrinkage);
+
+    # Return `state_variations`, most promising first.
+    def rank(self, state_variations):
+        return sorted(state_variations, key=self.predict);
+
+    # Split `state_variations` into the ones worth testing and the rest.
+    # The ones worth testing are the `top_k` most promising, plus a
+    # random `explore` share of the rest, so that the model still gets
+    # to learn about variations it doesn't think much of.
+    def select(self, state_variations, top_k, explore):
+        ranked = self.rank(state_variations);
+
+        selected = ranked[:top_k];
+        rest = ranked[top_k:];
+
+        n_explore = min(len(rest), int(math.ceil(explore * len(rest))));
+        explored = set(self.random.sample(range(len(rest)), n_explore));
+
+        selected += [e for i, e in enumerate(rest) if i in explored];
+        rest = [e for i, e in enumerate(rest) if i not in explored];
+
+        return (selected, rest);
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+# Workspace templates
+
+# This file is part of SimpleTuner
+
+# Copyright (C) 2021-2023 Embecosm <www.embecosm.com>
+# Contributor Maxim Blinov <maxim.blinov@embecosm.com>
+
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os, shutil, fcntl, hashlib, subprocess;
+import logging;
+
+logger = logging.getLogger("WorkspaceTemplate");
+
+# Worker contexts that start out from a source tarball don't extract it
+# into every worker directory. Instead, `get_template` extracts it once
+# into a template directory, shared by all workers (and runs), and
+# `populate_workspace` fills each worker directory from that, which is
+# much cheaper than decompressing the tarball again.
+#
+# Templates live in SIMPLETUNER_TEMPLATE_DIRECTORY, which the driver
+# points at workspace/templates, and are keyed by the path, size and
+# modification time of the tarball. Delete them to free up the space.
+
+def get_template_directory(workspace):
+    if "SIMPLETUNER_TEMPLATE_DIRECTORY" in os.environ:
+        return os.environ["SIMPLETUNER_TEMPLATE_DIRECTORY"];
+
+    # Next to the worker directories, then.
+    return os.path.dirname(os.path.realpath(workspace));
+
+# Return the template directory with the contents of `tarball`,
+# extracting it if this is the first time anyone asked for it, or
+# `None` if it doesn't extract. Any number of workers can ask at once:
+# only one of them extracts it, and the rest wait for it.
+def get_template(tarball, workspace):
+    tarball = os.path.realpath(tarball);
+    stat = os.stat(tarball);
+
+    key = hashlib.sha256("{}:{}:{}".format(tarball, stat.st_size, stat.st_mtime_ns)\
+                         .encode("utf-8")).hexdigest();
+
+    template_directory = get_template_directory(workspace);
+    os.makedirs(template_directory, exist_ok=True);
+
+    template = os.path.join(template_directory, "template-" + key);
+
+    with open(template + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX);
+
+        if os.path.isdir(template):
+            return template;
+
+        logger.info("Extracting \"{}\" into template \"{}\"".format(tarball, template));
+
+        # Extract next to it first, so that a template that exists is
+        # always complete.
+        partial = template + ".partial";
+        shutil.rmtree(partial, ignore_errors=True);
+        os.mkdir(partial);
+
+        res = subprocess.Popen(["tar", "-xf", tarball, "--directory", partial],
+                               stdin=subprocess.DEVNULL,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE);
+
+        stdout, stderr = res.communicate();
+
+        if res.returncode != 0:
+            logger.error("Failed to extract \"{}\":".format(tarball));
+            logger.error(stderr.decode("utf-8").strip());
+            shutil.rmtree(partial, ignore_errors=True);
+            return None;
+
+        os.rename(partial, template);
+
+    return template;
+
+# Fill `workspace` with the contents of `template`. Return `True` on
+# success.
+#
+# Files are copied copy-on-write where the file system can (reflinks,
+# e.g. on btrfs or XFS), and copied in full otherwise. With `hardlink`,
+# they are hard links to the template instead, which takes no space at
+# all, but is only safe if nothing ever writes to those files in place:
+# a write would change the template, and every other worker's
+# workspace with it. That's the case for a source tree that is built
+# out of tree, for example.
+def populate_workspace(template, workspace, hardlink=False):
+    cmds = [];
+    if hardlink:
+        cmds.append(["cp", "-a", "-l"]);
+    cmds.append(["cp", "-a", "--reflink=auto"]);
+
+    for cmd in cmds:
+        res = subprocess.Popen(cmd + [os.path.join(template, "."), workspace],
+                               stdin=subprocess.DEVNULL,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE);
+
+        stdout, stderr = res.communicate();
+
+        if res.returncode == 0:
+            return True;
+
+        logger.warning("Failed to populate \"{}\" with \"{}\":".format(workspace, " ".join(cmd)));
+        logger.warning(stderr.decode("utf-8").strip());
+
+        # Don't copy over what hard links made it: that would write
+        # through them, into the template.
+        for entry in os.listdir(workspace):
+            path = os.path.join(workspace, entry);
+
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path);
+            else:
+                os.remove(path);
+
+    return False;